@@ -1,82 +1,344 @@
-import requests, os, json
-from utils.config import Config
+import os, json, re, time
+from threading import Event, Lock
+from utils.config_registry import ConfigRegistry
 from utils.loader import UserInfoLoader
+from api.http_pool import SessionPool
+from api.prompt import PromptAssembler
+from api.tokens import ContextBudgeter, estimate_tokens, messages_tokens
+from api.rate_limiter import RateLimiter
+from utils.metrics import UsageStats
+from api.errors import APIError, RequestCancelled, classify_error
+from api.retry import RetryPolicy, load_retry_config
+from api.router import EndpointRouter
 
 def load_api_config():
-    """加载 api.json 配置"""
-    api_file = Config.get_full_path(os.path.join("txt", "api.json"))
-    with open(api_file, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    """加载 api.json 配置（只读，文件未变化时直接使用缓存）"""
+    return ConfigRegistry.instance().load(os.path.join("txt", "api.json"))
 
-def send_api_request(api_url, api_key, data):
-    """发送API请求并统一处理错误"""
+class CancelToken:
+    """
+    请求取消令牌
+    
+    cancel() 可在任意线程调用：标记取消，并关闭正在读取的响应以中断连接，
+    流式生成时服务端会随之停止生成。收到响应头之前的等待无法中断，
+    但响应一到就会被丢弃，不会再读取内容。
+    """
+    
+    def __init__(self):
+        self._cancelled = Event()
+        self._lock = Lock()
+        self._response = None
+    
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+    
+    def cancel(self):
+        """取消请求"""
+        self._cancelled.set()
+        with self._lock:
+            response, self._response = self._response, None
+        if response is not None:
+            response.close()
+    
+    def wait(self, seconds):
+        """等待指定秒数，期间被取消时提前返回 True"""
+        return self._cancelled.wait(seconds)
+    
+    def check(self):
+        """已取消时抛出 RequestCancelled"""
+        if self.cancelled:
+            raise RequestCancelled()
+    
+    def attach(self, response):
+        """登记正在读取的响应，已取消时立即关闭"""
+        with self._lock:
+            self._response = response
+        if self.cancelled:
+            self.cancel()
+            raise RequestCancelled()
+    
+    def detach(self):
+        """响应读取完毕，取消登记"""
+        with self._lock:
+            self._response = None
+
+# 合并判断模式下的好感度标记，如 【好感度+2】；模型通常放在末尾，但之后也可能还有内容
+JUDGE_TRAILER_PATTERN = re.compile(r'\s*【好感度[+-]?\d+】')
+# 流式接收时可能是标记开头的未完成片段
+_PARTIAL_TRAILER_PATTERN = re.compile(r'^【(好(感(度([+-]?\d*)?)?)?)?$')
+
+class JudgeTrailerFilter:
+    """
+    流式接收时扣下回复中的好感度标记
+
+    完整的标记直接删去；从最后一个“【”开始、可能是标记开头的片段先暂存不转发，
+    确认不是标记后再补发，保证标记不会出现在气泡里。
+    """
+
+    def __init__(self, on_delta=None):
+        self.on_delta = on_delta
+        self.pending = ""
+
+    def feed(self, delta):
+        """接收一段流式内容"""
+        text = JUDGE_TRAILER_PATTERN.sub("", self.pending + delta)
+        index = text.rfind("【")
+        if index == -1 or not _PARTIAL_TRAILER_PATTERN.match(text[index:]):
+            index = len(text)
+        # 末尾的空白也先暂存，后面若是标记则与标记一起删去
+        index = len(text[:index].rstrip())
+        text, self.pending = text[:index], text[index:]
+        if text and self.on_delta:
+            self.on_delta(text)
+
+    def flush(self):
+        """流结束时补发暂存的片段（最终没有组成标记的部分）"""
+        if self.pending and self.on_delta:
+            self.on_delta(self.pending)
+        self.pending = ""
+
+def _read_event_stream(response, on_delta=None, cancel_token=None):
+    """
+    逐行解析 SSE 流式响应，每收到一段内容调用一次 on_delta
+    
+    Returns:
+        tuple: (完整内容, usage 段)，服务端没有返回用量时 usage 为 None
+    """
+    # text/event-stream 常不带 charset，requests 会按 ISO-8859-1 解码
+    response.encoding = "utf-8"
+    parts = []
+    usage = None
+    done = False
+    # 读到流末尾而不是在 [DONE] 处中断，连接才能归还连接池复用
+    for line in response.iter_lines(decode_unicode=True):
+        if cancel_token:
+            cancel_token.check()
+        # 空行分隔事件，冒号开头的是注释（如 keep-alive）
+        if done or not line.startswith("data:"):
+            continue
+        payload = line[5:].strip()
+        if payload == "[DONE]":
+            done = True
+            continue
+        chunk = json.loads(payload)
+        # 开启 include_usage 后，最后一个事件带有用量且 choices 为空
+        if chunk.get("usage"):
+            usage = chunk["usage"]
+        choices = chunk.get("choices") or []
+        if not choices:
+            continue
+        delta = (choices[0].get("delta") or {}).get("content")
+        if delta:
+            parts.append(delta)
+            if on_delta:
+                on_delta(delta)
+    return "".join(parts), usage
+
+def _post(api_url, headers, data, on_delta, cancel_token, time_left):
+    """
+    发出一次请求并读取回复内容，读取超时不超过本次调用剩余的时限 time_left
+    
+    取消导致的读取异常统一转换为 RequestCancelled，其余异常原样抛出。
+    
+    Returns:
+        tuple: (回复内容, usage 段)，服务端没有返回用量时 usage 为 None
+    """
+    stream = bool(data.get("stream"))
+    if stream and "stream_options" not in data:
+        # 让流式响应在末尾附带用量统计
+        data = {**data, "stream_options": {"include_usage": True}}
+    pool = SessionPool.instance()
+    try:
+        if cancel_token:
+            cancel_token.check()
+        # 可取消的请求总是按流读取响应体，取消时才能中途关闭连接
+        connect_timeout, read_timeout = pool.timeout
+        response = pool.get(api_url).post(
+            api_url, headers=headers, json=data,
+            timeout=(connect_timeout, max(1.0, min(read_timeout, time_left))),
+            stream=stream or cancel_token is not None
+        )
+        if cancel_token:
+            cancel_token.attach(response)
+        try:
+            response.raise_for_status()
+            if stream:
+                content, usage = _read_event_stream(response, on_delta, cancel_token)
+            else:
+                body = response.json()
+                content, usage = body["choices"][0]["message"]["content"], body.get("usage")
+            return content, usage
+        finally:
+            if cancel_token:
+                cancel_token.detach()
+            response.close()
+    except RequestCancelled:
+        raise
+    except Exception as e:
+        # 取消时关闭连接会让读取抛出各种网络异常
+        if cancel_token and cancel_token.cancelled:
+            raise RequestCancelled() from e
+        raise
+
+def send_api_request(api_url, api_key, data, on_delta=None, cancel_token=None, deadline=None,
+                     interactive=False, max_attempts=None, on_latency=None):
+    """
+    发送API请求（同一端点复用长连接），可重试的失败按 RetryPolicy 退避重试
+    
+    data 中 stream 为 True 时按 SSE 流式读取，每收到一段内容调用 on_delta(文本)，
+    返回值仍是完整回复。流式内容已经转发给 on_delta 后不再重试，避免重复显示。
+    每次尝试前先向 RateLimiter 申请额度，交互请求优先，后台请求排队等待。
+    
+    Args:
+        cancel_token: 可选，取消后抛出 RequestCancelled（重试等待中也会立即返回）
+        deadline: 本次调用（含重试）的总时限（秒），默认取 api.json 的 retry.deadline
+        interactive: 是否为用户正在等待的交互请求（对话回复）
+        max_attempts: 最多尝试次数，默认取 api.json 的 retry.max_attempts
+        on_latency: 可选，成功时以那一次 HTTP 尝试的耗时（秒）调用，不含限流排队和重试等待
+    
+    Returns:
+        str: 回复内容
+    
+    Raises:
+        APIError: 重试后仍然失败，str(异常) 是可以展示给用户的说明
+        RequestCancelled: 请求被取消
+    """
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
     }
+    policy = RetryPolicy(deadline, max_attempts=max_attempts)
+    limiter = RateLimiter.instance()
+    label = data.get("model", api_url)
+    # 词元额度按估算的输入 + 回复上限预扣，收到用量后结算
+    estimated = messages_tokens(data.get("messages", [])) + int(data.get("max_tokens") or 0)
+    forwarded = []
     
-    try:
-        response = requests.post(api_url, headers=headers, json=data, timeout=30)
-        response.raise_for_status()
-        return response.json()["choices"][0]["message"]["content"]
-    except requests.exceptions.Timeout:
-        return "请求超时，请检查网络连接"
-    except requests.exceptions.ConnectionError:
-        return "网络连接失败，请检查网络"
-    except requests.exceptions.HTTPError as e:
-        error_map = {
-            401: "API密钥错误，请检查您的API密钥",
-            403: "API访问被拒绝，请检查权限设置",
-            429: "请求过于频繁，请稍后再试"
-        }
-        return error_map.get(response.status_code, f"API请求失败: {response.status_code}")
-    except Exception as e:
-        return f"发生错误: {str(e)}"
-
-def build_conversation_messages(base_prompt, user_info_loader, history_manager, 
-                               user_content=None, new_role="user", memory_manager=None,
-                               heart_manager=None):
-    """构建完整的对话消息列表"""
-    messages = [{"role": "system", "content": base_prompt}]
-    
-    if heart_manager:
-        heart_desc = heart_manager.get_level_desc()
-        if heart_desc:
-            messages.append({
-                "role": "system", 
-                "content": f"【当前情感状态】{heart_desc}\n\n这是你对用户的真实情感基础和当前态度，后续回复必须严格遵循这个情感基调。"
-            })
-    
-    user_info_str = user_info_loader.get_info_string()
-    if user_info_str:
-        user_info_msg = f"以下是重要用户档案信息，这对理解对话上下文至关重要：\n{user_info_str}"
-        messages.append({"role": "system", "content": user_info_msg})
-    
-    if memory_manager:
-        long_memory_str = memory_manager.get_long_memories_string()
-        if long_memory_str:
-            long_memory_msg = f"以下是长期核心记忆，这些是过去对话的重要总结：\n{long_memory_str}"
-            messages.append({"role": "system", "content": long_memory_msg})
-    
-    system_messages_count = len(messages)
-    
-    if history_manager:
-        for talk in history_manager.get_all_talks():
-            role = "user" if talk["role"] in ["event", "user"] else "assistant"
-            content = f"[互动事件] {talk['content']}" if talk["role"] == "event" else talk["content"]
-            messages.append({"role": role, "content": content})
+    def forward(delta):
+        forwarded.append(len(delta))
+        on_delta(delta)
     
-    if user_content is not None:
-        messages.append({"role": new_role, "content": user_content})
+    while True:
+        try:
+            limiter.acquire(
+                api_url, estimated, interactive=interactive, timeout=policy.remaining(),
+                cancel_token=cancel_token, label=label
+            )
+        except RequestCancelled:
+            raise
+        except Exception as e:
+            raise classify_error(e)
+        
+        start = time.monotonic()
+        try:
+            content, usage = _post(
+                api_url, headers, data, forward if on_delta else None, cancel_token, policy.remaining()
+            )
+        except RequestCancelled:
+            limiter.settle(api_url, estimated, 0)
+            raise
+        except Exception as e:
+            limiter.settle(api_url, estimated, 0)
+            error = classify_error(e)
+        else:
+            if on_latency:
+                on_latency(time.monotonic() - start)
+            if usage:
+                UsageStats.instance().record(label, usage)
+                actual = (usage.get("prompt_tokens") or 0) + (usage.get("completion_tokens") or 0)
+                limiter.settle(api_url, estimated, actual)
+            return content
+        
+        delay = None if forwarded else policy.next_delay(error)
+        if delay is None:
+            raise error
+        print(f"[重试] {error}，{delay:.1f}秒后进行第{policy.attempt + 1}次尝试")
+        if cancel_token:
+            if cancel_token.wait(delay):
+                raise RequestCancelled()
+        else:
+            time.sleep(delay)
+
+def request_with_failover(role, data, on_delta=None, cancel_token=None, interactive=False, deadline=None):
+    """
+    按 EndpointRouter 给出的顺序向某个角色（"chat" / "vision" / "background"）的端点发请求
+    
+    data 中的 model 会替换为所选端点的模型。一个端点失败后切换到下一个，
+    后面还有端点可切换时不在当前端点重试；流式内容已经显示后不再切换。
+    所有端点共用一个总时限（默认取 api.json 的 retry.deadline）。
     
-    return messages, system_messages_count
+    Returns:
+        str: 回复内容
+    
+    Raises:
+        APIError: 全部端点都失败（抛出最后一个错误）
+        RequestCancelled: 请求被取消
+    """
+    router = EndpointRouter.instance()
+    endpoints = router.ordered(role)
+    if not endpoints:
+        raise APIError("没有可用的API端点，请检查 api.json")
+    
+    if deadline is None:
+        deadline = float(load_retry_config()["deadline"])
+    end_time = time.monotonic() + deadline
+    forwarded = []
+    
+    def forward(delta):
+        forwarded.append(len(delta))
+        on_delta(delta)
+    
+    last_error = None
+    for position, endpoint in enumerate(endpoints):
+        remaining = end_time - time.monotonic()
+        if remaining <= 0:
+            break
+        is_last = position == len(endpoints) - 1
+        latencies = []
+        try:
+            content = send_api_request(
+                endpoint.api_url, endpoint.api_key, {**data, "model": endpoint.model},
+                on_delta=forward if on_delta else None, cancel_token=cancel_token,
+                deadline=remaining, interactive=interactive, max_attempts=None if is_last else 1,
+                on_latency=latencies.append
+            )
+        except APIError as e:
+            router.record(endpoint, False)
+            last_error = e
+            if forwarded or is_last:
+                raise
+            print(f"[路由] {endpoint.name} 请求失败（{e}），改用 {endpoints[position + 1].name}")
+            continue
+        # 只统计成功的那次 HTTP 尝试，限流排队和退避等待不算作端点的延迟
+        router.record(endpoint, True, latencies[-1] if latencies else None)
+        return content
+    raise last_error or APIError("请求超时，请检查网络连接")
+
+def with_context_window(system_messages, history_manager, user_content=None, new_role="user",
+                        reserve=0, label=None, notes=()):
+    """
+    在系统消息后接上最近的上下文窗口、末尾的系统说明 notes 和本次输入，返回新列表
+    
+    上下文窗口直接取自 history_manager 维护的定长队列，开销与历史总长度无关，
+    再按词元预算（见 ContextBudgeter）从新到旧挑选放得下的部分。
+    本次输入总会发送；它已经写入历史（作为窗口最后一条）时不再重复追加。
+    """
+    window = history_manager.context_window() if history_manager else []
+    tail = list(notes)
+    if user_content is not None:
+        new_message = {"role": new_role, "content": user_content}
+        if window and window[-1] == new_message:
+            window.pop()
+        tail.append(new_message)
+    return ContextBudgeter().build(system_messages, window, tail, reserve=reserve, label=label)
 
 
 class BaseAPI:
     """API基类"""
     
     def __init__(self, api_key, api_url, model, character_prompt=None, 
-                 user_info_loader=None, history_manager=None, heart_manager=None):
+                 user_info_loader=None, history_manager=None, heart_manager=None, prompt=None):
         self.api_key = api_key
         self.api_url = api_url
         self.model = model
@@ -84,14 +346,20 @@ class BaseAPI:
         self.user_info_loader = user_info_loader or UserInfoLoader()
         self.history_manager = history_manager
         self.heart_manager = heart_manager
+        self.prompt = prompt or PromptAssembler.shared()  # 系统提示片段缓存（默认各 API 对象共用）
 
 class DeepSeekAPI(BaseAPI):
     """DeepSeek API通信类"""
     
     def __init__(self, api_key=None, character_prompt=None, history_manager=None, 
-                 memory_manager=None, heart_manager=None):
+                 memory_manager=None, heart_manager=None, role="chat", prompt=None):
+        """
+        role 为 "background" 时使用 api.json 的 background_api 段（没有则同 chat_api），见 api/router.py
+        
+        角色设定与桌宠不同的辅助对象应传入自己的 prompt（PromptAssembler），不要与对话共用片段缓存。
+        """
         api_config = load_api_config()
-        chat_config = api_config["chat_api"]
+        chat_config = {**api_config["chat_api"], **api_config.get(f"{role}_api", {})}
         
         super().__init__(
             api_key=chat_config["api_key"],
@@ -100,59 +368,88 @@ class DeepSeekAPI(BaseAPI):
             character_prompt=character_prompt,
             user_info_loader=UserInfoLoader(),
             history_manager=history_manager,
-            heart_manager=heart_manager
+            heart_manager=heart_manager,
+            prompt=prompt
         )
         self.temperature = chat_config["temperature"]
         self.max_tokens = chat_config["max_tokens"]
         self.stream = chat_config["stream"]
+        self.combined_judge = chat_config.get("combined_judge", False)
+        self.role = role
         self.memory_manager = memory_manager
+        self.system_messages = []
+        self.system_notes = []
         self._load_conversation()
     
-    def _load_conversation(self):
-        """加载对话历史到内存"""
-        self.conversation_history, self._system_count = build_conversation_messages(
-            self.character_prompt, 
-            self.user_info_loader, 
-            self.history_manager,
-            memory_manager=self.memory_manager,
-            heart_manager=self.heart_manager
+    def _refresh_system_messages(self):
+        """重新生成系统消息（与对话历史分开保存），system_notes 接在历史之后"""
+        self.system_messages = self.prompt.chat_messages(self)
+        self.system_notes = self.prompt.chat_notes(self)
+        self._system_count = len(self.system_messages)
+    
+    def _load_conversation(self, user_input=None, reserve=0):
+        """组合系统消息和上下文窗口，user_input 不为空时附加在末尾并打印词元统计"""
+        self._refresh_system_messages()
+        self.conversation_history = with_context_window(
+            self.system_messages, self.history_manager, user_input,
+            reserve=reserve, label="对话" if user_input is not None else None, notes=self.system_notes
         )
     
     def update_conversation_history(self):
-        """更新内存中的对话历史"""
+        """更新内存中的对话历史（历史记录变化后调用）"""
         self._load_conversation()
     
-    def get_response(self, user_input):
-        """获取AI回复"""
-        self.conversation_history, self._system_count = build_conversation_messages(
-            self.character_prompt,
-            self.user_info_loader,
-            self.history_manager,
-            user_content=user_input,
-            new_role="user",
-            memory_manager=self.memory_manager,
-            heart_manager=self.heart_manager
-        )
+    def get_response(self, user_input, on_delta=None, extra_system=None, cancel_token=None, interactive=False):
+        """
+        获取AI回复，开启 stream 时每收到一段内容调用 on_delta(文本)
         
-        # 裁剪历史
-        max_total = Config.MAX_HISTORY_MESSAGES + self._system_count
-        if len(self.conversation_history) > max_total:
-            self.conversation_history = (
-                self.conversation_history[:self._system_count] + 
-                self.conversation_history[-Config.MAX_HISTORY_MESSAGES:]
-            )
+        extra_system 为只附加在本次请求末尾的系统说明，不计入对话历史。
+        传入 cancel_token 时请求可被取消（抛出 RequestCancelled）。
+        interactive 为 True 表示用户正在等待回复，限流时优先放行。
+        """
+        # 为回复和临时系统说明预留词元，其余预算留给历史
+        reserve = self.max_tokens + (estimate_tokens(extra_system) if extra_system else 0)
+        self._load_conversation(user_input, reserve)
+        
+        messages = self.conversation_history
+        if extra_system:
+            messages = messages + [{"role": "system", "content": extra_system}]
         
         data = {
             "model": self.model,
-            "messages": self.conversation_history,
+            "messages": messages,
             "stream": self.stream,
             "temperature": self.temperature,
             "max_tokens": self.max_tokens,
         }
         
-        ai_response = send_api_request(self.api_url, self.api_key, data)
+        ai_response = request_with_failover(
+            self.role, data, on_delta=on_delta, cancel_token=cancel_token, interactive=interactive
+        )
         self.conversation_history.append({"role": "assistant", "content": ai_response})
         return ai_response
+    
+    def get_response_with_judge(self, user_input, on_delta=None, cancel_token=None, interactive=False):
+        """
+        一次请求同时获取回复和好感度变化（合并判断模式）
+        
+        回复中带有【好感度±N】标记（通常在末尾），流式接收时标记不会转发给 on_delta。
+        
+        Returns:
+            tuple: (去掉标记的回复, 变化值)，模型没有给出标记时变化值为 None
+        """
+        trailer = JudgeTrailerFilter(on_delta)
+        raw = self.get_response(
+            user_input,
+            on_delta=trailer.feed if on_delta else None,
+            extra_system=self.heart_manager.build_judge_instruction(),
+            cancel_token=cancel_token,
+            interactive=interactive
+        )
+        response, change = self.heart_manager.split_judge_trailer(raw)
+        trailer.flush()
+        self.conversation_history[-1]["content"] = response
+        return response, change
 
 
 class VisionAPI(BaseAPI):
@@ -170,7 +467,8 @@ class VisionAPI(BaseAPI):
             character_prompt=character_prompt,
             user_info_loader=user_info_loader,
             history_manager=history_manager,
-            heart_manager=heart_manager
+            heart_manager=heart_manager,
+            prompt=prompt
         )
         self.temperature = vision_config["temperature"]
         self.max_tokens = vision_config["max_tokens"]
@@ -180,38 +478,22 @@ class VisionAPI(BaseAPI):
         """分析屏幕截图并返回AI评价"""
         pure_base64 = image_base64.split(',', 1)[1] if image_base64.startswith('data:image') else image_base64
         
-        system_content_parts = [f"【你的身份】{self.character_prompt}\n\n这是你的核心人设，后续描述必须用第一人称'我'，并保持这个性格语气。"]
-        
-        if self.heart_manager:
-            heart_desc = self.heart_manager.get_level_desc()
-            if heart_desc:
-                system_content_parts.append(f"【当前情感状态】{heart_desc}\n\n这是你对用户的真实情感态度，观察屏幕时必须保持这个情感基调，用符合当前关系的态度描述看到的内容。")
-        
-        user_info_str = self.user_info_loader.get_info_string()
-        if user_info_str:
-            system_content_parts.append(f"【用户档案】{user_info_str}\n\n这是你需要记住的用户信息，观察屏幕时要联想用户的兴趣。")
-        
-        if self.memory_manager:
-            long_memory_str = self.memory_manager.get_long_memories_string()
-            if long_memory_str:
-                system_content_parts.append(f"【过往记忆】{long_memory_str}\n\n这些是你和用户的共同回忆，描述画面时可以自然联系这些记忆。")
+        system_content = self.prompt.system_block(self, "vision")
         
         history_context = ""
         if self.history_manager:
-            recent_talks = self.history_manager.get_all_talks()[-20:]
+            recent_talks = self.history_manager.tail(20)
             if recent_talks:
                 history_parts = []
                 for talk in recent_talks:
-                    if talk["role"] == "event":
-                        history_parts.append(f"\n- [事件] {talk['content']}")
-                    elif talk["role"] == "user":
-                        history_parts.append(f"\n- 用户说: {talk['content']}")
-                    elif talk["role"] == "assistant":
-                        history_parts.append(f"\n- 你回复: {talk['content']}")
+                    if talk.role == "event":
+                        history_parts.append(f"\n- [事件] {talk.content}")
+                    elif talk.role == "user":
+                        history_parts.append(f"\n- 用户说: {talk.content}")
+                    elif talk.role == "assistant":
+                        history_parts.append(f"\n- 你回复: {talk.content}")
                 history_context = "【最近对话】" + "".join(history_parts) + "\n\n"
         
-        system_content = "\n\n".join(system_content_parts)
-        
         if custom_prompt is None:
             base_question = f"""{history_context}【任务】请观察这张屏幕截图：
 - 看到了用户大概在进行什么活动（如浏览网页、写代码、玩游戏等）
@@ -250,4 +532,4 @@ class VisionAPI(BaseAPI):
             "max_tokens": self.max_tokens,
         }
         
-        return send_api_request(self.api_url, self.api_key, data)
\ No newline at end of file
+        return request_with_failover("vision", data)
\ No newline at end of file
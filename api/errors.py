@@ -0,0 +1,105 @@
+"""
+接口调用的异常类型
+
+send_api_request 失败时抛出 APIError 的子类，而不是返回错误文字，
+调用方据此决定提示用户还是静默放弃，错误内容不会被当作回复写入历史或记忆。
+str(异常) 是可以直接展示给用户的中文说明。
+"""
+import time
+from email.utils import parsedate_to_datetime
+import requests
+
+
+class RequestCancelled(Exception):
+    """请求已被取消（例如被更新的对话取代）"""
+
+
+class APIError(Exception):
+    """接口调用失败"""
+
+    retryable = False  # 重试是否可能成功
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class APITimeoutError(APIError):
+    """连接或读取超时"""
+    retryable = True
+
+
+class APIConnectionError(APIError):
+    """网络连接失败或连接中途断开"""
+    retryable = True
+
+
+class RateLimitError(APIError):
+    """请求过于频繁（429），retry_after 为服务端要求的等待秒数"""
+    retryable = True
+
+    def __init__(self, message, status=429, retry_after=None):
+        super().__init__(message, status)
+        self.retry_after = retry_after
+
+
+class ServerError(APIError):
+    """服务端错误（5xx）"""
+    retryable = True
+
+
+class AuthenticationError(APIError):
+    """API密钥错误（401）"""
+
+
+class PermissionDeniedError(APIError):
+    """没有访问权限（403）"""
+
+
+class APIStatusError(APIError):
+    """其他不可重试的 HTTP 错误"""
+
+
+class BadResponseError(APIError):
+    """返回内容无法解析"""
+
+
+def parse_retry_after(value):
+    """解析 Retry-After 头（秒数或 HTTP 日期），无法解析时返回 None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(error):
+    """把请求过程中的异常转换为对应的 APIError"""
+    if isinstance(error, APIError):
+        return error
+    if isinstance(error, requests.exceptions.Timeout):
+        return APITimeoutError("请求超时，请检查网络连接")
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        response = error.response
+        status = response.status_code
+        if status == 401:
+            return AuthenticationError("API密钥错误，请检查您的API密钥", status)
+        if status == 403:
+            return PermissionDeniedError("API访问被拒绝，请检查权限设置", status)
+        if status == 429:
+            return RateLimitError(
+                "请求过于频繁，请稍后再试", status, parse_retry_after(response.headers.get("Retry-After"))
+            )
+        if status >= 500:
+            return ServerError(f"API请求失败: {status}", status)
+        return APIStatusError(f"API请求失败: {status}", status)
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError)):
+        return APIConnectionError("网络连接失败，请检查网络")
+    if isinstance(error, (ValueError, KeyError, IndexError, TypeError)):
+        return BadResponseError(f"接口返回的内容无法解析: {error}")
+    return APIError(f"发生错误: {error}")
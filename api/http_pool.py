@@ -0,0 +1,92 @@
+import os
+from threading import Lock
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from utils.config_registry import ConfigRegistry
+
+# api.json 中 "http" 段的默认值
+DEFAULT_HTTP_CONFIG = {
+    "pool_size": 4,  # 每个端点保持的长连接数量
+    "connect_timeout": 5,  # 建立连接超时（秒）
+    "read_timeout": 30  # 等待响应超时（秒）
+}
+
+
+def load_http_config():
+    """读取 api.json 的 "http" 段，缺失的键使用默认值"""
+    config = dict(DEFAULT_HTTP_CONFIG)
+    api_config = ConfigRegistry.instance().get(os.path.join("txt", "api.json"), {})
+    config.update(api_config.get("http", {}))
+    return config
+
+
+class SessionPool:
+    """
+    按端点（协议+主机+端口）共享的 HTTP 长连接会话
+
+    对话、好感度判断、记忆整理、识图和整点报时都通过 send_api_request 发请求，
+    同一端点的请求复用同一个 requests.Session 及其连接池，避免每次重新进行 TCP 和 TLS 握手。
+    通过 instance() 获取共享实例；API 配置变化后调用 reset() 让新配置生效。
+    """
+
+    _instance = None
+    _instance_lock = Lock()
+
+    @classmethod
+    def instance(cls):
+        """获取进程内共享的实例"""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def __init__(self):
+        self.lock = Lock()
+        self._sessions = {}
+        self._config = None
+
+    @staticmethod
+    def _endpoint(url):
+        """URL 对应的端点键"""
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    @property
+    def config(self):
+        """当前生效的连接配置"""
+        with self.lock:
+            if self._config is None:
+                self._config = load_http_config()
+            return self._config
+
+    @property
+    def timeout(self):
+        """(连接超时, 读取超时)，直接传给 requests"""
+        config = self.config
+        return (config["connect_timeout"], config["read_timeout"])
+
+    def get(self, url):
+        """获取 url 所在端点的会话，首次使用时创建"""
+        pool_size = int(self.config["pool_size"])
+        endpoint = self._endpoint(url)
+        with self.lock:
+            session = self._sessions.get(endpoint)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+                session.mount(endpoint, adapter)
+                self._sessions[endpoint] = session
+            return session
+
+    def reset(self):
+        """关闭所有会话并在下次请求时按最新配置重新创建"""
+        with self.lock:
+            sessions, self._sessions = self._sessions, {}
+            self._config = None
+        for session in sessions.values():
+            session.close()
+
+    def close(self):
+        """关闭所有会话（程序退出时调用）"""
+        self.reset()
@@ -0,0 +1,158 @@
+from threading import Lock
+from utils.config import Config
+
+# 各用途的系统提示模板：片段名 -> 包装格式，{} 处填入片段内容，片段为空时整段省略
+PROMPT_TEMPLATES = {
+    "chat": {
+        "character": "{}",
+        "heart": "【当前情感状态】{}\n\n这是你对用户的真实情感基础和当前态度，后续回复必须严格遵循这个情感基调。",
+        "user_info": "以下是重要用户档案信息，这对理解对话上下文至关重要：\n{}",
+        "memory": "以下是长期核心记忆，这些是过去对话的重要总结：\n{}",
+    },
+    "vision": {
+        "character": "【你的身份】{}\n\n这是你的核心人设，后续描述必须用第一人称'我'，并保持这个性格语气。",
+        "heart": "【当前情感状态】{}\n\n这是你对用户的真实情感态度，观察屏幕时必须保持这个情感基调，用符合当前关系的态度描述看到的内容。",
+        "user_info": "【用户档案】{}\n\n这是你需要记住的用户信息，观察屏幕时要联想用户的兴趣。",
+        "memory": "【过往记忆】{}\n\n这些是你和用户的共同回忆，描述画面时可以自然联系这些记忆。",
+    },
+    "announce": {
+        "character": "【你的身份】{}\n\n这是你的核心人设，你必须用第一人称'我'，保持这个性格语气。",
+        "heart": "【当前情感状态】{}\n\n这是你对用户的真实情感态度，报时时必须符合这个情感基调，用符合当前关系亲密度的语气提醒用户。",
+        "user_info": "【用户档案】{}\n\n这是你需要记住的用户信息，报时时结合用户的作息、习惯或喜好会让提醒更贴心。",
+        "memory": "【过往记忆】{}\n\n这些是你和用户的共同回忆，报时时可以自然联系这些记忆，让对话更有连贯性。",
+    },
+}
+
+FRAGMENT_NAMES = ("character", "heart", "user_info", "memory")
+
+# 片段排列顺序（Config.PROMPT_ORDER）：(放在对话历史之前的片段, 放在对话历史之后的片段)
+# "stable_first" 把随好感度分数变化的情感状态移到历史之后、本次输入之前，作为末尾的系统说明，
+# 分数变化后 角色设定 + 用户档案 + 长期记忆 + 已有对话 这段前缀仍然不变，可以持续命中服务端的前缀缓存。
+# 识图和报时没有对话历史，单段系统提示按 前 + 后 的顺序拼接。
+FRAGMENT_ORDERS = {
+    "classic": (("character", "heart", "user_info", "memory"), ()),
+    "stable_first": (("character", "user_info", "memory"), ("heart",)),
+}
+
+
+class _Fragment:
+    """一个提示片段的缓存：来源标识不变时直接复用文本，文本真正变化时版本号加一"""
+
+    __slots__ = ("key", "text", "version")
+
+    def __init__(self):
+        self.key = None
+        self.text = ""
+        self.version = 0
+
+    def refresh(self, key, render):
+        if self.version and key == self.key:
+            return
+        text = render() if key is not None else ""
+        if text != self.text or not self.version:
+            self.text = text
+            self.version += 1
+        self.key = key
+
+
+class PromptAssembler:
+    """
+    系统提示的片段缓存与组装
+
+    角色设定、好感度描述、用户档案和长期记忆四个片段各自缓存，只在来源变化时重新生成
+    （角色设定看文本，好感度看分数和等级配置，用户档案看文件和已加载的配置对象，长期记忆看 memory_version）。
+    组装好的系统提示按各片段版本号缓存，片段都没变时返回与上次逐字节相同的内容，
+    便于服务端的前缀缓存命中；片段顺序见 FRAGMENT_ORDERS。
+
+    通过 shared() 获取按角色设定和用户档案文件共享的实例，对话、识图和报时共用同一份片段。
+    片段来源取自调用时传入的 owner（API 对象）的同名属性。
+    """
+
+    _instances = {}  # (角色设定文件, 用户档案文件) -> PromptAssembler
+    _instance_lock = Lock()
+
+    @classmethod
+    def shared(cls):
+        """获取当前配置文件对应的共享实例"""
+        key = (Config.CHARACTER_FILE, Config.USER_INFO_FILE)
+        with cls._instance_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls()
+            return cls._instances[key]
+
+    def __init__(self):
+        self.lock = Lock()
+        self._fragments = {name: _Fragment() for name in FRAGMENT_NAMES}
+        self._assembled = {}  # 用途 -> ((片段顺序, 片段版本号), 组装结果)
+
+    @staticmethod
+    def _fragment_sources(owner):
+        """各片段的 (来源标识, 生成函数)，来源不存在时标识为 None；标识与具体的 API 对象无关"""
+        heart = getattr(owner, "heart_manager", None)
+        loader = getattr(owner, "user_info_loader", None)
+        memory = getattr(owner, "memory_manager", None)
+        return {
+            "character": (owner.character_prompt, lambda: owner.character_prompt),
+            "heart": (
+                (heart.score, heart.favorability_config) if heart else None,
+                lambda: heart.get_level_desc()
+            ),
+            "user_info": ((loader.file_path, loader.info) if loader else None, lambda: loader.get_info_string()),
+            "memory": (
+                (memory, memory.memory_version) if memory else None,
+                lambda: memory.get_long_memories_string()
+            ),
+        }
+
+    def _refresh(self, owner):
+        """刷新全部片段，返回各片段的版本号（调用方需持有 lock）"""
+        for name, (key, render) in self._fragment_sources(owner).items():
+            self._fragments[name].refresh(key, render)
+        return tuple(self._fragments[name].version for name in FRAGMENT_NAMES)
+
+    def versions(self, owner):
+        """各片段当前的版本号"""
+        with self.lock:
+            return self._refresh(owner)
+
+    def _sections(self, purpose, names):
+        """按模板包装后的非空片段列表"""
+        template = PROMPT_TEMPLATES[purpose]
+        return [
+            template[name].format(self._fragments[name].text)
+            for name in names if self._fragments[name].text
+        ]
+
+    def _assemble(self, owner, purpose, build):
+        """片段版本号没变时复用上次的组装结果"""
+        order = Config.PROMPT_ORDER
+        with self.lock:
+            key = (order, self._refresh(owner))
+            cached = self._assembled.get(purpose)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+            head, tail = FRAGMENT_ORDERS[order]
+            result = build(self._sections(purpose, head), self._sections(purpose, tail))
+            self._assembled[purpose] = (key, result)
+            return result
+
+    def _chat_parts(self, owner):
+        """对话请求的 (历史之前的系统消息, 历史之后的系统消息)"""
+        def build(head, tail):
+            return (
+                tuple({"role": "system", "content": text} for text in head),
+                tuple({"role": "system", "content": text} for text in tail),
+            )
+        return self._assemble(owner, "chat", build)
+
+    def chat_messages(self, owner):
+        """对话请求开头的系统消息（每个片段一条），返回新列表，其中的字典请勿修改"""
+        return list(self._chat_parts(owner)[0])
+
+    def chat_notes(self, owner):
+        """接在对话历史之后、本次输入之前的系统消息（见 FRAGMENT_ORDERS），返回新列表，其中的字典请勿修改"""
+        return list(self._chat_parts(owner)[1])
+
+    def system_block(self, owner, purpose):
+        """识图（"vision"）或报时（"announce"）用的单段系统提示"""
+        return self._assemble(owner, purpose, lambda head, tail: "\n\n".join(head + tail))
@@ -0,0 +1,179 @@
+import os
+import time
+from threading import Condition, Lock
+from urllib.parse import urlsplit
+from utils.config_registry import ConfigRegistry
+from api.errors import RateLimitError
+
+# api.json 中 "rate_limit" 段的默认值，0 表示不限制
+DEFAULT_RATE_LIMIT_CONFIG = {
+    "rpm": 60,  # 每个 API 地址每分钟最多请求数
+    "tpm": 0,  # 每个 API 地址每分钟最多词元数（按估算的输入 + max_tokens 预扣，收到用量后多退少补）
+    "background_reserve": 0.2  # 额度中留给交互请求（对话）的比例，后台请求不能动用这部分
+}
+
+
+def load_rate_limit_config():
+    """读取 api.json 的 "rate_limit" 段，缺失的键使用默认值"""
+    config = dict(DEFAULT_RATE_LIMIT_CONFIG)
+    api_config = ConfigRegistry.instance().get(os.path.join("txt", "api.json"), {})
+    config.update(api_config.get("rate_limit", {}))
+    return config
+
+
+class _Bucket:
+    """令牌桶：容量为每分钟额度，按秒匀速补充，余量可以因事后结算暂时为负"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self.rate = self.capacity / 60.0
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def shortfall(self, amount, floor):
+        """取走 amount 后余量不低于 floor 还差多少"""
+        return max(0.0, amount + floor - self.level)
+
+
+class RateLimiter:
+    """
+    客户端限流（按 API 地址分别计算，进程内共享）
+
+    每次请求前调用 acquire()：请求数和词元数两个令牌桶都有足够余量时放行，否则等待补充。
+    交互请求优先：有交互请求在等时后台请求让路，且后台请求不能动用 background_reserve 比例的额度。
+    请求结束后用 settle() 按实际用量结算词元。等待时间计入 stats() 并打印日志。
+    通过 instance() 获取共享实例；API 配置变化后调用 reset()。
+    """
+
+    _instance = None
+    _instance_lock = Lock()
+
+    @classmethod
+    def instance(cls):
+        """获取进程内共享的实例"""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def __init__(self):
+        self._cond = Condition()
+        self._config = None
+        self._buckets = {}  # 端点 -> (请求数桶, 词元桶)，不限制的桶为 None
+        self._interactive_waiting = 0
+        self._stats = {"requests": 0, "waited": 0, "wait_seconds": 0.0, "max_wait": 0.0}
+
+    @staticmethod
+    def _endpoint(url):
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def _get_buckets(self, endpoint):
+        """端点对应的令牌桶，首次使用时按配置创建（调用方需持有 _cond）"""
+        if self._config is None:
+            self._config = load_rate_limit_config()
+        buckets = self._buckets.get(endpoint)
+        if buckets is None:
+            rpm, tpm = self._config["rpm"], self._config["tpm"]
+            buckets = (_Bucket(rpm) if rpm else None, _Bucket(tpm) if tpm else None)
+            self._buckets[endpoint] = buckets
+        return buckets
+
+    def _wait_needed(self, buckets, tokens, interactive):
+        """当前需要再等多少秒才能放行，0 表示可以立即放行（调用方需持有 _cond）"""
+        if not interactive and self._interactive_waiting:
+            return 0.05
+        now = time.monotonic()
+        reserve = 0.0 if interactive else float(self._config["background_reserve"])
+        wait = 0.0
+        for bucket, amount in zip(buckets, (1, tokens)):
+            if bucket is None:
+                continue
+            bucket.refill(now)
+            # 单次请求超过整桶容量时只要求桶满，避免永远等不到
+            amount = min(amount, bucket.capacity * (1 - reserve))
+            shortfall = bucket.shortfall(amount, bucket.capacity * reserve)
+            if shortfall:
+                wait = max(wait, shortfall / bucket.rate)
+        return wait
+
+    def acquire(self, url, tokens=0, interactive=False, timeout=None, cancel_token=None, label=None):
+        """
+        等待请求额度
+
+        Args:
+            tokens: 本次请求预计消耗的词元数
+            interactive: 是否为交互请求（优先放行）
+            timeout: 最长等待秒数，超时抛出 RateLimitError
+            cancel_token: 可选，等待期间被取消时抛出 RequestCancelled
+
+        Returns:
+            float: 实际等待的秒数
+        """
+        start = time.monotonic()
+        with self._cond:
+            buckets = self._get_buckets(self._endpoint(url))
+            if interactive:
+                self._interactive_waiting += 1
+            try:
+                while True:
+                    wait = self._wait_needed(buckets, tokens, interactive)
+                    if not wait:
+                        break
+                    if cancel_token:
+                        cancel_token.check()
+                    if timeout is not None and time.monotonic() - start + wait > timeout:
+                        raise RateLimitError("请求排队超时，请稍后再试", status=None)
+                    # 分段等待，以便及时响应取消和其他请求的结算
+                    self._cond.wait(min(wait, 0.25))
+                request_bucket, token_bucket = buckets
+                if request_bucket:
+                    request_bucket.level -= 1
+                if token_bucket:
+                    token_bucket.level -= tokens
+            finally:
+                if interactive:
+                    self._interactive_waiting -= 1
+                    self._cond.notify_all()
+
+            waited = time.monotonic() - start
+            self._stats["requests"] += 1
+            if waited >= 0.01:
+                self._stats["waited"] += 1
+                self._stats["wait_seconds"] += waited
+                self._stats["max_wait"] = max(self._stats["max_wait"], waited)
+        if waited >= 0.01:
+            kind = "交互" if interactive else "后台"
+            print(f"[限流] {label or url} | {kind}请求等待 {waited * 1000:.0f}ms")
+        return waited
+
+    def settle(self, url, estimated, actual):
+        """按实际词元用量结算（多退少补）"""
+        with self._cond:
+            buckets = self._buckets.get(self._endpoint(url))
+            if not buckets or buckets[1] is None:
+                return
+            bucket = buckets[1]
+            bucket.level = min(bucket.capacity, bucket.level + estimated - actual)
+            self._cond.notify_all()
+
+    def stats(self):
+        """累计的请求数、等待过的请求数、总等待和最长等待秒数"""
+        with self._cond:
+            return dict(self._stats)
+
+    def reset(self, config=None):
+        """
+        丢弃全部令牌桶并在下次请求时按最新配置重新创建
+
+        Args:
+            config: 可选，直接使用的限流配置（不读取 api.json，如基准测试关闭限流）
+        """
+        with self._cond:
+            self._config = dict(config) if config is not None else None
+            self._buckets = {}
+            self._cond.notify_all()
@@ -0,0 +1,60 @@
+import os
+import random
+import time
+from utils.config_registry import ConfigRegistry
+
+# api.json 中 "retry" 段的默认值
+DEFAULT_RETRY_CONFIG = {
+    "max_attempts": 3,  # 每次调用最多尝试几次（含第一次）
+    "base_delay": 0.5,  # 第一次重试前的基准等待（秒），之后每次翻倍
+    "max_delay": 8,  # 单次等待上限（秒）
+    "deadline": 60  # 每次调用（含全部重试和等待）的总时限（秒）
+}
+
+
+def load_retry_config():
+    """读取 api.json 的 "retry" 段，缺失的键使用默认值"""
+    config = dict(DEFAULT_RETRY_CONFIG)
+    api_config = ConfigRegistry.instance().get(os.path.join("txt", "api.json"), {})
+    config.update(api_config.get("retry", {}))
+    return config
+
+
+class RetryPolicy:
+    """
+    单次调用的重试策略
+
+    可重试的错误（超时、连接失败、429、5xx）按指数退避加随机抖动等待后重试，
+    429 带 Retry-After 时至少等待服务端要求的时间；尝试次数和总时限任一用完就放弃。
+    """
+
+    def __init__(self, deadline=None, config=None, max_attempts=None):
+        config = config or load_retry_config()
+        self.max_attempts = max(1, int(max_attempts or config["max_attempts"]))
+        self.base_delay = float(config["base_delay"])
+        self.max_delay = float(config["max_delay"])
+        self.deadline = time.monotonic() + float(deadline if deadline is not None else config["deadline"])
+        self.attempt = 0
+
+    def remaining(self):
+        """距离时限还剩多少秒"""
+        return self.deadline - time.monotonic()
+
+    def next_delay(self, error):
+        """
+        第 attempt 次失败后应等待的秒数，不应再重试时返回 None
+
+        Args:
+            error: 本次失败的 APIError
+        """
+        self.attempt += 1
+        if not error.retryable or self.attempt >= self.max_attempts:
+            return None
+        # 全抖动：在 [0, 基准 * 2^(n-1)] 之间随机，避免多个请求同时重试
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (self.attempt - 1)))
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if delay >= self.remaining():
+            return None
+        return delay
@@ -0,0 +1,196 @@
+"""
+多端点路由与故障切换
+
+api.json 的每个角色段（chat_api / vision_api，以及可选的 background_api）除了自身的
+api_url / api_key / model 外，还可以带一个 endpoints 列表，每项是一个 OpenAI 兼容端点：
+
+    "chat_api": {
+        "api_key": "...", "api_url": "https://api.deepseek.com/v1/chat/completions", "model": "deepseek-chat",
+        "endpoints": [
+            {"name": "备用", "api_url": "https://.../v1/chat/completions", "api_key": "...", "model": "...", "weight": 0.5}
+        ]
+    }
+
+列表项缺少的键沿用所在段的值。background_api 供记忆整理、好感度判断等后台任务使用，
+其中缺少的键（包括 endpoints）沿用 chat_api，没有配置时与 chat_api 相同。
+每个端点统计最近的延迟（p50/p95）和错误率，请求按 延迟 × 错误惩罚 / 权重 从小到大依次尝试，
+连续失败的端点暂时冷却。
+"""
+import os
+import time
+from collections import deque
+from threading import Lock
+from urllib.parse import urlsplit
+from utils.config_registry import ConfigRegistry
+
+WINDOW = 50  # 每个端点保留的最近样本数
+UNKNOWN_LATENCY = 10.0  # 只失败过、还没有成功样本的端点按这个延迟（秒）计分
+MAX_COOLDOWN = 60  # 连续失败后的最长冷却时间（秒）
+
+
+def _percentile(values, fraction):
+    """values 的近似分位数，没有样本时返回 None"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class Endpoint:
+    """一个端点的连接信息和近期表现"""
+
+    def __init__(self, name, api_url, api_key, model, weight=1.0):
+        self.name = name
+        self.api_url = api_url
+        self.api_key = api_key
+        self.model = model
+        self.weight = max(float(weight), 0.01)
+        self.latencies = deque(maxlen=WINDOW)  # 成功请求的耗时（秒）
+        self.outcomes = deque(maxlen=WINDOW)  # 最近请求是否成功
+        self.failures = 0  # 连续失败次数
+        self.cooldown_until = 0.0
+
+    @property
+    def key(self):
+        """配置刷新后用来找回统计数据的标识"""
+        return (self.api_url, self.model, self.api_key)
+
+    def update_config(self, other):
+        """沿用统计数据，更新名称和权重"""
+        self.name = other.name
+        self.weight = other.weight
+
+    def p50(self):
+        return _percentile(self.latencies, 0.5)
+
+    def p95(self):
+        return _percentile(self.latencies, 0.95)
+
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def healthy(self, now):
+        return now >= self.cooldown_until
+
+    def score(self):
+        """越小越优先；从未请求过的端点得 0，会被优先试用一次"""
+        latency = self.p50()
+        if latency is None:
+            latency = UNKNOWN_LATENCY if self.outcomes else 0.0
+        return latency * (1 + 4 * self.error_rate()) / self.weight
+
+    def record(self, ok, latency=None):
+        self.outcomes.append(ok)
+        if ok:
+            self.failures = 0
+            self.cooldown_until = 0.0
+            if latency is not None:
+                self.latencies.append(latency)
+        else:
+            self.failures += 1
+            self.cooldown_until = time.monotonic() + min(MAX_COOLDOWN, 2 ** (self.failures - 1))
+
+
+def _endpoint_configs(api_config, role):
+    """某个角色的端点配置列表"""
+    section = api_config.get(f"{role}_api")
+    if role == "background":
+        # 与 DeepSeekAPI 一致：background_api 只需写出与 chat_api 不同的键
+        section = {**api_config.get("chat_api", {}), **(section or {})}
+    if not section:
+        return []
+
+    configs = []
+    if section.get("api_url"):
+        configs.append(section)
+    for item in section.get("endpoints", ()):
+        merged = {key: value for key, value in section.items() if key != "endpoints"}
+        merged.update(item)
+        configs.append(merged)
+    return configs
+
+
+class EndpointRouter:
+    """
+    按角色挑选端点并记录每个端点的表现
+
+    通过 instance() 获取共享实例。配置由 ConfigRegistry 缓存，api.json 变化后自动使用新的端点列表，
+    地址、模型和密钥都没变的端点保留原有统计。
+    """
+
+    _instance = None
+    _instance_lock = Lock()
+
+    @classmethod
+    def instance(cls):
+        """获取进程内共享的实例"""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def __init__(self):
+        self.lock = Lock()
+        self._config = None
+        self._roles = {}  # 角色 -> [Endpoint]
+        self._known = {}  # Endpoint.key -> Endpoint，跨配置刷新保留统计
+
+    def _load(self):
+        """api.json 变化时重建各角色的端点列表（调用方需持有 lock）"""
+        api_config = ConfigRegistry.instance().load(os.path.join("txt", "api.json"))
+        if api_config is self._config:
+            return
+        self._config = api_config
+        self._roles = {}
+        for role in ("chat", "vision", "background"):
+            endpoints = []
+            for config in _endpoint_configs(api_config, role):
+                endpoint = Endpoint(
+                    config.get("name") or urlsplit(config["api_url"]).netloc,
+                    config["api_url"], config.get("api_key", ""), config.get("model", ""),
+                    config.get("weight", 1.0)
+                )
+                known = self._known.setdefault(endpoint.key, endpoint)
+                known.update_config(endpoint)
+                endpoints.append(known)
+            self._roles[role] = endpoints
+
+    def endpoints(self, role):
+        """角色配置的全部端点（按配置顺序）"""
+        with self.lock:
+            self._load()
+            return list(self._roles.get(role, []))
+
+    def ordered(self, role):
+        """按尝试顺序排列的端点：健康的按得分从小到大，冷却中的放在最后"""
+        with self.lock:
+            self._load()
+            endpoints = self._roles.get(role, [])
+            now = time.monotonic()
+            healthy = sorted((e for e in endpoints if e.healthy(now)), key=lambda e: e.score())
+            cooling = sorted((e for e in endpoints if not e.healthy(now)), key=lambda e: e.cooldown_until)
+            return healthy + cooling
+
+    def record(self, endpoint, ok, latency=None):
+        """记录一次请求的结果，成功时附带耗时（秒）"""
+        with self.lock:
+            endpoint.record(ok, latency)
+
+    def stats(self, role=None):
+        """各端点的 p50/p95 延迟（毫秒）、错误率和样本数"""
+        with self.lock:
+            self._load()
+            roles = [role] if role else list(self._roles)
+            result = {}
+            for name in roles:
+                for endpoint in self._roles.get(name, []):
+                    p50, p95 = endpoint.p50(), endpoint.p95()
+                    result[f"{name}/{endpoint.name}"] = {
+                        "p50_ms": round(p50 * 1000) if p50 is not None else None,
+                        "p95_ms": round(p95 * 1000) if p95 is not None else None,
+                        "error_rate": round(endpoint.error_rate(), 3),
+                        "samples": len(endpoint.outcomes),
+                    }
+            return result
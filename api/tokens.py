@@ -0,0 +1,155 @@
+"""
+本地词元估算与上下文预算
+
+没有可用的分词器时按字符类别估算（参考 DeepSeek 的换算：1 个中文字符约 0.6 个词元，
+1 个英文字符约 0.3 个词元）。提供词表文件 Config.TOKEN_VOCAB_FILE 时改为按词表最长匹配计数，
+词表为纯文本（每行一个词元）或 JSON（词元列表，或以词元为键的字典，如 tokenizer.json 的 model.vocab）。
+"""
+import json
+import os
+from functools import lru_cache
+from threading import Lock
+from utils.config import Config
+
+CJK_TOKENS = 0.6  # 中日韩文字
+ASCII_TOKENS = 0.3  # 英文字母、数字、标点
+SPACE_TOKENS = 0.25  # 空白
+OTHER_TOKENS = 1.0  # 其他字符（表情符号等）
+MESSAGE_OVERHEAD = 4  # 每条消息的角色和分隔标记
+
+_vocab_lock = Lock()
+_vocab = None  # (词元集合, 最长词元长度)，未加载时为 None，没有词表时为 False
+
+
+def _is_cjk(code):
+    return (
+        0x4E00 <= code <= 0x9FFF or 0x3400 <= code <= 0x4DBF or 0x3040 <= code <= 0x30FF
+        or 0xAC00 <= code <= 0xD7AF or 0x3000 <= code <= 0x303F or 0xFF00 <= code <= 0xFFEF
+    )
+
+
+def _char_tokens(char):
+    """单个字符的估算词元数"""
+    code = ord(char)
+    if code < 128:
+        return SPACE_TOKENS if char.isspace() else ASCII_TOKENS
+    if _is_cjk(code):
+        return CJK_TOKENS
+    return OTHER_TOKENS
+
+
+def _read_vocab(path):
+    """读取词表文件，返回词元集合"""
+    with open(path, 'r', encoding='utf-8') as f:
+        if not path.endswith(".json"):
+            return {line.rstrip("\n") for line in f if line.strip()}
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("model", {}).get("vocab", data)
+    return {token for token in data if isinstance(token, str) and token}
+
+
+def _get_vocab():
+    """按需加载词表，没有配置或加载失败时返回 False"""
+    global _vocab
+    with _vocab_lock:
+        if _vocab is None:
+            _vocab = False
+            path = Config.get_full_path(Config.TOKEN_VOCAB_FILE)
+            if os.path.exists(path):
+                try:
+                    tokens = _read_vocab(path)
+                    if tokens:
+                        _vocab = (tokens, max(len(token) for token in tokens))
+                except Exception as e:
+                    print(f"加载词表失败: {e}，改用字符估算")
+        return _vocab
+
+
+def _count_with_vocab(text, tokens, max_len):
+    """按词表最长匹配计数，词表中没有的字符按字符类别估算"""
+    count = 0.0
+    pos = 0
+    length = len(text)
+    while pos < length:
+        for size in range(min(max_len, length - pos), 0, -1):
+            if text[pos:pos + size] in tokens:
+                count += 1
+                pos += size
+                break
+        else:
+            count += _char_tokens(text[pos])
+            pos += 1
+    return count
+
+
+@lru_cache(maxsize=1024)
+def estimate_tokens(text):
+    """估算一段文本的词元数（上下文中的消息反复出现，结果按文本缓存）"""
+    if not text:
+        return 0
+    vocab = _get_vocab()
+    if vocab:
+        count = _count_with_vocab(text, *vocab)
+    else:
+        count = sum(_char_tokens(char) for char in text)
+    return int(count + 0.999)
+
+
+def message_tokens(message):
+    """单条消息的估算词元数（只计文本内容）"""
+    content = message.get("content")
+    if isinstance(content, list):
+        content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return estimate_tokens(content or "") + MESSAGE_OVERHEAD
+
+
+def messages_tokens(messages):
+    """多条消息的估算词元数"""
+    return sum(message_tokens(message) for message in messages)
+
+
+class ContextBudgeter:
+    """
+    按词元预算挑选上下文
+
+    系统消息、本次输入和预留的回复长度（max_tokens）先占用预算，剩余部分从最新的历史消息往前填，
+    放不下为止；历史条数另受上下文窗口长度（Config.CONTEXT_MAX_MESSAGES）限制。
+    """
+
+    def __init__(self, ceiling=None):
+        self.ceiling = ceiling if ceiling is not None else Config.CONTEXT_TOKEN_BUDGET
+
+    def build(self, system_messages, window, tail_messages=(), reserve=0, label=None):
+        """
+        组合 系统消息 + 放得下的最近历史 + tail_messages
+
+        Args:
+            reserve: 额外预留的词元数（回复长度、临时系统说明等）
+            label: 不为空时打印一行词元统计日志
+
+        Returns:
+            list: 消息列表
+        """
+        system_tokens = messages_tokens(system_messages)
+        tail_tokens = messages_tokens(tail_messages)
+        available = self.ceiling - system_tokens - tail_tokens - reserve
+
+        kept = []
+        history_tokens = 0
+        for message in reversed(window):
+            tokens = message_tokens(message)
+            if history_tokens + tokens > available:
+                break
+            kept.append(message)
+            history_tokens += tokens
+        kept.reverse()
+
+        if label:
+            total = system_tokens + history_tokens + tail_tokens + reserve
+            dropped = f"（预算不足，略去更早的{len(window) - len(kept)}条）" if len(kept) < len(window) else ""
+            print(
+                f"[词元] {label} | 系统 {system_tokens} | 历史 {len(kept)}条 {history_tokens}{dropped} | "
+                f"输入 {tail_tokens} | 预留 {reserve} | 合计约 {total}/{self.ceiling}"
+            )
+        return list(system_messages) + kept + list(tail_messages)
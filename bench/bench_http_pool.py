@@ -0,0 +1,66 @@
+"""
+长连接会话池基准
+
+对本地模拟 HTTPS 接口依次发送相同数量的请求，对比：
+  - 每次 requests.post（旧实现，每次新建 TCP + TLS 连接）
+  - send_api_request（按端点复用 SessionPool 中的长连接）
+输出建立的连接数和平均每次请求耗时。
+
+用法：python bench/bench_http_pool.py [请求次数]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+from bench.mock_server import MockServer
+from api.api_client import send_api_request
+from api.http_pool import SessionPool
+from api.rate_limiter import DEFAULT_RATE_LIMIT_CONFIG, RateLimiter
+
+DATA = {
+    "model": "deepseek-chat",
+    "messages": [{"role": "user", "content": "你好"}],
+    "stream": False,
+    "temperature": 0.8,
+    "max_tokens": 100
+}
+
+
+def run(server, label, send, count):
+    """发送 count 次请求并打印统计"""
+    server.reset_stats()
+    started = time.perf_counter()
+    for _ in range(count):
+        send()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<20} 连接 {server.connections:4d} 次  请求 {server.requests:4d} 次  "
+          f"平均 {elapsed / count * 1000:6.2f} ms/请求")
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    server = MockServer().start()
+    os.environ["REQUESTS_CA_BUNDLE"] = server.cert_file
+    headers = {"Authorization": "Bearer test", "Content-Type": "application/json"}
+    # 关闭客户端限流，只比较连接复用
+    RateLimiter.instance().reset({**DEFAULT_RATE_LIMIT_CONFIG, "rpm": 0, "tpm": 0})
+
+    try:
+        # 预热，避免首次导入和证书加载计入结果
+        requests.post(server.url, headers=headers, json=DATA, timeout=30)
+        send_api_request(server.url, "test", DATA)
+
+        bare = run(server, "requests.post（旧）", lambda: requests.post(server.url, headers=headers, json=DATA, timeout=30), count)
+        pooled = run(server, "SessionPool（新）", lambda: send_api_request(server.url, "test", DATA), count)
+        print(f"每次请求节省 {(bare - pooled) / count * 1000:.2f} ms（握手开销）")
+    finally:
+        SessionPool.instance().close()
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
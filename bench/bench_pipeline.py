@@ -0,0 +1,415 @@
+"""
+端到端延迟基准
+
+启动本地模拟接口（见 mock_server.py，可设置时延、首字延迟、流式节奏和错误注入），
+在临时目录中生成全新的配置和历史，依次驱动：
+  - DeepSeekAPI.get_response（单次对话请求）
+  - HeartManager.judge_change（好感度判断）
+  - MemoryManager.consolidate_short_term_memory（记忆整理）
+  - TalkManager 的完整对话轮次（无界面：Qt 以 offscreen 平台运行，回调由代替主窗口的对象接收）
+输出每个阶段的延迟分布（平均 / p50 / p95 / 最大）、每轮发出的请求数和吞吐，
+便于离线对比改动前后的性能。记忆整理和对话管线依赖 PyQt5，未安装时跳过。
+
+用法：python bench/bench_pipeline.py [--turns 20] [--calls 20] [--ttfb 0.2] [--chunk-interval 0.02]
+      [--error-rate 0.1 --error-status 500] [--no-stream] [--combined] [--verbose]
+"""
+import argparse
+import contextlib
+import copy
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.mock_server import MockServer
+from utils import begin
+from utils.config import Config
+from utils.loader import CharacterLoader
+from utils.metrics import LatencyTrace
+from api.api_client import DeepSeekAPI
+from api.errors import APIError
+from api.http_pool import SessionPool
+
+USER_INPUTS = (
+    "今天天气怎么样？",
+    "我刚写完一段代码，有点累了",
+    "你还记得我昨天说的事情吗",
+    "晚上想吃点什么好呢",
+    "陪我聊聊天吧",
+)
+
+CHAT_REPLY = "（歪头）今天阳光很好哦，适合出去走走~\n不过记得多喝水，写代码也要休息一下！"
+
+TURN_MARKS = ("首字", "回复完成", "本轮结束", "好感度判断", "整轮")
+
+
+def use_sandbox(base):
+    """把全部配置和历史文件指向临时目录，基准不会读写真实数据"""
+    Config.BASE_PATH = base
+    Config.CHARACTER_FILE = os.path.join(base, "txt", "character.json")
+    Config.USER_INFO_FILE = os.path.join(base, "txt", "user_info.json")
+    Config.SETTING_FILE = os.path.join(base, "txt", "setting.json")
+    Config.HISTORY_FILE = os.path.join(base, "log", "talk_log.json")
+    Config.HISTORY_DIR = os.path.join(base, "log", "talks")
+    Config.HISTORY_DB_FILE = os.path.join(base, "log", "talk_log.db")
+    Config.TOKEN_VOCAB_FILE = os.path.join(base, "txt", "token_vocab.txt")
+
+
+def write_api_config(server, args):
+    """生成指向模拟接口的 api.json：重试等待缩短，默认不限流"""
+    config = copy.deepcopy(begin.DEFAULT_API_CONFIG)
+    config["chat_api"].update(
+        api_key="bench", api_url=server.url, stream=args.stream, combined_judge=args.combined
+    )
+    config["vision_api"].update(api_key="bench", api_url=server.url)
+    config["retry"].update(base_delay=0.05, max_delay=0.5)
+    config["rate_limit"]["rpm"] = args.rpm
+    path = Config.get_full_path(os.path.join("txt", "api.json"))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+
+
+class Responder:
+    """按请求内容给出各类调用期望的回复，并按类别统计请求数"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = Counter()
+
+    @staticmethod
+    def classify(request):
+        messages = request.get("messages", [])
+        last = messages[-1].get("content") if messages else ""
+        text = last if isinstance(last, str) else ""
+        if "进一步压缩提炼" in text:
+            return "compress"
+        if "提炼成一条核心记忆" in text:
+            return "memory"
+        if "只输出这四个字和数字" in text:
+            return "judge"
+        return "chat"
+
+    def __call__(self, request):
+        kind = self.classify(request)
+        with self.lock:
+            self.counts[kind] += 1
+        if kind == "compress":
+            return "\n".join(f"{i}. 第{i}条压缩后的记忆" for i in range(1, 7))
+        if kind == "memory":
+            return "用户和桌宠聊了天气"
+        if kind == "judge":
+            return "好感度+1"
+        combined = any("【好感度判断】" in str(m.get("content")) for m in request.get("messages", []))
+        return CHAT_REPLY + ("\n【好感度+1】" if combined else "")
+
+    def snapshot(self):
+        with self.lock:
+            return Counter(self.counts)
+
+
+@contextlib.contextmanager
+def quiet(verbose):
+    """不加 --verbose 时屏蔽程序自身的日志输出，只保留基准结果"""
+    if verbose:
+        yield
+        return
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def report(label, samples):
+    """打印一组耗时（毫秒）的分布"""
+    if not samples:
+        print(f"{label:<18} 无成功样本")
+        return
+    print(f"{label:<18} 次数 {len(samples):4d}  平均 {sum(samples) / len(samples):8.1f}  "
+          f"p50 {percentile(samples, 0.5):8.1f}  p95 {percentile(samples, 0.95):8.1f}  "
+          f"最大 {max(samples):8.1f} ms")
+
+
+def report_throughput(label, calls, failures, requests, wall):
+    """打印一个阶段的请求数和吞吐"""
+    print(f"{'':<18} 调用 {calls} 次（失败 {failures}）  接口请求 {requests} 次  "
+          f"耗时 {wall:.2f}s  吞吐 {calls / wall:.2f} 次/秒")
+
+
+def bench_get_response(server, args):
+    """DeepSeekAPI.get_response：首字和完整回复的耗时，可并发"""
+    local = threading.local()
+    first, total = [], []
+    failures = []
+
+    def call(index):
+        api = getattr(local, "api", None)
+        if api is None:
+            api = local.api = DeepSeekAPI(history_manager=None)
+        trace = LatencyTrace("get_response")
+
+        def on_delta(delta):
+            if trace.elapsed("首字") is None:
+                trace.mark("首字")
+
+        try:
+            api.get_response(USER_INPUTS[index % len(USER_INPUTS)], on_delta=on_delta if api.stream else None)
+        except APIError:
+            failures.append(index)
+            return
+        total.append(trace.mark("完成"))
+        if trace.elapsed("首字") is not None:
+            first.append(trace.elapsed("首字"))
+
+    with quiet(args.verbose):
+        # 预热：建立连接、生成系统提示，不计入结果
+        try:
+            DeepSeekAPI(history_manager=None).get_response("你好")
+        except APIError:
+            pass
+        server.reset_stats()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(call, range(args.calls)))
+        wall = time.perf_counter() - started
+
+    print(f"\n== DeepSeekAPI.get_response（并发 {args.concurrency}）")
+    if first:
+        report("首字", first)
+    report("完整回复", total)
+    report_throughput("get_response", args.calls, len(failures), server.requests, wall)
+
+
+def bench_judge(server, args):
+    """HeartManager.judge_change：单独的好感度判断请求"""
+    from core.heart import HeartManager
+
+    heart = HeartManager()
+    samples = []
+    failures = 0
+    with quiet(args.verbose):
+        server.reset_stats()
+        started = time.perf_counter()
+        for index in range(args.calls):
+            trace = LatencyTrace("judge_change")
+            change = heart.judge_change(USER_INPUTS[index % len(USER_INPUTS)], CHAT_REPLY)
+            if change is None:
+                failures += 1
+            else:
+                samples.append(trace.mark("完成"))
+        wall = time.perf_counter() - started
+
+    print("\n== HeartManager.judge_change")
+    report("判断", samples)
+    report_throughput("judge_change", args.calls, failures, server.requests, wall)
+    return heart
+
+
+def bench_memory(server, args, history_manager):
+    """MemoryManager.consolidate_short_term_memory：按批整理 batches × MAX_HISTORY_MESSAGES 条记录"""
+    from core.memory_manager import MemoryManager
+    from utils.executor import TaskExecutor
+
+    TaskExecutor.instance()  # 需在主线程创建
+    with quiet(args.verbose):
+        memory_manager = MemoryManager(history_manager)
+        for index in range(args.batches * Config.MAX_HISTORY_MESSAGES):
+            role = "user" if index % 2 == 0 else "assistant"
+            content = USER_INPUTS[index // 2 % len(USER_INPUTS)] if role == "user" else CHAT_REPLY
+            history_manager.add_talk(role, content)
+
+        server.reset_stats()
+        before = len(memory_manager.long_memories)
+        trace = LatencyTrace("consolidate")
+        memory_manager.consolidate_short_term_memory()
+        elapsed = trace.mark("完成")
+        batches = len(memory_manager.long_memories) - before
+
+    print("\n== MemoryManager.consolidate_short_term_memory")
+    report("整理（整次）", [elapsed])
+    if batches > 0:
+        report("整理（每批）", [elapsed / batches])
+    report_throughput("consolidate", 1, 0 if batches == args.batches else 1, server.requests, elapsed / 1000)
+    return memory_manager
+
+
+def bench_turns(server, args, responder, history_manager, memory_manager, heart):
+    """TalkManager 的完整对话轮次：发送 → 首字 → 回复完成 → 恢复输入 → 好感度判断（及期间触发的记忆整理）"""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtCore import pyqtSlot
+    from PyQt5.QtWidgets import QApplication, QLabel, QWidget
+    from ui.talk import TalkManager
+    from utils.executor import TaskExecutor
+
+    class HeadlessWindow(QWidget):
+        """代替主窗口接收 TalkManager 的回调（槽与 MainWindow 同名），并记录各节点的时间"""
+
+        def __init__(self):
+            super().__init__()
+            self.character_label = QLabel(self)
+            self.talk_manager = None
+            self.trace = None
+            self.failed = False
+
+        def _mark(self, label):
+            if self.trace is not None and self.trace.elapsed(label) is None:
+                self.trace.mark(label)
+
+        @pyqtSlot(str)
+        def display_ai_response(self, response):
+            self.talk_manager.show_bubble(response)
+            if response.startswith("获取回复时出错"):
+                self.failed = True
+            self._mark("回复完成")
+
+        @pyqtSlot()
+        def begin_ai_stream(self):
+            self.talk_manager.speech_bubble.begin_stream()
+            self._mark("首字")
+
+        @pyqtSlot(str)
+        def stream_ai_delta(self, delta):
+            self.talk_manager.speech_bubble.append_stream(delta)
+
+        @pyqtSlot()
+        def end_ai_stream(self):
+            self.talk_manager.speech_bubble.end_stream()
+            self._mark("回复完成")
+
+        @pyqtSlot()
+        def on_heart_changed(self):
+            self._mark("好感度判断")
+
+        @pyqtSlot()
+        def on_talk_complete(self):
+            self._mark("本轮结束")
+
+    def idle(executor):
+        return all(not lane["running"] and not lane["queued"] for lane in executor.stats().values())
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    executor = TaskExecutor.instance()
+    window = HeadlessWindow()
+    with quiet(args.verbose):
+        api = DeepSeekAPI(
+            character_prompt=CharacterLoader.load_character(), history_manager=history_manager,
+            memory_manager=memory_manager, heart_manager=heart
+        )
+        talk = TalkManager(api, history_manager, None, window, memory_manager, heart)
+    window.talk_manager = talk
+
+    samples = {label: [] for label in TURN_MARKS}
+    per_turn = []
+    failures = 0
+    kinds_before = responder.snapshot()
+    server.reset_stats()
+    started = time.perf_counter()
+    with quiet(args.verbose):
+        for index in range(args.turns):
+            requests_before = server.requests
+            window.trace = LatencyTrace(f"第{index + 1}轮")
+            window.failed = False
+            talk.send_msg(USER_INPUTS[index % len(USER_INPUTS)])
+            give_up = time.monotonic() + 120
+            while window.trace.elapsed("本轮结束") is None or not idle(executor):
+                if time.monotonic() > give_up:
+                    break
+                app.processEvents()
+                time.sleep(0.001)
+            app.processEvents()
+            window.trace.mark("整轮")
+            failures += window.failed
+            per_turn.append(server.requests - requests_before)
+            for label in TURN_MARKS:
+                elapsed = window.trace.elapsed(label)
+                if elapsed is not None:
+                    samples[label].append(elapsed)
+    wall = time.perf_counter() - started
+    kinds = responder.snapshot() - kinds_before
+    talk.cancel_pending()
+
+    mode = "合并判断" if api.combined_judge else "单独判断"
+    print(f"\n== TalkManager 对话轮次（{'流式' if api.stream else '非流式'}，{mode}）")
+    for label in TURN_MARKS:
+        if samples[label]:
+            report(label, samples[label])
+    breakdown = "，".join(f"{kind} {count / args.turns:.2f}" for kind, count in sorted(kinds.items()))
+    print(f"{'':<18} 每轮请求 平均 {sum(per_turn) / args.turns:.2f} 次  最多 {max(per_turn)} 次（{breakdown}）")
+    report_throughput("turns", args.turns, failures, server.requests, wall)
+    print(f"{'':<18} 每分钟可完成 {args.turns / wall * 60:.1f} 轮")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="桌宠端到端延迟基准（本地模拟接口）")
+    parser.add_argument("--calls", type=int, default=20, help="get_response / judge_change 的调用次数")
+    parser.add_argument("--concurrency", type=int, default=1, help="get_response 的并发数")
+    parser.add_argument("--batches", type=int, default=3, help="记忆整理的批数")
+    parser.add_argument("--turns", type=int, default=20, help="完整对话轮数")
+    parser.add_argument("--latency", type=float, default=0.05, help="模拟接口返回响应头前的等待（秒）")
+    parser.add_argument("--ttfb", type=float, default=0.2, help="模拟接口第一段内容前的等待（秒）")
+    parser.add_argument("--chunk-interval", type=float, default=0.02, help="流式事件间隔（秒）")
+    parser.add_argument("--chunk-chars", type=int, default=2, help="每个流式事件的字符数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="注入错误的比例")
+    parser.add_argument("--error-status", type=int, default=500, help="注入错误的状态码，0 表示断开连接")
+    parser.add_argument("--rpm", type=int, default=0, help="客户端限流的每分钟请求数，0 表示不限制")
+    parser.add_argument("--no-stream", dest="stream", action="store_false", help="对话不使用流式")
+    parser.add_argument("--combined", action="store_true", help="使用合并判断模式")
+    parser.add_argument("--seed", type=int, default=1, help="错误注入的随机种子")
+    parser.add_argument("--verbose", action="store_true", help="同时输出程序自身的日志")
+    args = parser.parse_args()
+
+    responder = Responder()
+    server = MockServer(
+        latency=args.latency, ttfb=args.ttfb, chunk_interval=args.chunk_interval,
+        chunk_chars=args.chunk_chars, error_rate=args.error_rate, error_status=args.error_status,
+        retry_after=0, responder=responder, seed=args.seed
+    ).start()
+    os.environ["REQUESTS_CA_BUNDLE"] = server.cert_file
+    sandbox = tempfile.TemporaryDirectory()
+    use_sandbox(sandbox.name)
+    write_api_config(server, args)
+    with quiet(args.verbose):
+        begin.initialize_all()
+
+    print(f"模拟接口: 响应头 {args.latency * 1000:.0f}ms  首字 {args.ttfb * 1000:.0f}ms  "
+          f"流式间隔 {args.chunk_interval * 1000:.0f}ms/{args.chunk_chars}字  "
+          f"错误注入 {args.error_rate:.0%}（{args.error_status or '断开连接'}）")
+
+    from core.history_manager import TalkHistoryManager
+    from core.state_store import LongTermStateStore
+
+    history_manager = None
+    try:
+        bench_get_response(server, args)
+        heart = bench_judge(server, args)
+        with quiet(args.verbose):
+            history_manager = TalkHistoryManager()
+        try:
+            memory_manager = bench_memory(server, args, history_manager)
+            bench_turns(server, args, responder, history_manager, memory_manager, heart)
+        except ImportError as e:
+            print(f"\n未安装 PyQt5，跳过记忆整理和对话管线（{e}）")
+    finally:
+        with quiet(args.verbose):
+            if "utils.executor" in sys.modules:
+                sys.modules["utils.executor"].TaskExecutor.instance().shutdown()
+            if history_manager is not None:
+                history_manager.close()
+            LongTermStateStore.instance().close()
+            SessionPool.instance().close()
+        server.stop()
+        sandbox.cleanup()
+
+
+if __name__ == "__main__":
+    main()
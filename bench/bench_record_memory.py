@@ -0,0 +1,70 @@
+"""
+对话记录内存占用基准
+
+分别以旧格式（字典 + 字符串时间戳）和 TalkRecord 加载同一份 JSON 历史，
+用 tracemalloc 统计常驻内存，输出每条记录的平均字节数。
+
+用法：python bench/bench_record_memory.py [记录条数]
+"""
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.talk_record import TalkRecord
+
+ROLES = ("user", "assistant", "event")
+
+
+def build_json(count):
+    """生成与 talk_log.json 相同格式的历史文本"""
+    start = int(time.mktime((2023, 1, 1, 0, 0, 0, 0, 0, -1)))
+    talks = []
+    for talk_id in range(count):
+        talks.append({
+            "id": talk_id,
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start + talk_id * 90)),
+            "role": ROLES[talk_id % 3],
+            "content": f"第{talk_id}条消息，今天天气不错，一起出去走走吧"
+        })
+    return json.dumps(talks, ensure_ascii=False)
+
+
+def measure(load, text):
+    """加载后常驻内存（字节）和耗时"""
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = load(text)
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, elapsed
+
+
+def load_dicts(text):
+    return json.loads(text)
+
+
+def load_records(text):
+    return [TalkRecord.from_dict(talk) for talk in json.loads(text)]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    text = build_json(count)
+    print(f"记录条数: {count}")
+
+    for name, load in (("dict（旧）", load_dicts), ("TalkRecord（新）", load_records)):
+        result, current, elapsed = measure(load, text)
+        print(f"{name:<16} 共 {current / 1024 / 1024:7.2f} MiB  每条 {current / count:6.1f} 字节  加载 {elapsed:.2f}s")
+        del result
+
+
+if __name__ == "__main__":
+    main()
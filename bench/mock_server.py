@@ -0,0 +1,221 @@
+"""
+本地模拟 HTTPS 接口服务器（OpenAI 兼容的 /v1/chat/completions）
+
+仅用于基准测试：启动时用 openssl 生成临时自签名证书，统计建立的 TCP 连接数，
+以便对比是否复用了长连接。客户端需把 REQUESTS_CA_BUNDLE 指向 cert_file。
+
+可以模拟真实接口的时延和故障（均可在运行中修改）：
+  - latency: 收到请求后多久返回响应头（排队、网络往返）
+  - ttfb: 响应头之后多久生成第一段内容（非流式时整段回复生成完才返回）
+  - chunk_interval / chunk_chars: 流式事件的间隔（秒）和每个事件的字符数
+  - error_rate / error_status: 按概率注入错误，error_status 为 HTTP 状态码，
+    为 0 时模拟连接中途断开（流式时先发出一部分内容）
+  - responder: 可选，responder(请求体) 返回回复文本，默认总是返回 reply
+回复附带 usage 段（按字符数粗略计算的词元数）。
+
+单独运行：python bench/mock_server.py [端口] [--latency 秒] [--ttfb 秒] [--chunk-interval 秒]
+          [--error-rate 比例] [--error-status 状态码]
+"""
+import argparse
+import json
+import os
+import random
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_certificate(directory):
+    """生成 localhost / 127.0.0.1 的自签名证书，返回 (证书, 私钥) 路径"""
+    cert_file = os.path.join(directory, "cert.pem")
+    key_file = os.path.join(directory, "key.pem")
+    subprocess.run([
+        "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+        "-keyout", key_file, "-out", cert_file, "-subj", "/CN=localhost",
+        "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1"
+    ], check=True, capture_output=True)
+    return cert_file, key_file
+
+
+def count_tokens(text):
+    """粗略的词元数（模拟 usage 用，与客户端的估算无关）"""
+    return max(1, len(text) * 2 // 3)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """按服务器设置的时延和故障返回回复的聊天接口"""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.stats_lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        server = self.server
+        with server.stats_lock:
+            server.requests += 1
+            fail = server.error_rate and server.random.random() < server.error_rate
+            if fail:
+                server.errors += 1
+
+        reply = server.responder(request) if server.responder else server.reply
+        prompt_tokens = sum(count_tokens(json.dumps(m.get("content"), ensure_ascii=False))
+                            for m in request.get("messages", []))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": count_tokens(reply),
+                 "total_tokens": prompt_tokens + count_tokens(reply)}
+
+        if server.latency:
+            time.sleep(server.latency)
+        if fail and server.error_status:
+            self._send_error(server.error_status)
+            return
+        if request.get("stream"):
+            include_usage = (request.get("stream_options") or {}).get("include_usage")
+            self._send_stream(reply, usage if include_usage else None, drop=fail)
+            return
+        if fail:
+            # 不返回任何内容直接断开
+            self.close_connection = True
+            return
+
+        time.sleep(server.ttfb + server.chunk_interval * (self._chunk_count(reply) - 1))
+        body = json.dumps({
+            "choices": [{"message": {"role": "assistant", "content": reply}}],
+            "usage": usage
+        }, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _chunk_count(self, reply):
+        return max(1, -(-len(reply) // self.server.chunk_chars))
+
+    def _send_error(self, status):
+        """返回注入的 HTTP 错误，429 附带 Retry-After"""
+        body = json.dumps({"error": {"message": "injected error", "type": "mock"}}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if status == 429 and self.server.retry_after is not None:
+            self.send_header("Retry-After", str(self.server.retry_after))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        """写入一个 HTTP 分块"""
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_stream(self, reply, usage, drop=False):
+        """以 SSE 分块返回回复，每个事件携带 chunk_chars 个字符；drop 时发出一半后断开"""
+        server = self.server
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self._write_chunk(b": keep-alive\n\n")
+        time.sleep(server.ttfb)
+
+        starts = range(0, len(reply), server.chunk_chars)
+        for position, start in enumerate(starts):
+            if drop and position >= len(starts) // 2:
+                self.close_connection = True
+                return
+            if position:
+                time.sleep(server.chunk_interval)
+            event = {"choices": [{"index": 0, "delta": {"content": reply[start:start + server.chunk_chars]}}]}
+            self._write_chunk(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+        if usage:
+            event = {"choices": [], "usage": usage}
+            self._write_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockServer(ThreadingHTTPServer):
+    """在后台线程运行的模拟 HTTPS 服务器"""
+
+    daemon_threads = True
+
+    def __init__(self, port=0, reply="（模拟回复）你好呀~", latency=0.0, ttfb=0.0, chunk_interval=0.0,
+                 chunk_chars=2, error_rate=0.0, error_status=500, retry_after=None, responder=None, seed=None):
+        super().__init__(("127.0.0.1", port), MockHandler)
+        self.reply = reply
+        self.latency = latency
+        self.ttfb = ttfb
+        self.chunk_interval = chunk_interval
+        self.chunk_chars = max(1, chunk_chars)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.responder = responder
+        self.random = random.Random(seed)
+        self.connections = 0
+        self.requests = 0
+        self.errors = 0
+        self.stats_lock = threading.Lock()
+
+        self._cert_dir = tempfile.TemporaryDirectory()
+        self.cert_file, key_file = make_certificate(self._cert_dir.name)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(self.cert_file, key_file)
+        self.socket = context.wrap_socket(self.socket, server_side=True)
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"https://127.0.0.1:{self.server_address[1]}/v1/chat/completions"
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.connections = 0
+            self.requests = 0
+            self.errors = 0
+
+    def handle_error(self, request, client_address):
+        """客户端取消请求或注入断开时连接会被中途关闭，这类错误不打印"""
+        pass
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._cert_dir.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地模拟 OpenAI 兼容聊天接口")
+    parser.add_argument("port", nargs="?", type=int, default=8443)
+    parser.add_argument("--latency", type=float, default=0.0, help="返回响应头前的等待（秒）")
+    parser.add_argument("--ttfb", type=float, default=0.0, help="第一段内容前的等待（秒）")
+    parser.add_argument("--chunk-interval", type=float, default=0.0, help="流式事件间隔（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="注入错误的比例")
+    parser.add_argument("--error-status", type=int, default=500, help="注入错误的状态码，0 表示断开连接")
+    args = parser.parse_args()
+
+    server = MockServer(
+        args.port, latency=args.latency, ttfb=args.ttfb, chunk_interval=args.chunk_interval,
+        error_rate=args.error_rate, error_status=args.error_status
+    ).start()
+    print(f"模拟接口已启动: {server.url}")
+    print(f"证书: {server.cert_file}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
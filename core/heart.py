@@ -1,10 +1,9 @@
-import json
-import os
 import re
-from datetime import datetime
 from utils.config import Config
-from api.api_client import send_api_request, load_api_config
+from utils.config_registry import ConfigRegistry
+from api.api_client import send_api_request, request_with_failover, load_api_config, JUDGE_TRAILER_PATTERN
 from utils.begin import DEFAULT_FAVORABILITY
+from core.state_store import LongTermStateStore
 
 
 class HeartManager:
@@ -12,37 +11,36 @@ class HeartManager:
     
     def __init__(self):
         self.score = 0
-        self.file_path = "log/long.json"
-        self.history_file = "log/talk_log.json"
-        self.favorability_config = self._load_favorability_config()
+        self.state = LongTermStateStore.instance()
         self.load_score()
     
-    def _load_favorability_config(self):
-        """加载好感度配置"""
-        try:
-            char_file = Config.get_full_path("txt/character.json")
-            with open(char_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                if "favorability" in data and isinstance(data["favorability"], list):
-                    return data["favorability"]
-        except Exception as e:
-            print(f"加载好感度配置失败: {e}")
+    @property
+    def favorability_config(self):
+        """好感度等级配置（取自 character.json，文件修改后自动生效）"""
+        data = ConfigRegistry.instance().get(Config.CHARACTER_FILE, {})
+        levels = data.get("favorability")
+        if isinstance(levels, tuple) and levels:
+            return levels
         return DEFAULT_FAVORABILITY
     
-    def get_level_info(self, score=None):
-        """根据分数获取当前等级完整信息"""
-        if score is None:
-            score = self.score
-        
-        for level in self.favorability_config:
+    @staticmethod
+    def _find_level(levels, score):
+        """在给定的等级配置中查找分数所在的等级"""
+        for level in levels:
             min_range, max_range = level["range"]
             if min_range <= score <= max_range:
                 return level
         
-        if score < self.favorability_config[0]["range"][0]:
-            return self.favorability_config[0]
+        if score < levels[0]["range"][0]:
+            return levels[0]
         else:
-            return self.favorability_config[-1]
+            return levels[-1]
+    
+    def get_level_info(self, score=None):
+        """根据分数获取当前等级完整信息"""
+        if score is None:
+            score = self.score
+        return self._find_level(self.favorability_config, score)
     
     def get_level(self, score=None):
         """根据分数获取当前等级标签"""
@@ -54,38 +52,12 @@ class HeartManager:
         return f"当前好感度：{self.score}（{info['label']}）- {info['desc']}"
     
     def load_score(self):
-        """从long.json加载好感度"""
-        try:
-            abs_path = Config.get_full_path(self.file_path)
-            if os.path.exists(abs_path):
-                with open(abs_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.score = data.get("favorability", 0)
-            else:
-                self.score = 0
-                self.save_score()
-        except Exception as e:
-            print(f"加载好感度失败: {e}，初始化为0")
-            self.score = 0
+        """从共享状态加载好感度"""
+        self.score = self.state.favorability
     
     def save_score(self):
-        """保存好感度"""
-        try:
-            abs_path = Config.get_full_path(self.file_path)
-            data = {}
-            
-            if os.path.exists(abs_path):
-                with open(abs_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-            
-            data["favorability"] = self.score
-            
-            os.makedirs(os.path.dirname(abs_path), exist_ok=True)
-            
-            with open(abs_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"保存好感度失败: {e}")
+        """保存好感度（由共享状态的写入线程落盘）"""
+        self.state.favorability = self.score
     
     def judge_change(self, user_msg, ai_response, api_key=None):
         """调用API判断好感度变化"""
@@ -93,9 +65,6 @@ class HeartManager:
         api_config = load_api_config()
         chat_config = api_config["chat_api"]
         
-        if api_key is None:
-            api_key = chat_config["api_key"]
-        
         prompt = self._build_judge_prompt(user_msg, ai_response)
         
         data = {
@@ -107,7 +76,11 @@ class HeartManager:
         }
         
         try:
-            response = send_api_request(chat_config["api_url"], api_key, data)
+            if api_key is None:
+                # 后台任务，可路由到 background_api 配置的端点
+                response = request_with_failover("background", data)
+            else:
+                response = send_api_request(chat_config["api_url"], api_key, data)
             return self._parse_response(response)
         except Exception as e:
             print(f"好感度判断请求失败: {e}")
@@ -115,13 +88,14 @@ class HeartManager:
     
     def _build_judge_prompt(self, user_msg, ai_response):
         """构建判断提示词"""
-        level_info = self.get_level_info()
+        levels = self.favorability_config
+        level_info = self._find_level(levels, self.score)
         
         return f"""你是一只桌宠AI，以下是你的角色设定和内心状态：
 
 【角色设定】
 当前好感度等级配置：
-{chr(10).join([f"• {item['label']}（{item['range'][0]}至{item['range'][1]}分）：{item['desc']}" for item in self.favorability_config])}
+{chr(10).join([f"• {item['label']}（{item['range'][0]}至{item['range'][1]}分）：{item['desc']}" for item in levels])}
 
 【当前内心状态】
 当前等级：{level_info['label']}
@@ -159,6 +133,29 @@ class HeartManager:
 请输出格式为："好感度+数字" 或 "好感度-数字"，数字范围0~3。
 只输出这四个字和数字，不要有其他内容。"""
     
+    def build_judge_instruction(self):
+        """合并判断模式下附加在对话请求中的说明，要求在回复末尾带上好感度标记"""
+        level_info = self.get_level_info()
+        return f"""【好感度判断】正常回复完成后，另起一行，站在你的角色立场判断用户这句话让你的好感度如何变化，
+按格式输出：【好感度+数字】或【好感度-数字】，数字范围0~3。
+当前等级：{level_info['label']}（{self.score}分），判断时遵循该等级的心理预期：
+被重视、被关心、聊到感兴趣的话题时增加；被冒犯、被无视、被敷衍时减少。
+这一行只用于系统记录，不要在回复正文中提及好感度。"""
+    
+    def split_judge_trailer(self, text):
+        """
+        拆分合并判断模式的回复
+        
+        标记不一定在最后，以最后一个标记为准，回复中的所有标记都会被删去。
+        
+        Returns:
+            tuple: (去掉标记的回复, 变化值)，没有标记时变化值为 None
+        """
+        matches = list(JUDGE_TRAILER_PATTERN.finditer(text or ""))
+        if not matches:
+            return text, None
+        return JUDGE_TRAILER_PATTERN.sub("", text).rstrip(), self._parse_response(matches[-1].group(0))
+    
     def _parse_response(self, response):
         """解析API响应，提取变化值"""
         if not response:
@@ -181,14 +178,15 @@ class HeartManager:
     
     def update(self, change_value):
         """更新好感度分数"""
+        levels = self.favorability_config
         if change_value is None:
-            return self.score, self.get_level(), False
+            return self.score, self._find_level(levels, self.score)["label"], False
         
-        old_level = self.get_level()
+        old_level = self._find_level(levels, self.score)["label"]
         old_score = self.score
         self.score += change_value
         
-        new_level = self.get_level()
+        new_level = self._find_level(levels, self.score)["label"]
         level_changed = (old_level != new_level)
         
         self.save_score()
@@ -200,34 +198,17 @@ class HeartManager:
         
         return self.score, new_level, level_changed
     
-    def log_heart_change_to_last_talk(self, change_value):
-        """将好感度变化记录到最新的对话条目中"""
-        if change_value is None or change_value == 0:
+    def log_heart_change_to_last_talk(self, change_value, history_manager, talk_id=None):
+        """将好感度变化记录到指定的桌宠回复中，未指定时记录到最新一条"""
+        if change_value is None or change_value == 0 or history_manager is None:
             return
         
         try:
-            abs_path = Config.get_full_path(self.history_file)
-            if not os.path.exists(abs_path):
-                return
-            
-            with open(abs_path, 'r', encoding='utf-8') as f:
-                content = f.read().strip()
-                if not content:
-                    return
-                log_data = json.loads(content)
-            
-            if not log_data:
-                return
-            
-            for i in range(len(log_data) - 1, -1, -1):
-                if log_data[i]["role"] == "assistant":
-                    log_data[i]["heart"] = self.score
-                    log_data[i]["heartchange"] = f"{change_value:+d}"
-                    break
-            
-            with open(abs_path, 'w', encoding='utf-8') as f:
-                json.dump(log_data, f, ensure_ascii=False, indent=2)
-                
+            fields = {"heart": self.score, "heartchange": f"{change_value:+d}"}
+            if talk_id is None:
+                history_manager.annotate_last("assistant", **fields)
+            else:
+                history_manager.update_talk(talk_id, **fields)
         except Exception as e:
             print(f"记录好感度变化到对话日志失败: {e}")
     
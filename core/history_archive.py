@@ -0,0 +1,69 @@
+"""
+对话历史归档与导出
+
+运行中的 TalkHistoryManager 会在后台合并日志后自动调用 archive_history。
+已有安装也可以在桌宠未运行时手动执行一次：
+
+    python -m core.history_archive archive          # 迁移旧版文件、合并日志并归档旧分段
+    python -m core.history_archive export 输出文件   # 把全部历史（含归档）导出为一个 JSON 文件
+"""
+import sys
+from datetime import date, timedelta
+from utils.config import Config
+from core.history_store import create_history_store
+from core.persistence import atomic_write_json
+from core.state_store import LongTermStateStore
+
+
+def archive_history(store, processed_id, days=None):
+    """
+    归档早于 days 天、且已整理进长期记忆（ID不大于 processed_id）的分段
+
+    Returns:
+        int: 本次归档的分段数量，存储不支持归档时返回 0
+    """
+    if not hasattr(store, "archive"):
+        return 0
+    if days is None:
+        days = Config.HISTORY_ARCHIVE_DAYS
+    before_day = (date.today() - timedelta(days=days)).isoformat()
+    return store.archive(before_day, processed_id)
+
+
+def export_history(store, output_file):
+    """按日期顺序导出全部历史记录（包括已归档的分段），按天分段的存储需先合并日志"""
+    talks = []
+    for day in store.recorded_dates():
+        talks.extend(store.talks_by_date(day))
+    atomic_write_json(output_file, talks)
+    return len(talks)
+
+
+def main(argv):
+    """命令行入口"""
+    if not argv or argv[0] not in ("archive", "export") or (argv[0] == "export" and len(argv) < 2):
+        print(__doc__)
+        return 1
+
+    processed_id = LongTermStateStore.instance().processed_id
+    store = create_history_store(Config.HISTORY_FILE)
+    history = store.load(Config.MAX_HISTORY_MESSAGES, processed_id)
+    if not store.indexed:
+        # 先把日志合并进分段，导出和归档才能看到尚未合并的记录
+        store.compact(history, store.next_id)
+
+    if argv[0] == "export":
+        count = export_history(store, argv[1])
+        print(f"已导出{count}条历史记录到 {argv[1]}")
+        return 0
+
+    if store.indexed:
+        print("SQLite 后端按索引查询，不需要归档")
+        return 0
+    count = archive_history(store, processed_id)
+    print(f"日志已合并，本次归档{count}个分段")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,88 +1,405 @@
-import json
-from datetime import datetime
+import time
+from collections import deque
 from threading import Lock
 from utils.config import Config
+from core.history_store import create_history_store
+from core.history_archive import archive_history
+from core.talk_record import TalkRecord, records_from_dicts
+from core.persistence import WriteBehindWriter
+from core.state_store import LongTermStateStore
+
+class HistorySnapshot:
+    """
+    某一版本历史的只读视图
+
+    与管理器共享底层列表而不复制：新增记录只追加在视图长度之外，修改和删除前管理器会先
+    复制列表（写时复制），因此视图内容在创建后不会再变化。tail(n) 和 count() 只与 n 和
+    墓碑数量有关，与历史总长度无关。
+    """
+
+    __slots__ = ("version", "_items", "_length", "_tombstones", "_tuple")
+
+    def __init__(self, version, items, length, tombstones):
+        self.version = version
+        self._items = items
+        self._length = length
+        self._tombstones = tombstones
+        self._tuple = None
+
+    def count(self):
+        """记录条数"""
+        return self._length - len(self._tombstones)
+
+    def tail(self, n):
+        """最近 n 条记录（按ID升序）"""
+        result = []
+        pos = self._length - 1
+        while pos >= 0 and len(result) < n:
+            talk = self._items[pos]
+            if talk.id not in self._tombstones:
+                result.append(talk)
+            pos -= 1
+        result.reverse()
+        return result
+
+    def _as_tuple(self):
+        """完整内容，首次需要时才生成"""
+        if self._tuple is None:
+            self._tuple = tuple(
+                talk for talk in self._items[:self._length] if talk.id not in self._tombstones
+            )
+        return self._tuple
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return iter(self._as_tuple())
+
+    def __reversed__(self):
+        return reversed(self._as_tuple())
+
+    def __getitem__(self, index):
+        return self._as_tuple()[index]
+
+
+def _record_id(record):
+    """变更记录针对的记录ID"""
+    return record["talk"]["id"] if record["op"] == "add" else record["id"]
+
+
+def context_message(talk):
+    """把一条记录转换为发给模型的上下文消息（互动事件以用户身份发送）"""
+    if talk.role == "event":
+        return {"role": "user", "content": f"[互动事件] {talk.content}"}
+    role = "user" if talk.role == "user" else "assistant"
+    return {"role": role, "content": talk.content}
+
 
 class TalkHistoryManager:
-    """管理对话历史记录"""
-    
+    """
+    管理对话历史记录
+
+    记录ID单调递增且永不复用，内存中按ID升序排列并维护 ID→位置 索引。
+    删除只打墓碑标记，由后台统一压缩，增删改都不再整体重排和重写文件。
+    所有变更先记入待写队列，由专用写入线程合并后落盘，调用线程（包括UI线程）不访问磁盘。
+    启动时只加载近期记录（上下文窗口和尚未整理进长期记忆的部分），更早的记录按日期从存储读取。
+    内存中的记录是只读的 TalkRecord，修改时整条替换。读取方通过 snapshot()/tail()/count()
+    拿到带版本号的只读快照，无需复制整个历史；快照发出后，修改前先复制列表（写时复制）。
+    最近 CONTEXT_MAX_MESSAGES 条记录另外以上下文消息格式保存在定长队列中，新增记录时直接追加，
+    构建请求时 context_window() 的开销只与窗口大小有关。
+    """
+
     def __init__(self, history_file=None):
         if history_file is None:
             history_file = Config.HISTORY_FILE
-        
+
         self.history_file = history_file
+        self.store = create_history_store(history_file)
         self.history = []
         self.history_lock = Lock()
+        self._index = {}
+        self._tombstones = set()
+        self._next_id = 0
+        self._version = 0  # 每次变更加一
+        self._snapshot = None  # 当前版本的快照，版本变化时作废
+        self._shared = False  # 当前列表是否已被快照引用
+        self._context = deque(maxlen=Config.CONTEXT_MAX_MESSAGES)  # 最近记录的上下文消息
+        self._pending = []
+        self._last_compact = time.monotonic()
+        self._compact_requested = False
+        self._load_ok = True  # 加载不完整时不合并，避免用残缺的内容覆盖分段文件
         self.load_history()
-        self.reorganize_ids()
-    
+
+        # 后台写入线程：合并变更、定时合并日志和清理墓碑
+        self._writer = WriteBehindWriter(
+            self._flush_pending,
+            interval=Config.HISTORY_COMPACT_INTERVAL,
+            name="HistoryWriter"
+        )
+
     def load_history(self):
-        """从文件加载历史记录"""
+        """从存储加载近期历史记录"""
         try:
-            with open(self.history_file, 'r', encoding='utf-8') as f:
-                content = f.read().strip()
-                self.history = json.loads(content) if content else []
+            talks = self.store.load(
+                max(Config.MAX_HISTORY_MESSAGES, Config.CONTEXT_MAX_MESSAGES),
+                LongTermStateStore.instance().processed_id
+            )
+            self.history, skipped = records_from_dicts(talks)
+            self._next_id = self.store.next_id
+            if skipped:
+                self._load_ok = False
+                print(f"历史记录中有{skipped}条无法解析，本次运行不合并日志，原文件保持不变")
         except Exception as e:
-            print(f"加载历史记录失败: {e}")
+            print(f"加载历史记录失败: {e}，本次运行不合并日志")
             self.history = []
-    
+            self._next_id = max(self._next_id, getattr(self.store, "next_id", 0))
+            self._load_ok = False
+        self._rebuild_index()
+
+    def _rebuild_index(self):
+        """重建 ID→位置 索引"""
+        self._index = {talk.id: pos for pos, talk in enumerate(self.history)}
+        self._touch()
+        self._shared = False
+        self._rebuild_context()
+
+    def _rebuild_context(self):
+        """按最近的有效记录重建上下文消息队列（调用方需持有 history_lock，只在修改和删除时调用）"""
+        recent = []
+        pos = len(self.history) - 1
+        while pos >= 0 and len(recent) < self._context.maxlen:
+            talk = self.history[pos]
+            if talk.id not in self._tombstones:
+                recent.append(context_message(talk))
+            pos -= 1
+        self._context.clear()
+        self._context.extend(reversed(recent))
+
+    def _touch(self):
+        """标记历史已变化（调用方需持有 history_lock）"""
+        self._version += 1
+        self._snapshot = None
+
+    def _replace_at(self, pos, talk):
+        """替换指定位置的记录，列表被快照引用时先复制（调用方需持有 history_lock）"""
+        if self._shared:
+            self.history = list(self.history)
+            self._shared = False
+        self.history[pos] = talk
+
+    def _queue(self, record):
+        """记入待写队列并通知写入线程（调用方需持有 history_lock）"""
+        self._touch()
+        self._pending.append(record)
+        self._writer.mark_dirty()
+
+    def _flush_pending(self):
+        """写入线程：批量写入待写记录，按需合并日志（只在写入线程中调用）"""
+        with self.history_lock:
+            records, self._pending = self._pending, []
+        self.store.append_many(records)
+        if not self._load_ok:
+            return
+
+        due = time.monotonic() - self._last_compact >= Config.HISTORY_COMPACT_INTERVAL
+        force, self._compact_requested = self._compact_requested, False
+        if not (force or self._needs_compaction(due) or (due and self._tombstones)):
+            return
+
+        with self.history_lock:
+            self._purge_tombstones()
+            if not (force or self._needs_compaction(due)):
+                self._last_compact = time.monotonic()
+                return
+            talks = [talk.to_dict() for talk in self.history]
+            next_id = self._next_id
+            if self.store.snapshot_compaction:
+                # 快照已包含已加载记录此刻之前的全部变更，这些待写记录无需再写入；
+                # 针对未加载旧记录的变更不在快照中，仍留在队列里
+                hot_first_id = self.store.hot_first_id
+                self._pending = [
+                    record for record in self._pending if _record_id(record) < hot_first_id
+                ]
+        self.store.compact(talks, next_id)
+        self._last_compact = time.monotonic()
+
+        # 合并期间新增的变更不在快照中，直接写入日志
+        with self.history_lock:
+            records, self._pending = self._pending, []
+        self.store.append_many(records)
+        archive_history(self.store, LongTermStateStore.instance().processed_id)
+
+    def _needs_compaction(self, due):
+        """日志达到阈值，或到达定时合并时间且有未合并日志时需要合并"""
+        count = self.store.journal_count
+        return count >= Config.HISTORY_COMPACT_THRESHOLD or (due and count > 0)
+
+    def flush(self):
+        """同步写入所有待写变更"""
+        self._writer.flush()
+
     def save_history(self):
-        """保存历史记录到文件"""
-        try:
-            abs_path = Config.get_full_path(self.history_file)
-            with open(abs_path, 'w', encoding='utf-8') as f:
-                json.dump(self.history, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"保存历史记录失败: {e}")
-    
-    def _get_min_available_id(self):
-        """获取最小的可用ID"""
-        if not self.history:
-            return 0
-        used_ids = sorted([talk["id"] for talk in self.history])
-        for i, used_id in enumerate(used_ids):
-            if used_id != i:
-                return i
-        return len(used_ids)
-    
-    def reorganize_ids(self):
-        """重新整理所有记录的ID，使其从0开始连续"""
-        with self.history_lock:
-            needs_reorganize = False
-            for index, talk in enumerate(self.history):
-                if talk["id"] != index:
-                    needs_reorganize = True
-                    break
-            
-            if needs_reorganize:
-                print("检测到ID不连续，正在重新整理...")
-                # 重新分配ID
-                for index, talk in enumerate(self.history):
-                    talk["id"] = index
-                self.save_history()
-                print("ID整理完成")
-    
+        """同步写入待写变更并把完整历史合并进快照"""
+        self._compact_requested = True
+        self.flush()
+
+    def close(self):
+        """停止写入线程并写入剩余变更（程序退出时调用）"""
+        self._writer.close()
+
+    def _purge_tombstones(self):
+        """移除已删除的记录并重建索引（调用方需持有 history_lock）"""
+        if not self._tombstones:
+            return
+        self.history = self._live_talks()
+        self._tombstones.clear()
+        self._rebuild_index()
+
+    def _live_talks(self):
+        """未删除的记录列表（调用方需持有 history_lock）"""
+        if not self._tombstones:
+            return list(self.history)
+        return [talk for talk in self.history if talk.id not in self._tombstones]
+
+    def _position_after(self, talk_id):
+        """二分查找第一条ID大于 talk_id 的记录位置（调用方需持有 history_lock）"""
+        lo, hi = 0, len(self.history)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.history[mid].id <= talk_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
     def add_talk(self, role, content):
-        """添加对话记录"""
-        with self.history_lock:
-            talk_entry = {
-                "id": self._get_min_available_id(),
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "role": role,
-                "content": content
-            }
-            self.history.append(talk_entry)
-            self.save_history()
-    
+        """添加对话记录，返回新记录的ID"""
+        with self.history_lock:
+            talk = TalkRecord.create(self._next_id, role, content)
+            self._next_id += 1
+            self._index[talk.id] = len(self.history)
+            self.history.append(talk)
+            self._context.append(context_message(talk))
+            self._queue({"op": "add", "talk": talk.to_dict()})
+            return talk.id
+
+    def update_talk(self, talk_id, **fields):
+        """更新指定记录的字段，只追加一条日志"""
+        with self.history_lock:
+            pos = self._index.get(talk_id)
+            if pos is None or talk_id in self._tombstones:
+                return False
+            self._replace_at(pos, self.history[pos].replace(**fields))
+            if "content" in fields or "role" in fields:
+                self._rebuild_context()
+            self._queue({"op": "update", "id": talk_id, "fields": fields})
+            return True
+
+    def annotate_last(self, role, **fields):
+        """给最近一条指定角色的记录补充字段（如好感度变化），返回记录ID，找不到返回 None"""
+        with self.history_lock:
+            for pos in range(len(self.history) - 1, -1, -1):
+                talk = self.history[pos]
+                if talk.role == role and talk.id not in self._tombstones:
+                    self._replace_at(pos, talk.replace(**fields))
+                    if "content" in fields or "role" in fields:
+                        self._rebuild_context()
+                    self._queue({"op": "update", "id": talk.id, "fields": fields})
+                    return talk.id
+        return None
+
+    def snapshot(self):
+        """当前版本的只读快照，历史未变化时各调用方共享同一个对象"""
+        with self.history_lock:
+            if self._snapshot is None:
+                self._snapshot = HistorySnapshot(
+                    self._version, self.history, len(self.history), frozenset(self._tombstones)
+                )
+                self._shared = True
+            return self._snapshot
+
+    def tail(self, n):
+        """最近 n 条记录（按ID升序）"""
+        return self.snapshot().tail(n)
+
+    def context_window(self):
+        """最近 CONTEXT_MAX_MESSAGES 条记录的上下文消息（按时间顺序，调用方不要修改其中的字典）"""
+        with self.history_lock:
+            return list(self._context)
+
+    def count(self):
+        """已加载的记录条数"""
+        return self.snapshot().count()
+
     def get_all_talks(self):
-        """获取所有对话记录"""
+        """获取已加载的全部对话记录（只读快照）"""
+        return self.snapshot()
+
+    def get_last_talk(self):
+        """获取最新的一条记录，没有则返回 None"""
+        with self.history_lock:
+            for talk in reversed(self.history):
+                if talk.id not in self._tombstones:
+                    return talk
+        return None
+
+    def count_after(self, talk_id):
+        """ID大于 talk_id 的记录数量"""
+        with self.history_lock:
+            count = len(self.history) - self._position_after(talk_id)
+            return count - sum(1 for t_id in self._tombstones if t_id > talk_id)
+
+    def get_talks_after(self, talk_id, limit=None):
+        """按顺序获取ID大于 talk_id 的记录，最多 limit 条"""
+        with self.history_lock:
+            result = []
+            for talk in self.history[self._position_after(talk_id):]:
+                if talk.id in self._tombstones:
+                    continue
+                result.append(talk)
+                if limit is not None and len(result) >= limit:
+                    break
+            return result
+
+    def _hot_days(self):
+        """内存中已完整加载的日期集合（调用方需持有 history_lock）"""
+        return {talk.day for talk in self._live_talks()}
+
+    def get_recorded_dates(self):
+        """获取所有有记录的日期（升序）"""
+        if self.store.indexed:
+            # 索引查询前先写入待写变更，保证结果包含最新记录
+            self.flush()
+            return self.store.recorded_dates()
         with self.history_lock:
-            return self.history.copy()
-    
+            hot_days = self._hot_days()
+        return sorted(hot_days.union(self.store.recorded_dates()))
+
+    def get_older_dates(self):
+        """早于已加载记录的有记录日期（升序），历史对话框滚动到顶部时逐日读取"""
+        dates = self.get_recorded_dates()
+        with self.history_lock:
+            live = self._live_talks()
+        # 存储总是从整天开始加载，已加载的最早一天不会只显示一部分
+        first_day = live[0].day if live else None
+        return [day for day in dates if first_day is None or day < first_day]
+
+    def get_talks_by_date(self, date_str):
+        """获取某一天的对话记录，未加载的日期按需从存储读取"""
+        if self.store.indexed:
+            self.flush()
+            return records_from_dicts(self.store.talks_by_date(date_str))[0]
+        with self.history_lock:
+            if date_str in self._hot_days():
+                return [talk for talk in self._live_talks() if talk.day == date_str]
+        return records_from_dicts(self.store.talks_by_date(date_str))[0]
+
+    def search_talks(self, keyword, limit=200):
+        """按内容搜索对话记录，返回最近的若干条"""
+        if self.store.indexed:
+            self.flush()
+            return records_from_dicts(self.store.search(keyword, limit))[0]
+        with self.history_lock:
+            hot_days = self._hot_days()
+            matches = [talk for talk in self._live_talks() if keyword in talk.content]
+        if len(matches) < limit:
+            older = self.store.search(keyword, limit - len(matches), exclude_days=hot_days)
+            matches = records_from_dicts(older)[0] + matches
+        return matches[-limit:]
+
     def delete_talk(self, talk_id):
-        """删除对话记录"""
+        """删除对话记录：只打墓碑并记一条变更，由后台压缩"""
         with self.history_lock:
-            self.history = [d for d in self.history if d["id"] != talk_id]
-            for index, talk in enumerate(self.history):
-                talk["id"] = index
-            self.save_history()
\ No newline at end of file
+            if talk_id in self._tombstones:
+                return False
+            if talk_id not in self._index:
+                # 未加载的旧记录直接记一条删除，由存储在合并时写回
+                if talk_id >= self.store.hot_first_id:
+                    return False
+                self._queue({"op": "delete", "id": talk_id})
+                return True
+            self._tombstones.add(talk_id)
+            self._rebuild_context()
+            self._queue({"op": "delete", "id": talk_id})
+            return True
@@ -0,0 +1,562 @@
+import bisect
+import gzip
+import json
+import os
+import sqlite3
+from threading import Lock
+from utils.config import Config
+from core.persistence import atomic_write_json
+
+
+def _day_of(talk):
+    """记录所属日期（YYYY-MM-DD）"""
+    return talk["timestamp"][:10]
+
+
+def _read_journal(journal_file):
+    """逐条读取追加日志，跳过写入中断留下的半行"""
+    if not os.path.exists(journal_file):
+        return
+    with open(journal_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                print("历史日志存在损坏的记录，已跳过")
+
+
+def _apply_records(talks, records):
+    """把 update/delete 记录应用到一组记录上"""
+    index = {talk["id"]: talk for talk in talks}
+    deleted = set()
+    for record in records:
+        if record["op"] == "update" and record["id"] in index:
+            index[record["id"]].update(record["fields"])
+        elif record["op"] == "delete":
+            deleted.add(record["id"])
+    if deleted:
+        talks = [talk for talk in talks if talk["id"] not in deleted]
+    return talks
+
+
+def read_legacy_history(legacy_file):
+    """
+    读取旧版单文件历史（talk_log.json 及其追加日志）
+
+    Returns:
+        tuple: (按ID升序的记录列表, 下一个可用ID)
+    """
+    legacy_file = Config.get_full_path(legacy_file)
+    history, next_id = [], 0
+    if os.path.exists(legacy_file):
+        with open(legacy_file, 'r', encoding='utf-8') as f:
+            content = f.read().strip()
+        data = json.loads(content) if content else []
+        if isinstance(data, dict):
+            next_id = data.get("next_id", 0)
+            history = data.get("talks", [])
+        else:
+            history = data
+
+    index = {talk["id"]: talk for talk in history}
+    records = []
+    for record in _read_journal(os.path.splitext(legacy_file)[0] + ".journal.jsonl"):
+        if record.get("op") == "add":
+            talk = record["talk"]
+            next_id = max(next_id, talk["id"] + 1)
+            if talk["id"] not in index:
+                history.append(talk)
+                index[talk["id"]] = talk
+        else:
+            records.append(record)
+    history = _apply_records(history, records)
+
+    # 早期版本删除时会重排ID，数据中可能出现重复或乱序，迁移时统一重新编号
+    ids = [talk["id"] for talk in history]
+    if not all(a < b for a, b in zip(ids, ids[1:])):
+        print("检测到ID重复或乱序，正在重新整理...")
+        for index, talk in enumerate(history):
+            talk["id"] = index
+        next_id = len(history)
+    elif history:
+        next_id = max(next_id, history[-1]["id"] + 1)
+    return history, next_id
+
+
+def _retire_legacy(legacy_file):
+    """迁移完成后把旧文件改名保留，避免重复导入"""
+    legacy_file = Config.get_full_path(legacy_file)
+    for path in (legacy_file, os.path.splitext(legacy_file)[0] + ".journal.jsonl"):
+        if os.path.exists(path):
+            os.replace(path, path + ".migrated")
+
+
+class JournalHistoryStore:
+    """
+    按天分段的快照 + 追加日志的对话历史存储
+
+    历史按日期拆成 log/talks/YYYY-MM-DD.json 分段文件，manifest.json 记录每段的日期、条数
+    和ID范围。变更只向 journal.jsonl 追加一行记录，后台合并时只重写内存中已加载的近期分段
+    和被改动过的旧分段。启动时按清单只加载最近若干天，更早的分段在浏览时按需读取。
+    足够旧且已整理进长期记忆的分段会被归档为 archive/YYYY-MM-DD.json.gz（清单中标记
+    archived），只在浏览历史或导出时打开。旧版的单文件 talk_log.json 会在首次加载时拆分迁移。
+
+    日志记录格式：
+        {"op": "add", "talk": {...}}
+        {"op": "update", "id": 3, "fields": {...}}
+        {"op": "delete", "id": 3}
+    """
+
+    indexed = False
+    snapshot_compaction = True  # compact() 会把已加载记录的快照写回分段
+
+    def __init__(self, data_dir, legacy_file=None):
+        self.data_dir = Config.get_full_path(data_dir)
+        self.archive_dir = os.path.join(self.data_dir, "archive")
+        self.manifest_file = os.path.join(self.data_dir, "manifest.json")
+        self.journal_file = os.path.join(self.data_dir, "journal.jsonl")
+        self.legacy_file = legacy_file
+        self.journal_count = 0
+        self.next_id = 0
+        self.segments = []  # 清单条目，按日期升序
+        self.hot_first_id = 0  # 已加载部分的最小ID，更小的ID都在未加载的分段里
+        self.lock = Lock()
+        self._loaded_days = set()
+        self._cold_records = []  # 针对未加载分段的 update/delete 记录，合并时写回
+
+    def _find_segment(self, day):
+        """二分查找某一天的清单条目位置，返回 (位置, 是否存在)"""
+        dates = [seg["date"] for seg in self.segments]
+        pos = bisect.bisect_left(dates, day)
+        return pos, pos < len(dates) and dates[pos] == day
+
+    def _is_archived(self, day):
+        """某一天的分段是否已归档"""
+        pos, exists = self._find_segment(day)
+        return exists and self.segments[pos].get("archived", False)
+
+    def _segment_path(self, day, archived=None):
+        """分段文件路径，已归档的分段为压缩文件"""
+        if archived is None:
+            archived = self._is_archived(day)
+        if archived:
+            return os.path.join(self.archive_dir, f"{day}.json.gz")
+        return os.path.join(self.data_dir, f"{day}.json")
+
+    def _read_manifest(self):
+        """读取清单"""
+        if not os.path.exists(self.manifest_file):
+            return
+        with open(self.manifest_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.next_id = data.get("next_id", 0)
+        self.segments = sorted(data.get("segments", []), key=lambda seg: seg["date"])
+
+    def _write_manifest(self):
+        """原子写入清单"""
+        atomic_write_json(self.manifest_file, {"next_id": self.next_id, "segments": self.segments})
+
+    def _read_segment(self, day):
+        """读取某一天的分段"""
+        path = self._segment_path(day)
+        if not os.path.exists(path):
+            return []
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _write_segment(self, day, talks, archived=None):
+        """写入某一天的分段并更新清单条目，没有记录时删除该分段；archived 为 None 时保持原状态"""
+        pos, exists = self._find_segment(day)
+        if archived is None:
+            archived = exists and self.segments[pos].get("archived", False)
+        path = self._segment_path(day, archived)
+
+        if not talks:
+            if exists:
+                del self.segments[pos]
+            if os.path.exists(path):
+                os.remove(path)
+            return
+
+        atomic_write_json(path, talks, compress=archived)
+        entry = {"date": day, "count": len(talks), "first_id": talks[0]["id"], "last_id": talks[-1]["id"]}
+        if archived:
+            entry["archived"] = True
+        if exists:
+            self.segments[pos] = entry
+        else:
+            self.segments.insert(pos, entry)
+
+    def _day_for_id(self, talk_id):
+        """根据ID范围找到所在分段的日期"""
+        first_ids = [seg["first_id"] for seg in self.segments]
+        pos = bisect.bisect_right(first_ids, talk_id) - 1
+        if pos >= 0 and talk_id <= self.segments[pos]["last_id"]:
+            return self.segments[pos]["date"]
+        return None
+
+    def _migrate_legacy(self):
+        """没有清单时把旧版单文件历史拆分成按天分段"""
+        if os.path.exists(self.manifest_file) or not self.legacy_file:
+            return
+        if not os.path.exists(Config.get_full_path(self.legacy_file)):
+            return
+
+        history, self.next_id = read_legacy_history(self.legacy_file)
+        print(f"正在将{len(history)}条历史记录拆分为按天分段...")
+        by_day = {}
+        for talk in history:
+            by_day.setdefault(_day_of(talk), []).append(talk)
+        for day, talks in by_day.items():
+            self._write_segment(day, talks)
+        self._write_manifest()
+        _retire_legacy(self.legacy_file)
+        print("历史记录迁移完成")
+
+    def load(self, min_count, min_id):
+        """
+        加载近期记录
+
+        从最新的分段往前加载，直到至少有 min_count 条记录，并且覆盖所有ID大于 min_id
+        （记忆整理水位）的记录，然后重放日志。
+
+        Returns:
+            list: 按ID升序的已加载记录
+        """
+        with self.lock:
+            os.makedirs(self.data_dir, exist_ok=True)
+            self._migrate_legacy()
+            self._read_manifest()
+
+            chosen, count = [], 0
+            for seg in reversed(self.segments):
+                if count >= min_count and seg["last_id"] <= min_id:
+                    break
+                chosen.append(seg)
+                count += seg["count"]
+            chosen.reverse()
+
+            history = []
+            for seg in chosen:
+                history.extend(self._read_segment(seg["date"]))
+            self._loaded_days = {seg["date"] for seg in chosen}
+            self.hot_first_id = chosen[0]["first_id"] if chosen else self.next_id
+
+            index = {talk["id"] for talk in history}
+            hot_records = []
+            self.journal_count = 0
+            for record in _read_journal(self.journal_file):
+                self.journal_count += 1
+                if record.get("op") == "add":
+                    talk = record["talk"]
+                    self.next_id = max(self.next_id, talk["id"] + 1)
+                    # 合并后、清空日志前退出时，记录可能已经写进分段
+                    if talk["id"] >= self.hot_first_id and talk["id"] not in index:
+                        history.append(talk)
+                        index.add(talk["id"])
+                elif record["id"] >= self.hot_first_id:
+                    hot_records.append(record)
+                else:
+                    self._cold_records.append(record)
+            return _apply_records(history, hot_records)
+
+    def append_many(self, records):
+        """一次性向日志追加多条记录"""
+        if not records:
+            return
+        with self.lock:
+            os.makedirs(self.data_dir, exist_ok=True)
+            with open(self.journal_file, 'a', encoding='utf-8') as f:
+                f.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+            self.journal_count += len(records)
+            self._cold_records.extend(
+                record for record in records
+                if record["op"] != "add" and record["id"] < self.hot_first_id
+            )
+
+    def compact(self, hot_talks, next_id):
+        """把已加载的近期记录和旧分段的改动写回分段文件，然后清空日志"""
+        with self.lock:
+            by_day = {}
+            for talk in hot_talks:
+                by_day.setdefault(_day_of(talk), []).append(talk)
+            for day in self._loaded_days | set(by_day):
+                self._write_segment(day, by_day.get(day, []))
+
+            cold_by_day = {}
+            for record in self._cold_records:
+                day = self._day_for_id(record["id"])
+                if day is not None and day not in by_day:
+                    cold_by_day.setdefault(day, []).append(record)
+            for day, records in cold_by_day.items():
+                self._write_segment(day, _apply_records(self._read_segment(day), records))
+
+            self._cold_records = []
+            self._loaded_days = set(by_day)
+            self.next_id = next_id
+            self._write_manifest()
+
+            with open(self.journal_file, 'w', encoding='utf-8'):
+                pass
+            self.journal_count = 0
+
+    def archive(self, before_day, max_id):
+        """
+        把早于 before_day、且所有记录ID都不大于 max_id（记忆整理水位）的分段压缩归档
+
+        Returns:
+            int: 本次归档的分段数量
+        """
+        with self.lock:
+            cold_ids = {record["id"] for record in self._cold_records}
+            archived = 0
+            for seg in list(self.segments):
+                day = seg["date"]
+                if day >= before_day:
+                    break
+                if seg.get("archived") or seg["last_id"] > max_id or day in self._loaded_days:
+                    continue
+                # 还有未写回的改动时留到下次合并之后
+                if any(seg["first_id"] <= talk_id <= seg["last_id"] for talk_id in cold_ids):
+                    continue
+                plain_path = self._segment_path(day, archived=False)
+                self._write_segment(day, self._read_segment(day), archived=True)
+                if os.path.exists(plain_path):
+                    os.remove(plain_path)
+                archived += 1
+            if archived:
+                self._write_manifest()
+            return archived
+
+    def recorded_dates(self):
+        """清单中所有分段的日期"""
+        with self.lock:
+            return [seg["date"] for seg in self.segments]
+
+    def talks_by_date(self, date_str):
+        """读取某一天的分段，并应用尚未合并的改动"""
+        with self.lock:
+            talks = self._read_segment(date_str)
+            if talks and self._cold_records:
+                ids = {talk["id"] for talk in talks}
+                talks = _apply_records(talks, [r for r in self._cold_records if r["id"] in ids])
+            return talks
+
+    def search(self, keyword, limit=200, exclude_days=()):
+        """从新到旧逐个分段查找，返回最近的匹配记录（按ID升序）"""
+        with self.lock:
+            days = [seg["date"] for seg in self.segments if seg["date"] not in exclude_days]
+        matches = []
+        for day in reversed(days):
+            for talk in reversed(self.talks_by_date(day)):
+                if keyword in talk["content"]:
+                    matches.append(talk)
+                    if len(matches) >= limit:
+                        return matches[::-1]
+        return matches[::-1]
+
+
+class SqliteHistoryStore:
+    """
+    SQLite 对话历史存储
+
+    按日期建立索引，并用 FTS5（trigram 分词，支持中文子串）索引对话内容，
+    历史对话框按日期筛选和搜索时直接走索引查询，不再逐条扫描时间戳。
+    首次启用时会把现有的 talk_log.json（及其日志）导入数据库。
+    """
+
+    indexed = True
+    snapshot_compaction = False  # 变更逐条写入数据库，compact() 不写任何内容
+
+    # 额外字段（好感度标注等）统一存入 extra 列
+    COLUMNS = ("id", "timestamp", "role", "content")
+
+    def __init__(self, db_file, legacy_file=None):
+        self.db_file = Config.get_full_path(db_file)
+        self.legacy_file = legacy_file
+        self.journal_count = 0
+        self.next_id = 0
+        self.hot_first_id = 0
+        self.lock = Lock()
+        os.makedirs(os.path.dirname(self.db_file), exist_ok=True)
+        self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.has_fts = False
+        self._init_schema()
+
+    def _init_schema(self):
+        """建表和索引"""
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS talks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    extra TEXT
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_talks_day ON talks(day)")
+            try:
+                self.conn.execute("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS talks_fts
+                    USING fts5(content, content='talks', content_rowid='id', tokenize='trigram')
+                """)
+                self.conn.executescript("""
+                    CREATE TRIGGER IF NOT EXISTS talks_ai AFTER INSERT ON talks BEGIN
+                        INSERT INTO talks_fts(rowid, content) VALUES (new.id, new.content);
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS talks_ad AFTER DELETE ON talks BEGIN
+                        INSERT INTO talks_fts(talks_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS talks_au AFTER UPDATE OF content ON talks BEGIN
+                        INSERT INTO talks_fts(talks_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                        INSERT INTO talks_fts(rowid, content) VALUES (new.id, new.content);
+                    END;
+                """)
+                self.has_fts = True
+            except sqlite3.OperationalError as e:
+                # 部分 SQLite 版本未编译 FTS5 或不支持 trigram，搜索退回 LIKE
+                print(f"FTS5 不可用，搜索将使用普通匹配: {e}")
+
+    def _row_to_talk(self, row):
+        """数据库行转为对话记录字典"""
+        talk = {key: row[key] for key in self.COLUMNS}
+        if row["extra"]:
+            talk.update(json.loads(row["extra"]))
+        return talk
+
+    def _insert(self, talk):
+        """插入一条记录（调用方需持有锁并处于事务中）"""
+        extra = {k: v for k, v in talk.items() if k not in self.COLUMNS}
+        self.conn.execute(
+            "INSERT INTO talks (id, timestamp, day, role, content, extra) VALUES (?, ?, ?, ?, ?, ?)",
+            (talk["id"], talk["timestamp"], talk["timestamp"][:10], talk["role"], talk["content"],
+             json.dumps(extra, ensure_ascii=False) if extra else None)
+        )
+
+    def _migrate_legacy(self):
+        """数据库为空时导入旧的 JSON 快照和日志"""
+        if not self.legacy_file or not os.path.exists(Config.get_full_path(self.legacy_file)):
+            return
+        if self.conn.execute("SELECT 1 FROM talks LIMIT 1").fetchone():
+            return
+
+        history, _ = read_legacy_history(self.legacy_file)
+        if not history:
+            return
+        print(f"正在将{len(history)}条历史记录导入 SQLite...")
+        with self.conn:
+            for talk in history:
+                self._insert(talk)
+        _retire_legacy(self.legacy_file)
+        print("历史记录导入完成")
+
+    def load(self, min_count, min_id):
+        """
+        加载近期记录：最近 min_count 条，以及所有ID大于 min_id（记忆整理水位）的记录
+
+        与按日分段的存储一样从整天开始加载：起点所在日期的更早记录也一并加载，
+        已加载的最早一天总是完整的，历史对话框只需按日读取更早的日期。
+
+        Returns:
+            list: 按ID升序的已加载记录
+        """
+        with self.lock:
+            self._migrate_legacy()
+            # AUTOINCREMENT 记录历史最大ID，删除末尾记录后ID也不会被复用
+            row = self.conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'talks'").fetchone()
+            self.next_id = row["seq"] + 1 if row else 0
+
+            row = self.conn.execute(
+                "SELECT id FROM talks ORDER BY id DESC LIMIT 1 OFFSET ?", (max(min_count - 1, 0),)
+            ).fetchone()
+            lower = min(row["id"], min_id + 1) if row else min_id + 1
+            row = self.conn.execute(
+                "SELECT MIN(id) AS id FROM talks WHERE day = "
+                "(SELECT day FROM talks WHERE id >= ? ORDER BY id LIMIT 1)", (lower,)
+            ).fetchone()
+            if row["id"] is not None:
+                lower = min(lower, row["id"])
+            self.hot_first_id = lower
+            cursor = self.conn.execute("SELECT * FROM talks WHERE id >= ? ORDER BY id", (lower,))
+            return [self._row_to_talk(row) for row in cursor]
+
+    def append_many(self, records):
+        """在一个事务中应用多条变更记录"""
+        if not records:
+            return
+        with self.lock, self.conn:
+            for record in records:
+                if record["op"] == "add":
+                    self._insert(record["talk"])
+                elif record["op"] == "update":
+                    self._update(record["id"], record["fields"])
+                elif record["op"] == "delete":
+                    self.conn.execute("DELETE FROM talks WHERE id = ?", (record["id"],))
+
+    def _update(self, talk_id, fields):
+        """更新记录字段，非固定列的字段合并进 extra"""
+        columns = {k: v for k, v in fields.items() if k in ("timestamp", "role", "content")}
+        extra_fields = {k: v for k, v in fields.items() if k not in self.COLUMNS}
+        if "timestamp" in columns:
+            columns["day"] = columns["timestamp"][:10]
+
+        if extra_fields:
+            row = self.conn.execute("SELECT extra FROM talks WHERE id = ?", (talk_id,)).fetchone()
+            if row is None:
+                return
+            extra = json.loads(row["extra"]) if row["extra"] else {}
+            extra.update(extra_fields)
+            columns["extra"] = json.dumps(extra, ensure_ascii=False)
+
+        if columns:
+            assignments = ", ".join(f"{k} = ?" for k in columns)
+            self.conn.execute(f"UPDATE talks SET {assignments} WHERE id = ?", (*columns.values(), talk_id))
+
+    def compact(self, hot_talks, next_id):
+        """每次写入都已落盘，无需合并"""
+        pass
+
+    def recorded_dates(self):
+        """所有有记录的日期"""
+        with self.lock:
+            cursor = self.conn.execute("SELECT DISTINCT day FROM talks ORDER BY day")
+            return [row["day"] for row in cursor]
+
+    def talks_by_date(self, date_str):
+        """某一天的全部记录"""
+        with self.lock:
+            cursor = self.conn.execute("SELECT * FROM talks WHERE day = ? ORDER BY id", (date_str,))
+            return [self._row_to_talk(row) for row in cursor]
+
+    def search(self, keyword, limit=200, exclude_days=()):
+        """按内容搜索，返回最近的匹配记录（按ID升序）"""
+        with self.lock:
+            if self.has_fts and len(keyword) >= 3:
+                query = '"' + keyword.replace('"', '""') + '"'
+                cursor = self.conn.execute(
+                    "SELECT t.* FROM talks_fts f JOIN talks t ON t.id = f.rowid "
+                    "WHERE talks_fts MATCH ? ORDER BY t.id DESC LIMIT ?",
+                    (query, limit)
+                )
+            else:
+                # trigram 分词要求至少3个字符，更短的关键词用 LIKE
+                pattern = "%" + keyword.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                cursor = self.conn.execute(
+                    "SELECT * FROM talks WHERE content LIKE ? ESCAPE '\\' ORDER BY id DESC LIMIT ?",
+                    (pattern, limit)
+                )
+            return [self._row_to_talk(row) for row in reversed(cursor.fetchall())]
+
+
+def create_history_store(history_file):
+    """根据配置创建历史存储后端，history_file 为旧版单文件历史路径（用于迁移）"""
+    if Config.HISTORY_BACKEND == "sqlite":
+        return SqliteHistoryStore(Config.HISTORY_DB_FILE, legacy_file=history_file)
+    return JournalHistoryStore(Config.HISTORY_DIR, legacy_file=history_file)
@@ -1,9 +1,10 @@
-import json
-import os
 from datetime import datetime
-from threading import Lock, Thread
+from threading import Lock
 from utils.config import Config
 from api.api_client import DeepSeekAPI
+from api.prompt import PromptAssembler
+from core.state_store import LongTermStateStore
+from utils.executor import TaskExecutor
 
 class MemoryManager:
     """短期和长期记忆管理器 """
@@ -12,8 +13,10 @@ class MemoryManager:
         """初始化记忆管理器"""
         self.history_manager = history_manager
         self.api_key = api_key
-        self.long_memory_file = "log/long.json"
+        self.state = LongTermStateStore.instance()
         self.lock = Lock()
+        self.memory_version = 0  # 长期记忆每次变化加一，系统提示据此判断是否需要重新生成
+        self._helper_apis = {}  # 角色设定 -> 记忆整理用的后台 API 对象，首次使用时创建
         
         # 加载长期记忆数据
         self.load_long_memory()
@@ -23,44 +26,17 @@ class MemoryManager:
     
     def load_long_memory(self):
         """
-        加载长期记忆文件
+        从共享状态加载长期记忆
         """
-        try:
-            # 获取绝对路径
-            abs_path = Config.get_full_path(self.long_memory_file)
-            if os.path.exists(abs_path):
-                with open(abs_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.processed_count = data.get("processed_count", 0)
-                    self.long_memories = data.get("memories", [])
-            else:
-                # 初始化新文件
-                self.processed_count = 0
-                self.long_memories = []
-                self.save_long_memory()
-        except Exception as e:
-            print(f"加载长期记忆失败: {e}，初始化空数据")
-            self.processed_count = 0
-            self.long_memories = []
+        self.processed_count = self.state.processed_count
+        self.processed_id = self.state.processed_id
+        self.long_memories = self.state.memories
+        self.memory_version += 1
     
     def save_long_memory(self):
-        """保存长期记忆到文件"""
-        try:
-            abs_path = Config.get_full_path(self.long_memory_file)
-            data = {}
-            if os.path.exists(abs_path):
-                try:
-                    with open(abs_path, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                except:
-                    data = {}
-            data["processed_count"] = self.processed_count
-            data["memories"] = self.long_memories
-            
-            with open(abs_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"保存长期记忆失败: {e}")
+        """保存长期记忆（由共享状态的写入线程落盘）"""
+        self.memory_version += 1
+        self.state.update_memory_state(self.processed_count, self.processed_id, self.long_memories)
     
     def get_unprocessed_count(self):
         """
@@ -69,8 +45,7 @@ class MemoryManager:
         Returns:
             int: 未处理的消息数量
         """
-        total_messages = len(self.history_manager.get_all_talks())
-        return max(0, total_messages - self.processed_count)
+        return self.history_manager.count_after(self.processed_id)
     
     def should_consolidate(self):
         """
@@ -85,11 +60,11 @@ class MemoryManager:
         """
         检查并触发记忆整理
         
-        如果满足整理条件，在后台线程执行整理，避免阻塞UI
+        如果满足整理条件，提交到记忆整理通道在后台执行，避免阻塞UI
         """
         if self.should_consolidate():
             print(f"检测到{self.get_unprocessed_count()}条未处理消息，触发记忆整理...")
-            Thread(target=self._consolidate_in_background, daemon=True).start()
+            TaskExecutor.instance().submit("memory", self._consolidate_in_background)
     
     def _consolidate_in_background(self):
         """在后台执行记忆整理"""
@@ -106,7 +81,7 @@ class MemoryManager:
         1. 获取未处理的短期记忆
         2. 调用DeepSeek API提炼核心内容
         3. 将提炼结果存入long.json
-        4. 更新processed_count
+        4. 更新processed_id（最后一条已整理记录的ID）
         5. 当长期记忆满20条时，压缩至5-10条
         """
         with self.lock:
@@ -118,12 +93,11 @@ class MemoryManager:
                 remaining = self.get_unprocessed_count()
                 print(f"\n[记忆整理] 第{batch_count}批开始 → 剩余{remaining}条待整理")
                 # 获取未处理的消息
-                all_talks = self.history_manager.get_all_talks()
-                unprocessed = all_talks[self.processed_count:self.processed_count + Config.MAX_HISTORY_MESSAGES]
+                unprocessed = self.history_manager.get_talks_after(self.processed_id, Config.MAX_HISTORY_MESSAGES)
                 if not unprocessed:
                     print("[记忆整理] 未找到可处理的消息，退出循环")
                     break          
-                print(f"[记忆整理] 正在处理第{self.processed_count}到{self.processed_count + len(unprocessed)}条消息...")            
+                print(f"[记忆整理] 正在处理ID {unprocessed[0].id}到{unprocessed[-1].id}的消息...")            
                 # 构建用于提炼的文本
                 memory_text = self._build_memory_text(unprocessed)
                 print(f"[记忆整理] 构建的文本长度: {len(memory_text)} 字符")            
@@ -141,6 +115,7 @@ class MemoryManager:
                     
                     # 更新已处理数量
                     self.processed_count += len(unprocessed)
+                    self.processed_id = unprocessed[-1].id
                     
                     print(f"[记忆整理] ✓ 成功整理为记忆ID:{new_memory_id} - {consolidated_memory}")
                     print(f"[记忆整理] 已处理总数: {self.processed_count}, 长期记忆数: {len(self.long_memories)}")
@@ -176,8 +151,8 @@ class MemoryManager:
         """
         lines = []
         for talk in talks:
-            role = talk["role"]
-            content = talk["content"]
+            role = talk.role
+            content = talk.content
             if role == "event":
                 lines.append(f"[事件] {content}")
             elif role == "user":
@@ -187,6 +162,24 @@ class MemoryManager:
         
         return "\n".join(lines)
     
+    def _helper_api(self, character_prompt):
+        """
+        记忆整理用的后台 API 对象，同一个角色设定只创建一次（调用方需持有 lock）
+        
+        使用自己的 PromptAssembler：整理助手的角色设定与桌宠不同，共用对话的片段缓存
+        会让对话的系统提示在两种设定之间来回切换，片段版本号反复增加，前缀缓存随之失效。
+        """
+        api = self._helper_apis.get(character_prompt)
+        if api is None:
+            api = self._helper_apis[character_prompt] = DeepSeekAPI(
+                api_key=self.api_key,
+                character_prompt=character_prompt,
+                history_manager=None,
+                role="background",
+                prompt=PromptAssembler()
+            )
+        return api
+    
     def _call_deepseek_for_consolidation(self, memory_text):
         """
         调用DeepSeek API提炼核心记忆
@@ -209,14 +202,10 @@ class MemoryManager:
 
 请直接输出提炼后的核心记忆，不要有任何解释或附加内容。"""
             
-            # 临时API实例（不使用历史记录）
-            temp_api = DeepSeekAPI(
-                api_key=self.api_key,
-                character_prompt="你是一个高效的信息提炼助手，擅长提取核心要点。",
-                history_manager=None
-            )
+            # 整理用的API实例（不使用历史记录）
+            helper_api = self._helper_api("你是一个高效的信息提炼助手，擅长提取核心要点。")
             
-            response = temp_api.get_response(prompt)
+            response = helper_api.get_response(prompt)
             
             # 清理响应
             memory = response.strip()
@@ -256,13 +245,9 @@ class MemoryManager:
 
 请直接输出提炼后的核心记忆列表，不要有任何解释或附加内容。"""
             
-            temp_api = DeepSeekAPI(
-                api_key=self.api_key,
-                character_prompt="你是一个高效的信息压缩助手，擅长提取核心要点。",
-                history_manager=None
-            )
+            helper_api = self._helper_api("你是一个高效的信息压缩助手，擅长提取核心要点。")
             
-            response = temp_api.get_response(prompt)
+            response = helper_api.get_response(prompt)
             
             # 解析响应
             new_memories = []
@@ -0,0 +1,79 @@
+import gzip
+import json
+import os
+import time
+from threading import Thread, Event, Lock
+from utils.config import Config
+
+
+def atomic_write_json(file_path, data, compress=False):
+    """先写临时文件再替换，保证目标文件任何时刻都是完整的；compress 为 True 时写入 gzip 压缩的紧凑 JSON"""
+    directory = os.path.dirname(file_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = file_path + ".tmp"
+    with open(tmp_path, 'wb') as raw:
+        if compress:
+            with gzip.GzipFile(fileobj=raw, mode='wb') as f:
+                f.write(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode('utf-8'))
+        else:
+            raw.write(json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8'))
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp_path, file_path)
+
+
+class WriteBehindWriter:
+    """
+    后台写入线程
+
+    调用方只发出脏通知（mark_dirty），不直接访问磁盘。写入线程收到通知后等待一个合并窗口，
+    把窗口内的多次变更合并成一次 flush_func 调用。interval 不为 None 时还会定时唤醒一次，
+    便于做周期性的维护工作（如日志合并）。
+    """
+
+    def __init__(self, flush_func, delay=None, interval=None, name="WriteBehindWriter"):
+        self.flush_func = flush_func
+        self.delay = Config.SAVE_COALESCE_DELAY if delay is None else delay
+        self.interval = interval
+        self._dirty = Event()
+        self._flush_lock = Lock()
+        self._stopped = False
+        self._thread = Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def mark_dirty(self):
+        """通知有数据需要写入"""
+        self._dirty.set()
+
+    def _run(self):
+        """写入线程主循环"""
+        while not self._stopped:
+            triggered = self._dirty.wait(self.interval)
+            if self._stopped:
+                break
+            if triggered:
+                # 合并窗口内的后续变更
+                time.sleep(self.delay)
+            self._dirty.clear()
+            self._do_flush()
+
+    def _do_flush(self):
+        """执行一次写入，同一时刻只允许一个写入在进行"""
+        with self._flush_lock:
+            try:
+                self.flush_func()
+            except Exception as e:
+                print(f"后台写入失败: {e}")
+
+    def flush(self):
+        """立即同步写入所有待写数据"""
+        self._dirty.clear()
+        self._do_flush()
+
+    def close(self):
+        """停止写入线程并写入剩余数据"""
+        self._stopped = True
+        self._dirty.set()
+        self._thread.join(timeout=2)
+        self.flush()
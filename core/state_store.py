@@ -0,0 +1,106 @@
+import copy
+import json
+import os
+from threading import Lock
+from utils.config import Config
+from utils.begin import DEFAULT_LONG_MEMORY
+from core.persistence import WriteBehindWriter, atomic_write_json
+
+
+class LongTermStateStore:
+    """
+    log/long.json 的唯一持有者
+
+    好感度、记忆整理进度和长期记忆都保存在同一个文件里。这里只在启动时读取一次，
+    之后所有读写都走内存，修改通过后台写入线程合并落盘，避免多个管理器各自
+    读-改-写整个文件造成的重复解析和更新丢失。通过 instance() 获取共享实例。
+    """
+
+    _instance = None
+    _instance_lock = Lock()
+
+    @classmethod
+    def instance(cls):
+        """获取进程内共享的实例"""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def __init__(self, file_path="log/long.json"):
+        self.file_path = Config.get_full_path(file_path)
+        self.lock = Lock()
+        self._data = self._load()
+        self._dirty = False
+        self._writer = WriteBehindWriter(self._flush, name="LongStateWriter")
+
+    def _load(self):
+        """读取 long.json，缺失或损坏时使用默认值"""
+        data = copy.deepcopy(DEFAULT_LONG_MEMORY)
+        try:
+            if os.path.exists(self.file_path):
+                with open(self.file_path, 'r', encoding='utf-8') as f:
+                    loaded = json.load(f)
+                # 旧版只记录已处理条数，当时ID从0开始连续，可直接换算成ID水位
+                if loaded.get("processed_id") is None:
+                    loaded["processed_id"] = int(loaded.get("processed_count", 0)) - 1
+                data.update(loaded)
+        except Exception as e:
+            print(f"加载长期状态失败: {e}，使用默认值")
+        return data
+
+    def _set(self, **fields):
+        """修改字段并通知写入线程"""
+        with self.lock:
+            self._data.update(fields)
+            self._dirty = True
+        self._writer.mark_dirty()
+
+    def _flush(self):
+        """写入线程：有修改时整体原子写入"""
+        with self.lock:
+            if not self._dirty:
+                return
+            data = copy.deepcopy(self._data)
+            self._dirty = False
+        atomic_write_json(self.file_path, data)
+
+    @property
+    def favorability(self) -> int:
+        with self.lock:
+            return int(self._data.get("favorability", 0))
+
+    @favorability.setter
+    def favorability(self, value: int):
+        self._set(favorability=int(value))
+
+    @property
+    def processed_count(self) -> int:
+        with self.lock:
+            return int(self._data.get("processed_count", 0))
+
+    @property
+    def processed_id(self) -> int:
+        with self.lock:
+            return int(self._data["processed_id"])
+
+    @property
+    def memories(self) -> list:
+        with self.lock:
+            return copy.deepcopy(self._data.get("memories", []))
+
+    def update_memory_state(self, processed_count: int, processed_id: int, memories: list):
+        """一次性更新记忆整理进度和长期记忆"""
+        self._set(
+            processed_count=int(processed_count),
+            processed_id=int(processed_id),
+            memories=copy.deepcopy(memories)
+        )
+
+    def flush(self):
+        """同步写入尚未落盘的修改"""
+        self._writer.flush()
+
+    def close(self):
+        """停止写入线程并写入剩余修改（程序退出时调用）"""
+        self._writer.close()
@@ -0,0 +1,135 @@
+import time
+from datetime import datetime
+from enum import Enum
+from functools import lru_cache
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class TalkRole(str, Enum):
+    """对话角色，所有记录共享同一组枚举实例；继承 str，可直接与 "user" 等字符串比较"""
+    USER = "user"
+    ASSISTANT = "assistant"
+    EVENT = "event"
+
+    def __str__(self):
+        return self.value
+
+
+_ROLES = {role.value: role for role in TalkRole}
+
+
+@lru_cache(maxsize=4096)
+def _hour_epoch(hour_text):
+    """"YYYY-MM-DD HH" 整点的本地时间戳（同一小时的记录共享一次换算）"""
+    return int(datetime(
+        int(hour_text[0:4]), int(hour_text[5:7]), int(hour_text[8:10]), int(hour_text[11:13])
+    ).timestamp())
+
+
+def parse_timestamp(text):
+    """把 "%Y-%m-%d %H:%M:%S" 格式的本地时间解析为整数时间戳"""
+    # 按固定位置切片并缓存整点换算，比逐条 strptime 快得多
+    return _hour_epoch(text[:13]) + int(text[14:16]) * 60 + int(text[17:19])
+
+
+def format_timestamp(epoch):
+    """把整数时间戳格式化为 "%Y-%m-%d %H:%M:%S" 本地时间"""
+    return time.strftime(TIMESTAMP_FORMAT, time.localtime(epoch))
+
+
+class TalkRecord:
+    """
+    一条对话记录
+
+    使用 __slots__ 且时间戳存整数，角色存共享的枚举实例，比原来的字典占用小得多。
+    时间字符串只在显示时格式化。记录创建后视为只读，修改时通过 replace() 生成新对象，
+    因此历史快照可以在多个调用方之间直接共享而无需复制。
+    好感度标注等额外字段存放在 extra 字典中，没有时为 None。
+    """
+
+    __slots__ = ("id", "epoch", "role", "content", "extra")
+
+    def __init__(self, talk_id, epoch, role, content, extra=None):
+        self.id = talk_id
+        self.epoch = epoch
+        self.role = _ROLES[role]
+        self.content = content
+        self.extra = extra or None
+
+    @classmethod
+    def create(cls, talk_id, role, content):
+        """以当前时间创建新记录"""
+        return cls(talk_id, int(time.time()), role, content)
+
+    @classmethod
+    def from_dict(cls, data):
+        """从持久化格式（字典）创建记录"""
+        extra = None
+        if len(data) > 4:
+            extra = {key: value for key, value in data.items() if key not in ("id", "timestamp", "role", "content")}
+        return cls(data["id"], parse_timestamp(data["timestamp"]), data["role"], data["content"], extra)
+
+    def to_dict(self):
+        """转换为持久化格式（字典），时间戳格式与旧版一致"""
+        data = {
+            "id": self.id,
+            "timestamp": self.timestamp,
+            "role": self.role.value,
+            "content": self.content
+        }
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def replace(self, **fields):
+        """返回修改了指定字段的新记录，timestamp 可传格式化字符串，其余未知字段存入 extra"""
+        record = TalkRecord(self.id, self.epoch, self.role, self.content, dict(self.extra) if self.extra else None)
+        for key, value in fields.items():
+            if key == "timestamp":
+                record.epoch = parse_timestamp(value)
+            elif key == "role":
+                record.role = _ROLES[value]
+            elif key == "content":
+                record.content = value
+            else:
+                if record.extra is None:
+                    record.extra = {}
+                record.extra[key] = value
+        return record
+
+    @property
+    def timestamp(self):
+        """格式化后的时间字符串"""
+        return format_timestamp(self.epoch)
+
+    @property
+    def day(self):
+        """所属日期（YYYY-MM-DD）"""
+        return time.strftime("%Y-%m-%d", time.localtime(self.epoch))
+
+    def get(self, key, default=None):
+        """读取额外字段（如 heartchange）"""
+        if self.extra is None:
+            return default
+        return self.extra.get(key, default)
+
+    def __repr__(self):
+        return f"TalkRecord(id={self.id}, timestamp={self.timestamp!r}, role={self.role.value!r}, content={self.content!r})"
+
+
+def records_from_dicts(talks):
+    """
+    把持久化格式的记录列表转换为 TalkRecord，角色未知或时间戳损坏的记录跳过并打印日志
+
+    Returns:
+        tuple: (记录列表, 跳过的条数)
+    """
+    records, skipped = [], 0
+    for talk in talks:
+        try:
+            records.append(TalkRecord.from_dict(talk))
+        except (KeyError, ValueError, TypeError, IndexError, AttributeError) as e:
+            skipped += 1
+            print(f"跳过损坏的对话记录 {talk!r}: {e!r}")
+    return records, skipped
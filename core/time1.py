@@ -1,7 +1,7 @@
 from PyQt5.QtCore import QTimer
 from datetime import datetime
-from threading import Thread
-from api.api_client import send_api_request
+from api.api_client import request_with_failover
+from utils.executor import TaskExecutor
 
 class TimeAnnouncer:
     """整点报时器"""
@@ -21,7 +21,7 @@ class TimeAnnouncer:
         if now.minute == 59 and now.second == 30 and now.hour != self.last_hour:
             self.last_hour = now.hour
             next_hour = (now.hour + 1) % 24
-            Thread(target=self._fetch_ai_response, args=(next_hour,), daemon=True).start()
+            TaskExecutor.instance().submit("announce", self._fetch_ai_response, next_hour)
         
         # 整点显示已准备好的回复
         elif now.minute == 0 and now.second == 0 and self.pending_msg:
@@ -34,40 +34,21 @@ class TimeAnnouncer:
     def _fetch_ai_response(self, hour):
         """在后台线程获取AI整点报时回复"""
         try:
-            system_parts = []
-            
-            if hasattr(self.api, 'character_prompt') and self.api.character_prompt:
-                system_parts.append(f"【你的身份】{self.api.character_prompt}\n\n这是你的核心人设，你必须用第一人称'我'，保持这个性格语气。")
-            
-            if self.heart_manager:
-                heart_desc = self.heart_manager.get_level_desc()
-                if heart_desc:
-                    system_parts.append(f"【当前情感状态】{heart_desc}\n\n这是你对用户的真实情感态度，报时时必须符合这个情感基调，用符合当前关系亲密度的语气提醒用户。")
-            
-            if hasattr(self.api, 'user_info_loader') and self.api.user_info_loader:
-                user_info_str = self.api.user_info_loader.get_info_string()
-                if user_info_str:
-                    system_parts.append(f"【用户档案】{user_info_str}\n\n这是你需要记住的用户信息，报时时结合用户的作息、习惯或喜好会让提醒更贴心。")
-            
-            if hasattr(self.api, 'memory_manager') and self.api.memory_manager:
-                long_memory_str = self.api.memory_manager.get_long_memories_string()
-                if long_memory_str:
-                    system_parts.append(f"【过往记忆】{long_memory_str}\n\n这些是你和用户的共同回忆，报时时可以自然联系这些记忆，让对话更有连贯性。")
-            
-            system_content = "\n\n".join(system_parts)
+            # 与对话共用 API 对象上的系统提示片段缓存
+            system_content = self.api.prompt.system_block(self.api, "announce")
             
             history_context = ""
             if hasattr(self.api, 'history_manager') and self.api.history_manager:
-                recent_talks = self.api.history_manager.get_all_talks()[-5:]
+                recent_talks = self.api.history_manager.tail(5)
                 if recent_talks:
                     history_parts = []
                     for talk in recent_talks:
-                        if talk["role"] == "event":
-                            history_parts.append(f"[事件] {talk['content']}")
-                        elif talk["role"] == "user":
-                            history_parts.append(f"用户说: {talk['content']}")
-                        elif talk["role"] == "assistant":
-                            history_parts.append(f"你回复: {talk['content']}")
+                        if talk.role == "event":
+                            history_parts.append(f"[事件] {talk.content}")
+                        elif talk.role == "user":
+                            history_parts.append(f"用户说: {talk.content}")
+                        elif talk.role == "assistant":
+                            history_parts.append(f"你回复: {talk.content}")
                     if history_parts:
                         history_context = "【最近对话】" + "\n".join(history_parts) + "\n\n"
             
@@ -100,7 +81,7 @@ class TimeAnnouncer:
                 "max_tokens": 100
             }
             
-            response = send_api_request(self.api.api_url, self.api.api_key, data)
+            response = request_with_failover(self.api.role, data)
             
             if response:
                 self.pending_msg = response.strip().strip('"').strip("“”")
@@ -0,0 +1,86 @@
+"""测试用的临时数据目录：配置和历史文件都指向临时目录，共享实例在每个测试前重建"""
+import os
+import shutil
+import tempfile
+import json
+import unittest
+from unittest import mock
+from utils.config import Config
+from utils.config_registry import ConfigRegistry
+from core.state_store import LongTermStateStore
+
+
+class SandboxTestCase(unittest.TestCase):
+    """每个测试使用全新的临时 BASE_PATH"""
+
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base, ignore_errors=True)
+        paths = {
+            "BASE_PATH": self.base,
+            "CHARACTER_FILE": os.path.join(self.base, "txt", "character.json"),
+            "USER_INFO_FILE": os.path.join(self.base, "txt", "user_info.json"),
+            "SETTING_FILE": os.path.join(self.base, "txt", "setting.json"),
+            "HISTORY_FILE": os.path.join(self.base, "log", "talk_log.json"),
+            "HISTORY_DIR": os.path.join(self.base, "log", "talks"),
+            "HISTORY_DB_FILE": os.path.join(self.base, "log", "talk_log.db"),
+            "TOKEN_VOCAB_FILE": os.path.join(self.base, "txt", "token_vocab.txt"),
+        }
+        for name, value in paths.items():
+            patcher = mock.patch.object(Config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        ConfigRegistry.instance().invalidate()
+        self.addCleanup(ConfigRegistry.instance().invalidate)
+
+        LongTermStateStore._instance = None
+        self.addCleanup(self._close_state)
+
+    @staticmethod
+    def _close_state():
+        if LongTermStateStore._instance is not None:
+            LongTermStateStore._instance.close()
+            LongTermStateStore._instance = None
+
+    def write_api_config(self, config):
+        """写入临时目录中的 txt/api.json"""
+        path = Config.get_full_path(os.path.join("txt", "api.json"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(config, f, ensure_ascii=False)
+
+
+class MockServerTestCase(SandboxTestCase):
+    """在本地启动模拟接口（bench/mock_server.py），requests 信任它们的自签名证书"""
+
+    def setUp(self):
+        super().setUp()
+        self.servers = []
+        from api.http_pool import SessionPool
+        SessionPool._instance = None
+        self.addCleanup(self._reset_pool)
+
+    @staticmethod
+    def _reset_pool():
+        from api.http_pool import SessionPool
+        if SessionPool._instance is not None:
+            SessionPool._instance.close()
+            SessionPool._instance = None
+
+    def start_server(self, **kwargs):
+        """启动一个模拟接口，测试结束时关闭"""
+        from bench.mock_server import MockServer
+        server = MockServer(**kwargs).start()
+        self.addCleanup(server.stop)
+        self.servers.append(server)
+
+        # 每个服务器各自生成自签名证书，合并成一个证书包
+        bundle = os.path.join(self.base, "ca.pem")
+        with open(bundle, 'w') as f:
+            for started in self.servers:
+                with open(started.cert_file) as cert:
+                    f.write(cert.read())
+        patcher = mock.patch.dict(os.environ, {"REQUESTS_CA_BUNDLE": bundle})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return server
@@ -0,0 +1,65 @@
+import unittest
+from api.api_client import CancelToken, RequestCancelled, send_api_request
+from tests.sandbox import MockServerTestCase
+
+DATA = {"model": "test", "messages": [{"role": "user", "content": "你好"}]}
+
+
+class StreamTest(MockServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.server = self.start_server(reply="今天天气真好呀~")
+
+    def test_deltas_and_full_reply(self):
+        """每段内容依次回调，返回值是完整回复"""
+        deltas = []
+        reply = send_api_request(self.server.url, "test", {**DATA, "stream": True}, on_delta=deltas.append)
+        self.assertEqual(reply, "今天天气真好呀~")
+        self.assertEqual(deltas, ["今天", "天气", "真好", "呀~"])
+
+    def test_stream_connection_reused(self):
+        """流式响应读到末尾后连接归还连接池"""
+        for _ in range(3):
+            send_api_request(self.server.url, "test", {**DATA, "stream": True})
+        send_api_request(self.server.url, "test", DATA)
+        self.assertEqual(self.server.requests, 4)
+        self.assertEqual(self.server.connections, 1)
+
+
+class CancelTest(MockServerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.server = self.start_server(reply="今天天气真好呀~")
+
+    def test_not_cancelled(self):
+        """未取消时与不传令牌的结果相同"""
+        self.assertEqual(send_api_request(self.server.url, "test", DATA, cancel_token=CancelToken()), "今天天气真好呀~")
+        reply = send_api_request(self.server.url, "test", {**DATA, "stream": True}, cancel_token=CancelToken())
+        self.assertEqual(reply, "今天天气真好呀~")
+
+    def test_cancelled_before_send(self):
+        """已取消的令牌不再发出请求"""
+        token = CancelToken()
+        token.cancel()
+        with self.assertRaises(RequestCancelled):
+            send_api_request(self.server.url, "test", DATA, cancel_token=token)
+        self.assertEqual(self.server.requests, 0)
+
+    def test_cancel_during_stream(self):
+        """流式接收中途取消时抛出 RequestCancelled，不再回调后续内容"""
+        token = CancelToken()
+        deltas = []
+
+        def on_delta(delta):
+            deltas.append(delta)
+            token.cancel()
+
+        with self.assertRaises(RequestCancelled):
+            send_api_request(self.server.url, "test", {**DATA, "stream": True}, on_delta=on_delta, cancel_token=token)
+        self.assertEqual(deltas, ["今天"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import json
+import os
+import unittest
+from unittest import mock
+from utils.config import Config
+from utils.config_registry import ConfigRegistry, thaw
+from tests.sandbox import SandboxTestCase
+
+PATH = os.path.join("txt", "api.json")
+
+
+class ConfigRegistryTest(SandboxTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.registry = ConfigRegistry.instance()
+        self.write_api_config({"chat_api": {"model": "deepseek-chat"}, "levels": [1, 2]})
+
+    def test_parsed_once(self):
+        """文件没有变化时只解析一次，各调用方拿到同一个对象"""
+        with mock.patch("utils.config_registry.json.load", wraps=json.load) as parse:
+            first = self.registry.load(PATH)
+            self.assertIs(self.registry.load(PATH), first)
+        self.assertEqual(parse.call_count, 1)
+
+    def test_reloaded_after_change(self):
+        """文件被外部改动后重新解析"""
+        self.registry.load(PATH)
+        self.write_api_config({"chat_api": {"model": "deepseek-reasoner"}})
+        full_path = Config.get_full_path(PATH)
+        stat = os.stat(full_path)
+        os.utime(full_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        self.assertEqual(self.registry.load(PATH)["chat_api"]["model"], "deepseek-reasoner")
+
+    def test_read_only(self):
+        """返回的配置不可修改，thaw() 得到可修改的副本"""
+        config = self.registry.load(PATH)
+        with self.assertRaises(TypeError):
+            config["chat_api"]["model"] = "other"
+        self.assertEqual(config["levels"], (1, 2))
+        copy = thaw(config)
+        copy["chat_api"]["model"] = "other"
+        self.assertEqual(copy["levels"], [1, 2])
+        self.assertEqual(self.registry.load(PATH)["chat_api"]["model"], "deepseek-chat")
+
+    def test_get_missing_file(self):
+        """文件不存在时 get() 返回默认值"""
+        self.assertEqual(self.registry.get(os.path.join("txt", "missing.json"), {}), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+from unittest import mock
+from core.heart import HeartManager
+from utils.config_registry import ConfigRegistry
+from tests.sandbox import SandboxTestCase
+
+
+class LevelConfigTest(SandboxTestCase):
+    """每个方法只从 ConfigRegistry 读取一次等级配置"""
+
+    def setUp(self):
+        super().setUp()
+        self.heart = HeartManager()
+        patcher = mock.patch.object(ConfigRegistry, "get", autospec=True, wraps=ConfigRegistry.get)
+        self.get = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assert_single_read(self, call):
+        self.get.reset_mock()
+        call()
+        self.assertEqual(self.get.call_count, 1)
+
+    def test_single_read_per_method(self):
+        self.assert_single_read(self.heart.get_level_info)
+        self.assert_single_read(lambda: self.heart._build_judge_prompt("你好", "你好呀"))
+        self.assert_single_read(lambda: self.heart.update(1))
+        self.assert_single_read(lambda: self.heart.update(None))
+
+    def test_update_reports_level(self):
+        score, level, _ = self.heart.update(2)
+        self.assertEqual((score, level), (2, self.heart.get_level(2)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import gzip
+import json
+import os
+import unittest
+from unittest import mock
+from core.history_archive import main
+from core.state_store import LongTermStateStore
+from utils.config import Config
+from tests.test_history_manager import HistoryTestCase
+
+
+class ArchiveTest(HistoryTestCase):
+    """2020 年的三天旧历史，每天两条（ID 0-5），启动时只加载最后一天"""
+
+    DAYS = ["2020-01-01", "2020-01-02", "2020-01-03"]
+
+    def setUp(self):
+        super().setUp()
+        self.write_legacy([
+            {"id": i, "timestamp": f"{self.DAYS[i // 2]} 0{8 + i % 2}:00:00", "role": "user", "content": f"消息{i}"}
+            for i in range(6)
+        ])
+        for name in ("MAX_HISTORY_MESSAGES", "CONTEXT_MAX_MESSAGES"):
+            patcher = mock.patch.object(Config, name, 2)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _set_watermark(self, processed_id):
+        LongTermStateStore.instance().update_memory_state(processed_id + 1, processed_id, [])
+
+    def _manifest(self):
+        with open(os.path.join(Config.HISTORY_DIR, "manifest.json"), 'r', encoding='utf-8') as f:
+            return {seg["date"]: seg for seg in json.load(f)["segments"]}
+
+    def test_archives_old_consolidated_segments(self):
+        """已整理进长期记忆的旧分段压缩归档，已加载的分段保持原样，归档后仍可按日期读取"""
+        self._set_watermark(5)
+        self.assertEqual(main(["archive"]), 0)
+
+        manifest = self._manifest()
+        self.assertEqual([day for day, seg in manifest.items() if seg.get("archived")], self.DAYS[:2])
+        self.assertFalse(os.path.exists(os.path.join(Config.HISTORY_DIR, "2020-01-01.json")))
+        with gzip.open(os.path.join(Config.HISTORY_DIR, "archive", "2020-01-01.json.gz"), 'rt', encoding='utf-8') as f:
+            self.assertEqual([talk["id"] for talk in json.load(f)], [0, 1])
+
+        manager = self.open_manager()
+        self.assertEqual([talk.id for talk in manager.get_talks_by_date("2020-01-01")], [0, 1])
+        self.assertEqual([talk.id for talk in manager.get_all_talks()], [4, 5])
+
+    def test_unconsolidated_segments_stay_hot(self):
+        """还没整理进长期记忆的分段不归档"""
+        self._set_watermark(1)
+        main(["archive"])
+        manifest = self._manifest()
+        self.assertTrue(manifest["2020-01-01"].get("archived"))
+        self.assertFalse(manifest["2020-01-02"].get("archived"))
+
+    def test_export_includes_archived(self):
+        """导出包含已归档的分段"""
+        self._set_watermark(5)
+        main(["archive"])
+        output = os.path.join(self.base, "export", "out.json")
+        self.assertEqual(main(["export", output]), 0)
+        with open(output, 'r', encoding='utf-8') as f:
+            self.assertEqual([talk["id"] for talk in json.load(f)], list(range(6)))
+
+
+
+class ExportTest(HistoryTestCase):
+
+    def test_export_includes_journal(self):
+        """日志中尚未合并的记录也要导出，输出文件可以是当前目录下的相对路径"""
+        manager = self.open_manager()
+        for i in range(3):
+            manager.add_talk("user", f"消息{i}")
+        manager.close()
+
+        cwd = os.getcwd()
+        os.chdir(self.base)
+        self.addCleanup(os.chdir, cwd)
+        self.assertEqual(main(["export", "out.json"]), 0)
+        with open(os.path.join(self.base, "out.json"), 'r', encoding='utf-8') as f:
+            talks = json.load(f)
+        self.assertEqual([talk["content"] for talk in talks], ["消息0", "消息1", "消息2"])
+
+if __name__ == "__main__":
+    unittest.main()
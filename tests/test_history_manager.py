@@ -0,0 +1,405 @@
+import json
+import os
+import time
+import unittest
+from unittest import mock
+from core.heart import HeartManager
+from core.history_manager import TalkHistoryManager
+from core.history_store import JournalHistoryStore
+from core.state_store import LongTermStateStore
+from utils.config import Config
+from tests.sandbox import SandboxTestCase
+
+
+class HistoryTestCase(SandboxTestCase):
+
+    def open_manager(self):
+        manager = TalkHistoryManager()
+        self.addCleanup(manager.close)
+        return manager
+
+    def reload(self, manager):
+        """关闭后重新加载，返回新的管理器"""
+        manager.close()
+        return self.open_manager()
+
+    def write_legacy(self, talks):
+        """写入旧版单文件历史"""
+        os.makedirs(os.path.dirname(Config.HISTORY_FILE), exist_ok=True)
+        with open(Config.HISTORY_FILE, 'w', encoding='utf-8') as f:
+            json.dump(talks, f, ensure_ascii=False)
+
+    def journal_lines(self):
+        journal_file = JournalHistoryStore(Config.HISTORY_DIR).journal_file
+        if not os.path.exists(journal_file):
+            return []
+        with open(journal_file, 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+
+class JournalTest(HistoryTestCase):
+
+    def test_add_appends_to_journal(self):
+        """新增和修改只向日志追加记录，不重写快照；重新加载时重放日志"""
+        manager = self.open_manager()
+        manager.add_talk("user", "你好")
+        manager.add_talk("assistant", "你好呀")
+        manager.update_talk(1, heart_change=2)
+        manager.flush()
+
+        self.assertFalse(os.path.exists(Config.HISTORY_FILE))
+        self.assertEqual([record["op"] for record in self.journal_lines()], ["add", "add", "update"])
+
+        talks = self.reload(manager).get_all_talks()
+        self.assertEqual([talk.content for talk in talks], ["你好", "你好呀"])
+        self.assertEqual(talks[1].get("heart_change"), 2)
+
+    def test_compact_folds_journal_into_segments(self):
+        """合并后记录写入当天的分段文件，清单记录条数和ID范围，日志清空"""
+        manager = self.open_manager()
+        manager.add_talk("user", "你好")
+        manager.save_history()
+
+        self.assertEqual(self.journal_lines(), [])
+        day = manager.get_last_talk().day
+        with open(os.path.join(Config.HISTORY_DIR, "manifest.json"), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        self.assertEqual(manifest["next_id"], 1)
+        self.assertEqual(manifest["segments"], [{"date": day, "count": 1, "first_id": 0, "last_id": 0}])
+        with open(os.path.join(Config.HISTORY_DIR, f"{day}.json"), 'r', encoding='utf-8') as f:
+            self.assertEqual([talk["content"] for talk in json.load(f)], ["你好"])
+        self.assertEqual(len(self.reload(manager).get_all_talks()), 1)
+
+    def test_legacy_file_migrated(self):
+        """旧版单文件历史首次加载时拆分成按天分段，原文件改名保留"""
+        self.write_legacy([
+            {"id": 0, "timestamp": "2024-01-01 08:00:00", "role": "user", "content": "早"},
+            {"id": 1, "timestamp": "2024-01-02 08:00:00", "role": "user", "content": "又是一天"},
+        ])
+        manager = self.open_manager()
+        manager.add_talk("assistant", "早上好")
+        self.assertTrue(os.path.exists(Config.HISTORY_FILE + ".migrated"))
+        self.assertFalse(os.path.exists(Config.HISTORY_FILE))
+        self.assertEqual(manager.get_recorded_dates()[:2], ["2024-01-01", "2024-01-02"])
+        self.assertEqual(
+            [talk.content for talk in self.reload(manager).get_all_talks()], ["早", "又是一天", "早上好"]
+        )
+
+
+class LazySegmentTest(HistoryTestCase):
+    """五天的旧历史，每天两条（ID 0-9），启动时只需要最近三条"""
+
+    DAYS = ["2024-01-01", "2024-01-02", "2024-01-03", "2024-01-04", "2024-01-05"]
+
+    def setUp(self):
+        super().setUp()
+        self.write_legacy([
+            {"id": i, "timestamp": f"{self.DAYS[i // 2]} 0{8 + i % 2}:00:00", "role": "user", "content": f"消息{i}"}
+            for i in range(10)
+        ])
+        for name in ("MAX_HISTORY_MESSAGES", "CONTEXT_MAX_MESSAGES"):
+            patcher = mock.patch.object(Config, name, 3)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _set_watermark(self, processed_id):
+        LongTermStateStore.instance().update_memory_state(processed_id + 1, processed_id, [])
+
+    def test_loads_only_recent_days(self):
+        """只加载最近的整天分段，更早的日期按需从分段读取"""
+        self._set_watermark(9)
+        manager = self.open_manager()
+        self.assertEqual([talk.id for talk in manager.get_all_talks()], [6, 7, 8, 9])
+        self.assertEqual(manager.get_recorded_dates(), self.DAYS)
+        self.assertEqual([talk.id for talk in manager.get_talks_by_date("2024-01-01")], [0, 1])
+        self.assertEqual([talk.id for talk in manager.search_talks("消息")], list(range(10)))
+
+    def test_loads_everything_after_watermark(self):
+        """尚未整理进长期记忆的记录都要加载"""
+        self._set_watermark(1)
+        manager = self.open_manager()
+        self.assertEqual([talk.id for talk in manager.get_all_talks()], list(range(2, 10)))
+
+    def test_delete_unloaded_record(self):
+        """删除未加载分段中的记录，合并后写回该分段"""
+        self._set_watermark(9)
+        manager = self.open_manager()
+        self.assertTrue(manager.delete_talk(0))
+        manager.flush()
+        self.assertEqual([talk.id for talk in manager.get_talks_by_date("2024-01-01")], [1])
+        manager.save_history()
+
+        manager = self.reload(manager)
+        self.assertEqual([talk.id for talk in manager.get_talks_by_date("2024-01-01")], [1])
+        self.assertEqual([talk.id for talk in manager.get_all_talks()], [6, 7, 8, 9])
+
+
+class OlderDatesTest(HistoryTestCase):
+    """历史对话框滚动到顶部时按日读取的日期，不能漏掉已加载最早一天的前半部分"""
+
+    def _run(self, backend):
+        with mock.patch.object(Config, "HISTORY_BACKEND", backend):
+            manager = self.open_manager()
+            for i in range(9):
+                talk_id = manager.add_talk("user", f"消息{i}")
+                manager.update_talk(talk_id, timestamp=f"2020-01-0{1 + i // 3} 0{i % 3}:00:00")
+            manager.save_history()
+            LongTermStateStore.instance().update_memory_state(9, 8, [])
+            with mock.patch.object(Config, "MAX_HISTORY_MESSAGES", 2), \
+                    mock.patch.object(Config, "CONTEXT_MAX_MESSAGES", 2):
+                manager = self.reload(manager)
+
+            loaded = [talk.id for talk in manager.get_all_talks()]
+            older = manager.get_older_dates()
+            shown = loaded + [talk.id for day in older for talk in manager.get_talks_by_date(day)]
+        self.assertEqual(loaded, [6, 7, 8])
+        self.assertEqual(older, ["2020-01-01", "2020-01-02"])
+        self.assertEqual(sorted(shown), list(range(9)))
+
+    def test_journal_backend(self):
+        self._run("journal")
+
+    def test_sqlite_backend(self):
+        self._run("sqlite")
+
+
+class WriteBehindTest(HistoryTestCase):
+
+    def test_mutations_do_not_touch_disk(self):
+        """变更只进入待写队列，写入线程合并窗口结束或 flush 后才落盘"""
+        manager = self.open_manager()
+        for i in range(5):
+            manager.add_talk("user", f"消息{i}")
+        self.assertEqual(self.journal_lines(), [])
+        manager.flush()
+        self.assertEqual(len(self.journal_lines()), 5)
+
+    def test_close_writes_pending(self):
+        """关闭时写入剩余变更"""
+        manager = self.open_manager()
+        manager.add_talk("user", "再见")
+        manager.close()
+        self.assertEqual(len(self.journal_lines()), 1)
+
+
+class StableIdTest(HistoryTestCase):
+
+    def test_ids_never_reused(self):
+        """ID 单调递增，删除末尾记录后也不复用，重新加载后保持不变"""
+        manager = self.open_manager()
+        for i in range(3):
+            manager.add_talk("user", f"消息{i}")
+        self.assertTrue(manager.delete_talk(2))
+        self.assertFalse(manager.delete_talk(2))
+        manager.add_talk("user", "新消息")
+        self.assertEqual([talk.id for talk in manager.get_all_talks()], [0, 1, 3])
+
+        reloaded = self.reload(manager)
+        self.assertEqual([talk.id for talk in reloaded.get_all_talks()], [0, 1, 3])
+        reloaded.add_talk("user", "再来一条")
+        self.assertEqual(reloaded.get_last_talk().id, 4)
+
+    def test_tombstones_skipped_by_queries(self):
+        """打了墓碑的记录不出现在查询结果里，清理前后结果一致"""
+        manager = self.open_manager()
+        for i in range(5):
+            manager.add_talk("user", f"消息{i}")
+        manager.delete_talk(1)
+        manager.delete_talk(3)
+
+        def observe():
+            return (
+                [talk.id for talk in manager.get_all_talks()],
+                manager.count_after(0),
+                [talk.id for talk in manager.get_talks_after(0, limit=2)],
+            )
+        before = observe()
+        self.assertEqual(before, ([0, 2, 4], 2, [2, 4]))
+        with manager.history_lock:
+            manager._purge_tombstones()
+        self.assertEqual(observe(), before)
+        self.assertFalse(manager.update_talk(1, heart_change=1))
+
+    def test_legacy_ids_repaired(self):
+        """旧数据 ID 重复或乱序时迁移时按顺序重新编号"""
+        self.write_legacy([
+            {"id": 0, "timestamp": "2024-01-01 08:00:00", "role": "user", "content": "甲"},
+            {"id": 0, "timestamp": "2024-01-01 08:01:00", "role": "user", "content": "乙"},
+        ])
+        manager = self.open_manager()
+        self.assertEqual([talk.id for talk in manager.get_all_talks()], [0, 1])
+        manager.add_talk("user", "丙")
+        self.assertEqual(manager.get_last_talk().id, 2)
+
+
+class AnnotateLastTest(HistoryTestCase):
+
+    def test_annotates_last_live_record_of_role(self):
+        """补充到最近一条未删除的指定角色记录，并通过日志持久化"""
+        manager = self.open_manager()
+        manager.add_talk("user", "你好")
+        manager.add_talk("assistant", "你好呀")
+        manager.add_talk("assistant", "在吗")
+        manager.add_talk("user", "在")
+        manager.delete_talk(2)
+
+        self.assertEqual(manager.annotate_last("assistant", heart=3, heartchange="+1"), 1)
+        self.assertIsNone(manager.annotate_last("event", heart=3))
+
+        talk = self.reload(manager).get_all_talks()[1]
+        self.assertEqual((talk.get("heart"), talk.get("heartchange")), (3, "+1"))
+
+    def test_heart_change_recorded_on_judged_reply(self):
+        """好感度判断完成前又有新回复时，变化仍记录到被判断的那条回复"""
+        manager = self.open_manager()
+        judged = manager.add_talk("assistant", "你好呀")
+        manager.add_talk("assistant", "在吗")
+        heart = HeartManager()
+        heart.score = 5
+        heart.log_heart_change_to_last_talk(2, manager, talk_id=judged)
+
+        first, second = self.reload(manager).get_all_talks()
+        self.assertEqual((first.get("heart"), first.get("heartchange")), (5, "+2"))
+        self.assertIsNone(second.get("heartchange"))
+
+
+class ContextWindowTest(HistoryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(Config, "CONTEXT_MAX_MESSAGES", 3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_window_keeps_latest_messages(self):
+        """只保留最近的记录，互动事件以用户身份发送"""
+        manager = self.open_manager()
+        manager.add_talk("user", "你好")
+        manager.add_talk("assistant", "你好呀")
+        manager.add_talk("event", "摸了摸头")
+        manager.add_talk("assistant", "嘿嘿")
+        self.assertEqual(manager.context_window(), [
+            {"role": "assistant", "content": "你好呀"},
+            {"role": "user", "content": "[互动事件] 摸了摸头"},
+            {"role": "assistant", "content": "嘿嘿"},
+        ])
+
+    def test_edit_and_delete_rebuild_window(self):
+        """修改内容和删除记录后窗口与重新加载的结果一致"""
+        manager = self.open_manager()
+        for content in ("一", "二", "三", "四"):
+            manager.add_talk("user", content)
+        manager.update_talk(3, content="肆")
+        manager.delete_talk(2)
+        expected = [{"role": "user", "content": c} for c in ("一", "二", "肆")]
+        self.assertEqual(manager.context_window(), expected)
+        self.assertEqual(self.reload(manager).context_window(), expected)
+
+
+
+class FlushDuringCompactionTest(SandboxTestCase):
+    """合并期间（append_many 之后、快照之前）新增的变更不能丢失"""
+
+    def _run(self, backend):
+        with mock.patch.object(Config, "HISTORY_BACKEND", backend):
+            manager = TalkHistoryManager()
+            for i in range(3):
+                manager.add_talk("user", f"消息{i}")
+            manager.flush()
+
+            store = manager.store
+            original = store.append_many
+            injected = []
+
+            def append_many(records):
+                # 模拟写入过程中其他线程继续添加记录
+                original(records)
+                if not injected:
+                    injected.append(manager.add_talk("assistant", "写入期间新增"))
+
+            with mock.patch.object(store, "append_many", append_many):
+                manager.add_talk("user", "触发写入")
+                manager.save_history()
+            manager.close()
+
+            reloaded = TalkHistoryManager()
+            contents = [talk.content for talk in reloaded.get_all_talks()]
+            reloaded.close()
+        self.assertIn("写入期间新增", contents)
+        self.assertEqual(len(contents), 5)
+
+    def test_journal_backend(self):
+        self._run("journal")
+
+    def test_sqlite_backend(self):
+        self._run("sqlite")
+
+    def test_journal_cold_change(self):
+        """合并期间针对未加载旧分段的删除不在快照中，也要写回"""
+        manager = TalkHistoryManager()
+        for day in range(1, 4):
+            talk_id = manager.add_talk("user", f"第{day}天")
+            manager.update_talk(talk_id, timestamp=f"2020-01-0{day} 10:00:00")
+        manager.save_history()
+        manager.close()
+        LongTermStateStore.instance().update_memory_state(3, 2, [])
+
+        with mock.patch.object(Config, "MAX_HISTORY_MESSAGES", 1), \
+                mock.patch.object(Config, "CONTEXT_MAX_MESSAGES", 1):
+            manager = TalkHistoryManager()
+        self.assertEqual([talk.id for talk in manager.get_all_talks()], [2])
+
+        store = manager.store
+        original = store.append_many
+        deleted = []
+
+        def append_many(records):
+            original(records)
+            if not deleted:
+                deleted.append(manager.delete_talk(0))
+
+        with mock.patch.object(store, "append_many", append_many):
+            manager.add_talk("user", "触发写入")
+            manager.save_history()
+        manager.close()
+        self.assertEqual(deleted, [True])
+
+        reloaded = TalkHistoryManager()
+        self.assertEqual([talk.id for talk in reloaded.get_all_talks()], [1, 2, 3])
+        reloaded.close()
+
+
+
+class CorruptRecordTest(SandboxTestCase):
+    """损坏的记录被跳过，且不会触发合并把分段文件改写掉"""
+
+    def test_bad_records_are_skipped_and_segments_kept(self):
+        manager = TalkHistoryManager()
+        for i in range(3):
+            manager.add_talk("user", f"消息{i}")
+        manager.save_history()
+        manager.close()
+
+        segment = os.path.join(Config.HISTORY_DIR, f"{time.strftime('%Y-%m-%d')}.json")
+        with open(segment, 'r', encoding='utf-8') as f:
+            talks = json.load(f)
+        talks[0]["role"] = "stranger"
+        talks[1]["timestamp"] = "昨天"
+        with open(segment, 'w', encoding='utf-8') as f:
+            json.dump(talks, f, ensure_ascii=False)
+
+        manager = TalkHistoryManager()
+        self.assertEqual([talk.content for talk in manager.get_all_talks()], ["消息2"])
+        manager.add_talk("user", "新消息")
+        manager.save_history()
+        manager.close()
+
+        with open(segment, 'r', encoding='utf-8') as f:
+            self.assertEqual(json.load(f), talks)
+        reloaded = TalkHistoryManager()
+        self.assertEqual([talk.content for talk in reloaded.get_all_talks()], ["消息2", "新消息"])
+        reloaded.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
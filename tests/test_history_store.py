@@ -0,0 +1,84 @@
+import json
+import os
+import unittest
+from core.history_store import SqliteHistoryStore
+from utils.config import Config
+from tests.sandbox import SandboxTestCase
+
+
+def make_talk(talk_id, timestamp, content, role="user"):
+    return {"id": talk_id, "timestamp": timestamp, "role": role, "content": content}
+
+
+class SqliteStoreTest(SandboxTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.store = self._open()
+
+    def _open(self):
+        store = SqliteHistoryStore(Config.HISTORY_DB_FILE, legacy_file=Config.HISTORY_FILE)
+        self.addCleanup(store.conn.close)
+        return store
+
+    def _add(self, *talks):
+        for talk in talks:
+            self.store.append_many([{"op": "add", "talk": talk}])
+
+    def test_date_index(self):
+        """按日期列出和读取记录"""
+        self._add(
+            make_talk(0, "2024-01-01 08:00:00", "早"),
+            make_talk(1, "2024-01-02 09:00:00", "早上好"),
+            make_talk(2, "2024-01-02 21:00:00", "晚安", role="assistant"),
+        )
+        self.assertEqual(self.store.recorded_dates(), ["2024-01-01", "2024-01-02"])
+        self.assertEqual([t["id"] for t in self.store.talks_by_date("2024-01-02")], [1, 2])
+
+    def test_load_starts_at_day_boundary(self):
+        """最近几条落在某一天中间时，这一天更早的记录也一并加载"""
+        self._add(*(make_talk(i, f"2024-01-01 0{i}:00:00", f"一日{i}") for i in range(3)))
+        self._add(*(make_talk(i, f"2024-01-02 0{i}:00:00", f"二日{i}") for i in range(3, 9)))
+        self.assertEqual([t["id"] for t in self.store.load(2, 8)], [3, 4, 5, 6, 7, 8])
+        self.assertEqual([t["id"] for t in self.store.load(7, 8)], list(range(9)))
+
+    def test_search(self):
+        """三个字以上走全文索引，更短的关键词退回 LIKE，结果按 ID 升序"""
+        self._add(
+            make_talk(0, "2024-01-01 08:00:00", "今天天气不错"),
+            make_talk(1, "2024-01-01 09:00:00", "明天天气怎么样"),
+            make_talk(2, "2024-01-01 10:00:00", "100%_确定"),
+        )
+        self.assertEqual([t["id"] for t in self.store.search("天气不")], [0])
+        self.assertEqual([t["id"] for t in self.store.search("天气")], [0, 1])
+        self.assertEqual([t["id"] for t in self.store.search("%_")], [2])
+        self.assertEqual([t["id"] for t in self.store.search("天气", limit=1)], [1])
+
+    def test_extra_fields_round_trip(self):
+        """好感度标注等额外字段存入 extra 列，更新后仍能读出"""
+        self._add(make_talk(0, "2024-01-01 08:00:00", "你好", role="assistant"))
+        self.store.append_many([{"op": "update", "id": 0, "fields": {"heart_change": 2}}])
+        self.assertEqual(self.store.load(100, -1)[0]["heart_change"], 2)
+
+    def test_deleted_ids_not_reused(self):
+        """删除末尾记录后重新加载，下一个ID仍然接着历史最大值"""
+        self._add(make_talk(0, "2024-01-01 08:00:00", "甲"), make_talk(1, "2024-01-01 08:01:00", "乙"))
+        self.store.append_many([{"op": "delete", "id": 1}])
+        self.assertEqual([t["id"] for t in self.store.load(100, -1)], [0])
+        self.assertEqual(self.store.next_id, 2)
+
+    def test_migrates_legacy_json(self):
+        """数据库为空时导入旧的 talk_log.json"""
+        self.store.conn.close()
+        os.remove(Config.HISTORY_DB_FILE)
+        os.makedirs(os.path.dirname(Config.HISTORY_FILE), exist_ok=True)
+        with open(Config.HISTORY_FILE, 'w', encoding='utf-8') as f:
+            json.dump([make_talk(0, "2024-01-01 08:00:00", "早")], f, ensure_ascii=False)
+
+        self.store = self._open()
+        self.assertEqual([t["content"] for t in self.store.load(100, -1)], ["早"])
+        self.assertEqual(self.store.recorded_dates(), ["2024-01-01"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+from api.api_client import send_api_request
+from api.http_pool import SessionPool
+from tests.sandbox import MockServerTestCase
+
+DATA = {"model": "test", "messages": [{"role": "user", "content": "你好"}]}
+
+
+class SessionPoolTest(MockServerTestCase):
+
+    def test_requests_reuse_connection(self):
+        """同一端点的多次请求只建立一次连接"""
+        server = self.start_server(reply="你好")
+        replies = [send_api_request(server.url, "test", DATA) for _ in range(5)]
+        self.assertEqual(replies, ["你好"] * 5)
+        self.assertEqual(server.requests, 5)
+        self.assertEqual(server.connections, 1)
+
+    def test_session_per_endpoint(self):
+        """同一端点的不同路径共享会话，不同端点各自一个会话"""
+        pool = SessionPool.instance()
+        first = pool.get("https://api.example.com/v1/chat/completions")
+        self.assertIs(pool.get("https://api.example.com/v1/models"), first)
+        self.assertIsNot(pool.get("https://api.example.com:8443/v1/chat/completions"), first)
+
+    def test_http_config_from_api_json(self):
+        """api.json 的 "http" 段覆盖默认值，reset() 后重新读取"""
+        pool = SessionPool.instance()
+        self.assertEqual(pool.timeout, (5, 30))
+        self.write_api_config({"http": {"read_timeout": 60, "pool_size": 2}})
+        self.assertEqual(pool.timeout, (5, 30))
+        pool.reset()
+        self.assertEqual(pool.timeout, (5, 60))
+        adapter = pool.get("https://api.example.com/").get_adapter("https://api.example.com/")
+        self.assertEqual(adapter._pool_maxsize, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
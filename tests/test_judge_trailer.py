@@ -0,0 +1,46 @@
+import unittest
+from api.api_client import JudgeTrailerFilter
+from core.heart import HeartManager
+from tests.sandbox import SandboxTestCase
+
+
+def stream(text, size):
+    """按 size 个字符一段送入过滤器，返回转发出的全部内容"""
+    forwarded = []
+    trailer = JudgeTrailerFilter(forwarded.append)
+    for start in range(0, len(text), size):
+        trailer.feed(text[start:start + size])
+    trailer.flush()
+    return "".join(forwarded)
+
+
+class JudgeTrailerTest(SandboxTestCase):
+
+    def test_marker_at_end(self):
+        heart = HeartManager()
+        self.assertEqual(heart.split_judge_trailer("你好呀~\n【好感度+2】"), ("你好呀~", 2))
+
+    def test_marker_followed_by_text(self):
+        heart = HeartManager()
+        text = "你好呀~\n【好感度-1】\n（转身）"
+        self.assertEqual(heart.split_judge_trailer(text), ("你好呀~\n（转身）", -1))
+
+    def test_last_marker_wins(self):
+        heart = HeartManager()
+        self.assertEqual(heart.split_judge_trailer("【好感度+1】嗯\n【好感度+3】"), ("嗯", 3))
+
+    def test_no_marker(self):
+        heart = HeartManager()
+        self.assertEqual(heart.split_judge_trailer("只是【普通】括号"), ("只是【普通】括号", None))
+
+    def test_stream_filter_matches_split(self):
+        """流式转发的内容与拆分后的回复一致，无论标记被切成几段"""
+        heart = HeartManager()
+        for text in ("你好呀~\n【好感度+2】", "你好呀~\n【好感度-1】\n（转身）", "只是【普通】括号【好感"):
+            expected = heart.split_judge_trailer(text)[0]
+            for size in (1, 2, 3, 7):
+                self.assertEqual(stream(text, size).rstrip(), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+from unittest import mock
+from utils.metrics import UsageStats, parse_usage
+
+
+class UsageTest(unittest.TestCase):
+
+    def test_parse_deepseek_usage(self):
+        usage = {"prompt_tokens": 100, "completion_tokens": 20,
+                 "prompt_cache_hit_tokens": 80, "prompt_cache_miss_tokens": 20}
+        self.assertEqual(parse_usage(usage), (100, 20, 80, 20))
+
+    def test_parse_openai_usage(self):
+        usage = {"prompt_tokens": 100, "completion_tokens": 20, "prompt_tokens_details": {"cached_tokens": 64}}
+        self.assertEqual(parse_usage(usage), (100, 20, 64, 36))
+
+    def test_parse_without_cache_info(self):
+        self.assertEqual(parse_usage({"prompt_tokens": 100}), (100, 0, None, None))
+
+    def test_cumulative_hit_rate(self):
+        """累计命中率只统计带缓存信息的请求"""
+        stats = UsageStats()
+        with mock.patch("builtins.print"):
+            self.assertIsNone(stats.hit_rate())
+            stats.record("chat", {"prompt_tokens": 100, "prompt_cache_hit_tokens": 0, "prompt_cache_miss_tokens": 100})
+            stats.record("chat", {"prompt_tokens": 100, "prompt_cache_hit_tokens": 100, "prompt_cache_miss_tokens": 0})
+            stats.record("vision", {"prompt_tokens": 50})
+        self.assertEqual(stats.hit_rate(), 0.5)
+        self.assertEqual((stats.requests, stats.prompt_tokens), (3, 250))
+
+
+if __name__ == "__main__":
+    unittest.main()
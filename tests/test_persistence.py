@@ -0,0 +1,55 @@
+import os
+import threading
+import time
+import unittest
+from core.persistence import WriteBehindWriter, atomic_write_json
+from tests.sandbox import SandboxTestCase
+
+
+class WriteBehindWriterTest(unittest.TestCase):
+
+    def test_coalesces_dirty_notifications(self):
+        """合并窗口内的多次通知只触发一次写入"""
+        calls = []
+        done = threading.Event()
+
+        def flush():
+            calls.append(time.monotonic())
+            done.set()
+
+        writer = WriteBehindWriter(flush, delay=0.1)
+        self.addCleanup(writer.close)
+        for _ in range(10):
+            writer.mark_dirty()
+        self.assertTrue(done.wait(2))
+        time.sleep(0.2)
+        self.assertEqual(len(calls), 1)
+
+    def test_flush_failure_keeps_thread_alive(self):
+        """写入出错只打印，不影响之后的写入"""
+        calls = []
+
+        def flush():
+            calls.append(None)
+            if len(calls) == 1:
+                raise OSError("磁盘已满")
+
+        writer = WriteBehindWriter(flush, delay=0)
+        writer.flush()
+        writer.close()
+        self.assertEqual(len(calls), 2)
+
+
+class AtomicWriteTest(SandboxTestCase):
+
+    def test_replaces_without_leftovers(self):
+        path = os.path.join(self.base, "log", "state.json")
+        atomic_write_json(path, {"a": 1})
+        atomic_write_json(path, {"a": 2})
+        with open(path, 'r', encoding='utf-8') as f:
+            self.assertEqual(f.read().count('"a": 2'), 1)
+        self.assertEqual(os.listdir(os.path.dirname(path)), ["state.json"])
+
+
+if __name__ == "__main__":
+    unittest.main()
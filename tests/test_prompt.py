@@ -0,0 +1,169 @@
+import json
+import os
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+from api.api_client import DeepSeekAPI, with_context_window
+from api.prompt import PromptAssembler
+from utils.config import Config
+from utils.loader import UserInfoLoader
+from tests.sandbox import SandboxTestCase
+
+
+class FakeHeart:
+    """只提供组装提示需要的属性"""
+
+    def __init__(self, score):
+        self.score = score
+        self.favorability_config = ()
+
+    def get_level_desc(self):
+        return f"好感度 {self.score}"
+
+
+class FragmentCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.owner = SimpleNamespace(
+            character_prompt="角色设定", heart_manager=FakeHeart(1),
+            user_info_loader=None, memory_manager=None
+        )
+        self.assembler = PromptAssembler()
+
+    def test_unchanged_sources_reuse_result(self):
+        """来源没变时不重新生成片段，返回同一份系统消息"""
+        first = self.assembler.chat_messages(self.owner)
+        with mock.patch.object(FakeHeart, "get_level_desc") as render:
+            second = self.assembler.chat_messages(self.owner)
+        render.assert_not_called()
+        self.assertEqual(second, first)
+        self.assertIs(second[0], first[0])
+
+    def test_only_changed_fragment_bumped(self):
+        """好感度变化只让心情片段的版本号加一"""
+        character, heart, _, _ = self.assembler.versions(self.owner)
+        self.owner.heart_manager.score = 2
+        self.assertEqual(self.assembler.versions(self.owner)[:2], (character, heart + 1))
+        self.assertEqual(self.assembler.system_block(self.owner, "vision").count("好感度 2"), 1)
+
+    def test_same_text_keeps_version(self):
+        """来源变了但生成的文本相同时版本号不变"""
+        versions = self.assembler.versions(self.owner)
+        self.owner.heart_manager = FakeHeart(1)
+        self.assertEqual(self.assembler.versions(self.owner), versions)
+
+
+class FragmentOrderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.owner = SimpleNamespace(
+            character_prompt="角色设定", heart_manager=FakeHeart(1),
+            user_info_loader=SimpleNamespace(file_path="user_info.json", info={}, get_info_string=lambda: "用户档案"),
+            memory_manager=None
+        )
+        self.assembler = PromptAssembler()
+
+    def contents(self):
+        return [m["content"] for m in self.assembler.chat_messages(self.owner)]
+
+    def notes(self):
+        return [m["content"] for m in self.assembler.chat_notes(self.owner)]
+
+    def test_stable_first_keeps_prefix(self):
+        """stable_first 把情感状态移到历史之后，好感度变化时开头的系统消息不变"""
+        with mock.patch.object(Config, "PROMPT_ORDER", "stable_first"):
+            before = self.contents()
+            self.owner.heart_manager.score = 2
+            after = self.contents()
+            notes = self.notes()
+            block = self.assembler.system_block(self.owner, "vision")
+        self.assertEqual(after, before)
+        self.assertFalse(any("好感度" in text for text in after))
+        self.assertEqual(len(notes), 1)
+        self.assertIn("好感度 2", notes[0])
+        # 识图没有历史，情感状态接在单段提示的最后
+        self.assertLess(block.index("【用户档案】"), block.index("【当前情感状态】好感度 2"))
+
+    def test_classic_order(self):
+        with mock.patch.object(Config, "PROMPT_ORDER", "classic"):
+            contents = self.contents()
+            notes = self.notes()
+        self.assertEqual(contents[0], "角色设定")
+        self.assertIn("好感度 1", contents[1])
+        self.assertEqual(notes, [])
+
+
+class ContextWindowNotesTest(unittest.TestCase):
+
+    def test_notes_follow_history(self):
+        """末尾的系统说明接在历史之后、本次输入之前"""
+        history = SimpleNamespace(context_window=lambda: [
+            {"role": "user", "content": "早"}, {"role": "assistant", "content": "早呀"}
+        ])
+        system = [{"role": "system", "content": "角色设定"}]
+        notes = [{"role": "system", "content": "好感度 1"}]
+        messages = with_context_window(system, history, "在吗", notes=notes)
+        self.assertEqual(
+            [m["content"] for m in messages], ["角色设定", "早", "早呀", "好感度 1", "在吗"]
+        )
+
+
+
+class SharedAssemblerTest(SandboxTestCase):
+    """对话和识图各有自己的 UserInfoLoader，但读的是同一个用户档案文件"""
+
+    def setUp(self):
+        super().setUp()
+        os.makedirs(os.path.dirname(Config.USER_INFO_FILE), exist_ok=True)
+        with open(Config.USER_INFO_FILE, 'w', encoding='utf-8') as f:
+            json.dump({"nickname": "小明"}, f, ensure_ascii=False)
+        self.addCleanup(PromptAssembler._instances.clear)
+        self.chat = self._owner()
+        self.vision = self._owner()
+
+    @staticmethod
+    def _owner():
+        return SimpleNamespace(
+            character_prompt="角色设定", user_info_loader=UserInfoLoader(),
+            heart_manager=None, memory_manager=None
+        )
+
+    def test_fragments_shared_between_owners(self):
+        """两个 API 对象使用同一个实例，片段只生成一次"""
+        assembler = PromptAssembler.shared()
+        self.assertIs(PromptAssembler.shared(), assembler)
+        with mock.patch.object(
+            UserInfoLoader, "get_info_string", autospec=True, side_effect=lambda loader: "用户的昵称是：小明"
+        ) as render:
+            messages = assembler.chat_messages(self.chat)
+            block = assembler.system_block(self.vision, "vision")
+            assembler.chat_messages(self.chat)
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual([m["content"] for m in messages][1], "以下是重要用户档案信息，这对理解对话上下文至关重要：\n用户的昵称是：小明")
+        self.assertIn("【用户档案】用户的昵称是：小明", block)
+
+    def test_helper_api_keeps_shared_versions(self):
+        """角色设定不同的辅助 API 使用自己的实例，不改动共享片段的版本号"""
+        self.write_api_config({"chat_api": {
+            "api_key": "test", "api_url": "https://127.0.0.1:1/v1/chat/completions", "model": "test",
+            "temperature": 0.5, "max_tokens": 100, "stream": False
+        }})
+        assembler = PromptAssembler.shared()
+        versions = assembler.versions(self.chat)
+        helper = DeepSeekAPI(
+            character_prompt="你是一个高效的信息提炼助手", history_manager=None,
+            role="background", prompt=PromptAssembler()
+        )
+        self.assertIsNot(helper.prompt, assembler)
+        self.assertEqual(helper.system_messages[0]["content"], "你是一个高效的信息提炼助手")
+        self.assertEqual(assembler.versions(self.chat), versions)
+
+    def test_separate_instance_per_file(self):
+        """换了用户档案文件后使用另一个实例"""
+        assembler = PromptAssembler.shared()
+        with mock.patch.object(Config, "USER_INFO_FILE", os.path.join(self.base, "other.json")):
+            self.assertIsNot(PromptAssembler.shared(), assembler)
+
+
+if __name__ == "__main__":
+    unittest.main()
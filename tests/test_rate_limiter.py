@@ -0,0 +1,57 @@
+import unittest
+from api.api_client import CancelToken
+from api.errors import RateLimitError, RequestCancelled
+from api.rate_limiter import RateLimiter
+from tests.sandbox import SandboxTestCase
+
+URL = "https://api.example.com/chat/completions"
+
+
+class RateLimiterTest(SandboxTestCase):
+    """每分钟 600 词元（每秒补充 10 个），不限请求数"""
+
+    def setUp(self):
+        super().setUp()
+        self.write_api_config({"rate_limit": {"rpm": 0, "tpm": 600, "background_reserve": 0.5}})
+        self.limiter = RateLimiter()
+
+    def test_waits_when_bucket_empty(self):
+        """额度用完后在时限内等不到补充就抛出 RateLimitError"""
+        self.assertLess(self.limiter.acquire(URL, 600, interactive=True), 0.01)
+        with self.assertRaises(RateLimitError):
+            self.limiter.acquire(URL, 100, interactive=True, timeout=0.1)
+
+    def test_endpoints_limited_separately(self):
+        self.limiter.acquire(URL, 600, interactive=True)
+        self.assertLess(self.limiter.acquire("https://other.example.com/", 600, interactive=True, timeout=0.1), 0.01)
+
+    def test_settle_refunds_unused_tokens(self):
+        """按实际用量结算后退回多预扣的部分"""
+        self.limiter.acquire(URL, 600, interactive=True)
+        self.limiter.settle(URL, 600, 100)
+        self.assertLess(self.limiter.acquire(URL, 400, interactive=True, timeout=0.1), 0.01)
+
+    def test_background_cannot_use_reserve(self):
+        """后台请求不能动用留给交互请求的额度"""
+        self.limiter.acquire(URL, 200, interactive=True)
+        with self.assertRaises(RateLimitError):
+            self.limiter.acquire(URL, 200, timeout=0.1)
+        self.assertLess(self.limiter.acquire(URL, 200, interactive=True, timeout=0.1), 0.01)
+
+    def test_cancel_while_waiting(self):
+        self.limiter.acquire(URL, 600, interactive=True)
+        token = CancelToken()
+        token.cancel()
+        with self.assertRaises(RequestCancelled):
+            self.limiter.acquire(URL, 100, cancel_token=token, timeout=5)
+        self.assertEqual(self.limiter.stats()["requests"], 1)
+
+    def test_reset_with_config(self):
+        """reset() 传入配置时不再读取 api.json（基准测试用来关闭限流）"""
+        self.limiter.acquire(URL, 600, interactive=True)
+        self.limiter.reset({"rpm": 0, "tpm": 0, "background_reserve": 0})
+        self.assertLess(self.limiter.acquire(URL, 600, timeout=0.1), 0.01)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+import unittest
+from unittest import mock
+import requests
+from api.api_client import send_api_request
+from api.errors import (
+    APIConnectionError, AuthenticationError, BadResponseError, RateLimitError, ServerError, classify_error
+)
+from api.rate_limiter import RateLimiter
+from api.retry import RetryPolicy
+from utils.metrics import UsageStats
+from tests.sandbox import MockServerTestCase, SandboxTestCase
+
+DATA = {"model": "test", "messages": [{"role": "user", "content": "你好"}]}
+CONFIG = {"max_attempts": 3, "base_delay": 0.01, "max_delay": 0.01, "deadline": 10}
+
+
+def http_error(status, headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    return requests.exceptions.HTTPError(response=response)
+
+
+class ClassifyTest(unittest.TestCase):
+
+    def test_status_codes(self):
+        self.assertIsInstance(classify_error(http_error(401)), AuthenticationError)
+        self.assertIsInstance(classify_error(http_error(503)), ServerError)
+        error = classify_error(http_error(429, {"Retry-After": "2"}))
+        self.assertIsInstance(error, RateLimitError)
+        self.assertEqual(error.retry_after, 2.0)
+
+    def test_network_and_parse_errors(self):
+        self.assertIsInstance(classify_error(requests.exceptions.ConnectionError()), APIConnectionError)
+        self.assertIsInstance(classify_error(KeyError("choices")), BadResponseError)
+        self.assertTrue(classify_error(requests.exceptions.ReadTimeout()).retryable)
+        self.assertFalse(classify_error(http_error(401)).retryable)
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+    def test_retryable_until_attempts_used(self):
+        policy = RetryPolicy(config=CONFIG)
+        error = ServerError("API请求失败: 503", 503)
+        self.assertIsNotNone(policy.next_delay(error))
+        self.assertIsNotNone(policy.next_delay(error))
+        self.assertIsNone(policy.next_delay(error))
+
+    def test_not_retryable(self):
+        self.assertIsNone(RetryPolicy(config=CONFIG).next_delay(AuthenticationError("API密钥错误")))
+
+    def test_retry_after_and_deadline(self):
+        """至少等待 Retry-After 要求的时间，超出总时限时放弃"""
+        policy = RetryPolicy(deadline=10, config=CONFIG)
+        self.assertEqual(policy.next_delay(RateLimitError("请求过于频繁", retry_after=3)), 3)
+        self.assertIsNone(policy.next_delay(RateLimitError("请求过于频繁", retry_after=30)))
+
+
+class SendRetryTest(SandboxTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write_api_config({"retry": CONFIG})
+
+    def test_retries_transient_failure(self):
+        with mock.patch("api.api_client._post", side_effect=[requests.exceptions.ConnectionError(), ("你好", None)]) as post:
+            self.assertEqual(send_api_request("https://127.0.0.1:9/", "test", DATA), "你好")
+        self.assertEqual(post.call_count, 2)
+
+    def test_raises_after_attempts_used(self):
+        with mock.patch("api.api_client._post", side_effect=requests.exceptions.ConnectionError()) as post:
+            with self.assertRaises(APIConnectionError):
+                send_api_request("https://127.0.0.1:9/", "test", DATA)
+        self.assertEqual(post.call_count, 3)
+
+    def test_no_retry_after_text_shown(self):
+        """流式内容已经转发后失败不再重试"""
+        def partial(api_url, headers, data, on_delta, cancel_token, time_left):
+            on_delta("你")
+            raise requests.exceptions.ChunkedEncodingError()
+
+        with mock.patch("api.api_client._post", side_effect=partial) as post:
+            with self.assertRaises(APIConnectionError):
+                send_api_request("https://127.0.0.1:9/", "test", {**DATA, "stream": True}, on_delta=lambda d: None)
+        self.assertEqual(post.call_count, 1)
+
+
+class InjectedErrorTest(MockServerTestCase):
+    """模拟接口注入的错误经过重试后的结果"""
+
+    def setUp(self):
+        super().setUp()
+        self.write_api_config({"retry": CONFIG, "rate_limit": {"rpm": 0, "tpm": 0}})
+        for cls in (RateLimiter, UsageStats):
+            cls._instance = None
+            self.addCleanup(setattr, cls, "_instance", None)
+
+    def test_server_error_retried_until_attempts_used(self):
+        server = self.start_server(error_rate=1.0, error_status=503)
+        with self.assertRaises(ServerError):
+            send_api_request(server.url, "test", DATA)
+        self.assertEqual(server.requests, 3)
+
+    def test_rate_limited_then_recovered(self):
+        """429 之后按 Retry-After 等待再试"""
+        server = self.start_server(error_rate=1.0, error_status=429, retry_after=0)
+
+        def recover(request):
+            # 第一次请求已经判定为失败，之后的请求都成功
+            server.error_rate = 0.0
+            return "恢复"
+        server.responder = recover
+
+        with mock.patch("builtins.print"):
+            self.assertEqual(send_api_request(server.url, "test", DATA), "恢复")
+        self.assertEqual(server.requests, 2)
+        self.assertEqual(UsageStats.instance().requests, 1)
+
+    def test_stream_dropped_after_text_shown(self):
+        """流式内容发出一半后断开，不再重试"""
+        server = self.start_server(reply="今天天气真好呀~", error_rate=1.0, error_status=0)
+        deltas = []
+        with self.assertRaises(APIConnectionError):
+            send_api_request(server.url, "test", {**DATA, "stream": True}, on_delta=deltas.append)
+        self.assertEqual(deltas, ["今天", "天气"])
+        self.assertEqual(server.requests, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
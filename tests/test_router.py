@@ -0,0 +1,109 @@
+import os
+import socket
+import unittest
+from api.api_client import request_with_failover
+from api.rate_limiter import RateLimiter
+from api.router import EndpointRouter
+from utils.config_registry import ConfigRegistry, thaw
+from tests.sandbox import MockServerTestCase
+
+
+def unused_url():
+    """一个没有服务监听的本地地址"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    return f"https://127.0.0.1:{port}/v1/chat/completions"
+
+
+class RouterTest(MockServerTestCase):
+    """chat_api 配置两个端点（主端点在前），都指向本地模拟接口"""
+
+    def setUp(self):
+        super().setUp()
+        self.primary = self.start_server(reply="主端点")
+        self.backup = self.start_server(reply="备用端点")
+        self.configure(self.primary.url)
+        for cls in (EndpointRouter, RateLimiter):
+            cls._instance = None
+            self.addCleanup(setattr, cls, "_instance", None)
+        self.router = EndpointRouter.instance()
+
+    def configure(self, primary_url):
+        self.write_api_config({
+            "chat_api": {
+                "api_key": "test", "api_url": primary_url, "model": "primary", "name": "主",
+                "endpoints": [{"name": "备用", "api_url": self.backup.url, "model": "backup"}]
+            },
+            "retry": {"max_attempts": 3, "base_delay": 0.3, "max_delay": 0.3, "deadline": 10},
+            "rate_limit": {"rpm": 0, "tpm": 0}
+        })
+
+    @staticmethod
+    def _request(role="chat"):
+        return request_with_failover(role, {"messages": [{"role": "user", "content": "你好"}]})
+
+    def test_faster_endpoint_first(self):
+        """优先使用延迟低的端点"""
+        primary, backup = self.router.endpoints("chat")
+        for _ in range(3):
+            self.router.record(primary, True, 0.2)
+            self.router.record(backup, True, 0.01)
+        self.assertEqual([e.name for e in self.router.ordered("chat")], ["备用", "主"])
+        self.assertEqual(self._request(), "备用端点")
+        self.assertEqual(self.primary.requests, 0)
+
+    def test_failover_on_error(self):
+        """主端点连不上时切换到备用端点，且不在主端点上重试，主端点随后进入冷却排到最后"""
+        self.configure(unused_url())
+        self.assertEqual(self._request(), "备用端点")
+        self.assertEqual([e.name for e in self.router.ordered("chat")], ["备用", "主"])
+        stats = self.router.stats("chat")
+        self.assertEqual(stats["chat/主"]["error_rate"], 1.0)
+        self.assertEqual(stats["chat/主"]["samples"], 1)
+        self.assertEqual(stats["chat/备用"]["error_rate"], 0.0)
+
+    def test_background_falls_back_to_chat(self):
+        """没有配置 background_api 时后台任务使用 chat_api 的端点和统计"""
+        self.assertEqual(self.router.endpoints("background"), self.router.endpoints("chat"))
+        self.assertEqual(self._request("background"), "主端点")
+        self.assertEqual(self.router.stats("chat")["chat/主"]["samples"], 1)
+
+    def test_background_overrides_model_only(self):
+        """background_api 只写了 model 时，地址、密钥和备用端点都沿用 chat_api"""
+        config = ConfigRegistry.instance().load(os.path.join("txt", "api.json"))
+        self.write_api_config({**thaw(config), "background_api": {"model": "cheap"}})
+        models = []
+        self.primary.responder = lambda request: models.append(request["model"]) or "主端点"
+
+        endpoints = self.router.endpoints("background")
+        self.assertEqual([(e.api_url, e.model) for e in endpoints], [
+            (self.primary.url, "cheap"), (self.backup.url, "backup")
+        ])
+        self.assertEqual(self._request("background"), "主端点")
+        self.assertEqual(models, ["cheap"])
+
+
+    def test_latency_excludes_retry_wait(self):
+        """延迟只统计成功的那次请求，不含之前失败后的退避等待"""
+        self.write_api_config({
+            "chat_api": {"api_key": "test", "api_url": self.primary.url, "model": "primary", "name": "主"},
+            "retry": {"max_attempts": 3, "base_delay": 0.3, "max_delay": 0.3, "deadline": 10},
+            "rate_limit": {"rpm": 0, "tpm": 0}
+        })
+        self.primary.error_rate = 1.0
+
+        def recover(request):
+            # 第一次请求已经判定为失败，之后的请求都成功
+            self.primary.error_rate = 0.0
+            return "恢复"
+        self.primary.responder = recover
+
+        self.assertEqual(self._request(), "恢复")
+        self.assertEqual(self.primary.requests, 2)
+        endpoint = self.router.endpoints("chat")[0]
+        self.assertLess(endpoint.p50(), 0.2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import json
+import os
+import threading
+import unittest
+from core.state_store import LongTermStateStore
+from utils.config import Config
+from tests.sandbox import SandboxTestCase
+
+
+class StateStoreTest(SandboxTestCase):
+
+    def _long_file(self):
+        return Config.get_full_path("log/long.json")
+
+    def _read(self):
+        with open(self._long_file(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def test_updates_from_threads_are_not_lost(self):
+        """好感度和记忆并发修改，落盘的文件同时包含两者"""
+        store = LongTermStateStore.instance()
+        threads = [
+            threading.Thread(target=setattr, args=(store, "favorability", 7)),
+            threading.Thread(target=store.update_memory_state, args=(3, 2, ["一起看了电影"])),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        store.flush()
+
+        data = self._read()
+        self.assertEqual(data["favorability"], 7)
+        self.assertEqual(data["processed_id"], 2)
+        self.assertEqual(data["memories"], ["一起看了电影"])
+
+    def test_reads_file_once(self):
+        """只在创建时读取一次，之后的读取都走内存"""
+        os.makedirs(os.path.dirname(self._long_file()))
+        with open(self._long_file(), 'w', encoding='utf-8') as f:
+            json.dump({"favorability": 5, "processed_count": 4, "memories": []}, f)
+        store = LongTermStateStore.instance()
+        os.remove(self._long_file())
+        self.assertEqual(store.favorability, 5)
+        # 旧版只记录条数，换算成ID水位
+        self.assertEqual(store.processed_id, 3)
+
+    def test_memories_are_copies(self):
+        """返回的记忆列表修改后不影响内部状态"""
+        store = LongTermStateStore.instance()
+        store.update_memory_state(1, 0, ["第一条"])
+        store.memories.append("外部修改")
+        self.assertEqual(store.memories, ["第一条"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+from core.talk_record import TalkRecord, TalkRole, format_timestamp, parse_timestamp
+from tests.test_history_manager import HistoryTestCase
+
+
+class TalkRecordTest(unittest.TestCase):
+
+    def test_dict_round_trip(self):
+        """持久化格式与旧版一致，额外字段原样保留"""
+        data = {"id": 3, "timestamp": "2024-02-29 23:59:58", "role": "assistant", "content": "晚安", "heart": 5}
+        record = TalkRecord.from_dict(data)
+        self.assertEqual(record.to_dict(), data)
+        self.assertEqual(record.day, "2024-02-29")
+        self.assertEqual(record.get("heart"), 5)
+
+    def test_timestamp_parsing_matches_format(self):
+        for text in ("2024-01-01 00:00:00", "2024-07-15 13:05:09", "2023-12-31 23:59:59"):
+            self.assertEqual(format_timestamp(parse_timestamp(text)), text)
+
+    def test_roles_are_shared_enum(self):
+        record = TalkRecord(0, 0, "user", "你好")
+        self.assertIs(record.role, TalkRole.USER)
+        self.assertEqual(record.role, "user")
+
+    def test_replace_returns_new_record(self):
+        """修改生成新对象，原记录不变，已共享出去的快照不受影响"""
+        record = TalkRecord(0, 0, "assistant", "你好")
+        changed = record.replace(content="你好呀", heartchange="+1")
+        self.assertEqual((record.content, record.extra), ("你好", None))
+        self.assertEqual((changed.content, changed.get("heartchange")), ("你好呀", "+1"))
+
+
+class SnapshotTest(HistoryTestCase):
+
+    def test_snapshot_shared_until_change(self):
+        """历史未变化时各调用方拿到同一个只读快照，变化后换成新快照"""
+        manager = self.open_manager()
+        manager.add_talk("user", "你好")
+        first = manager.get_all_talks()
+        self.assertIs(manager.get_all_talks(), first)
+
+        manager.annotate_last("user", heart=1)
+        second = manager.get_all_talks()
+        self.assertIsNot(second, first)
+        self.assertIsNone(first[0].get("heart"))
+        self.assertEqual(second[0].get("heart"), 1)
+
+
+    def test_snapshot_unchanged_by_later_writes(self):
+        """快照创建后，新增、修改和删除都不影响它的内容"""
+        manager = self.open_manager()
+        for i in range(4):
+            manager.add_talk("user", f"消息{i}")
+        snapshot = manager.snapshot()
+        manager.add_talk("user", "消息4")
+        manager.update_talk(1, content="改过了")
+        manager.delete_talk(2)
+
+        self.assertEqual([talk.content for talk in snapshot], ["消息0", "消息1", "消息2", "消息3"])
+        self.assertEqual(snapshot.count(), 4)
+        latest = manager.snapshot()
+        self.assertGreater(latest.version, snapshot.version)
+        self.assertEqual([talk.content for talk in latest], ["消息0", "改过了", "消息3", "消息4"])
+
+    def test_tail_and_count(self):
+        """tail 跳过墓碑，count 不含已删除记录"""
+        manager = self.open_manager()
+        for i in range(5):
+            manager.add_talk("user", f"消息{i}")
+        manager.delete_talk(3)
+        self.assertEqual([talk.id for talk in manager.tail(2)], [2, 4])
+        self.assertEqual([talk.id for talk in manager.tail(10)], [0, 1, 2, 4])
+        self.assertEqual(manager.count(), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
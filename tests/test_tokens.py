@@ -0,0 +1,59 @@
+import os
+import unittest
+from api import tokens
+from api.tokens import MESSAGE_OVERHEAD, ContextBudgeter, estimate_tokens, messages_tokens
+from utils.config import Config
+from tests.sandbox import SandboxTestCase
+
+
+class TokenTestCase(SandboxTestCase):
+    """词表和估算结果是模块级缓存，每个测试前后清空"""
+
+    def setUp(self):
+        super().setUp()
+        self._reset()
+        self.addCleanup(self._reset)
+
+    @staticmethod
+    def _reset():
+        tokens._vocab = None
+        estimate_tokens.cache_clear()
+
+
+class EstimateTest(TokenTestCase):
+
+    def test_character_classes(self):
+        """中文约 0.6、英文约 0.3 个词元，结果向上取整"""
+        self.assertEqual(estimate_tokens("你好呀"), 2)
+        self.assertEqual(estimate_tokens("hello"), 2)
+        self.assertEqual(estimate_tokens(""), 0)
+
+    def test_vocab_longest_match(self):
+        """有词表时按最长匹配计数，词表外的字符仍按类别估算"""
+        os.makedirs(os.path.dirname(Config.TOKEN_VOCAB_FILE), exist_ok=True)
+        with open(Config.TOKEN_VOCAB_FILE, 'w', encoding='utf-8') as f:
+            f.write("你好\n你\nhello\n")
+        self.assertEqual(estimate_tokens("你好hello"), 2)
+        self.assertEqual(estimate_tokens("你好呀"), 2)
+
+
+class BudgeterTest(TokenTestCase):
+
+    def test_keeps_newest_history_within_budget(self):
+        """系统消息、输入和预留先占预算，历史从最新往前填到放不下为止"""
+        system = [{"role": "system", "content": "设定"}]
+        window = [{"role": "user", "content": "一二三四五六七八九十"} for _ in range(5)]
+        tail = [{"role": "user", "content": "你好"}]
+        per_message = estimate_tokens("一二三四五六七八九十") + MESSAGE_OVERHEAD
+        ceiling = messages_tokens(system) + messages_tokens(tail) + 100 + per_message * 2
+        messages = ContextBudgeter(ceiling).build(system, window, tail, reserve=100)
+        self.assertEqual(messages, system + window[-2:] + tail)
+
+    def test_nothing_fits(self):
+        system = [{"role": "system", "content": "设定"}]
+        window = [{"role": "user", "content": "很长的一段历史"}]
+        self.assertEqual(ContextBudgeter(1).build(system, window), system)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -128,6 +128,10 @@ class AnimationManager:
         self.character_label.setPixmap(pixmap)
         self.current_state = state
     
+    def refresh_mood(self):
+        """好感度变化后按当前状态重新选择正常/不开心图片"""
+        self._update_display(self.current_state)
+    
     def start_speaking(self):
         """开始说话动画"""
         if not self.is_speaking:
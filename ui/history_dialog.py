@@ -3,7 +3,7 @@ from PyQt5.QtGui import QFont, QTextCharFormat
 from PyQt5.QtWidgets import (
     QDialog, QVBoxLayout, QHBoxLayout, QLabel, QWidget, 
     QPushButton, QScrollArea, QFrame, QSizePolicy,
-    QCalendarWidget, QListWidget, QListWidgetItem, QStackedWidget
+    QCalendarWidget, QListWidget, QListWidgetItem, QStackedWidget, QLineEdit
 )
 from utils.config import Config
 from core.heart import HeartManager
@@ -44,6 +44,9 @@ class HistoryDialog(QDialog):
         self.history_manager = history_manager
         self.parent_window = parent
         self.filter_date = None
+        self.search_keyword = ""
+        self.talk_bubbles = {}  # 记录ID -> 气泡控件
+        self.older_dates = []  # 默认视图中尚未加载的更早日期（升序），滚动到顶部时逐天加载
         
         # 初始化好感度管理器
         self.heart = HeartManager()
@@ -133,6 +136,13 @@ class HistoryDialog(QDialog):
         title_label.setStyleSheet("QLabel { color: #333; padding-bottom: 4px; }")
         header_layout.addWidget(title_label)
         
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("搜索对话内容...")
+        self.search_input.setFixedHeight(28)
+        self.search_input.setClearButtonEnabled(True)
+        self.search_input.returnPressed.connect(self.search_history)
+        header_layout.addWidget(self.search_input)
+        
         self.calendar_button = QPushButton("📅")
         self.calendar_button.setFixedSize(32, 32)
         self.calendar_button.setToolTip("按日期筛选")
@@ -157,6 +167,7 @@ class HistoryDialog(QDialog):
         self.content_layout.setSpacing(12)
         
         self.scroll_area.setWidget(self.content_widget)
+        self.scroll_area.verticalScrollBar().valueChanged.connect(self._on_history_scrolled)
         layout.addWidget(self.scroll_area, 1)
         
         # 页面样式
@@ -243,8 +254,7 @@ class HistoryDialog(QDialog):
 
     def _setup_calendar(self, layout):
         """设置日历控件"""
-        talks = self.history_manager.get_all_talks()
-        self.recorded_dates = {t["timestamp"][:10] for t in talks}
+        self.recorded_dates = set(self.history_manager.get_recorded_dates())
         
         self.calendar = QCalendarWidget()
         self.calendar.setVerticalHeaderFormat(QCalendarWidget.NoVerticalHeader)
@@ -262,10 +272,53 @@ class HistoryDialog(QDialog):
             item = self.content_layout.takeAt(0)
             if widget := item.widget():
                 widget.deleteLater()
+        self.talk_bubbles.clear()
+        
+        self.older_dates = []
+        
+        if self.search_keyword:
+            talks = self.history_manager.search_talks(self.search_keyword)
+        elif self.filter_date:
+            talks = self.history_manager.get_talks_by_date(self.filter_date)
+        else:
+            # 默认只显示已加载的近期记录，更早的日期在滚动到顶部时按需读取
+            talks = self.history_manager.get_all_talks()
+            self.older_dates = self.history_manager.get_older_dates()
         
-        for talk in reversed(self.history_manager.get_all_talks()):
-            if not self.filter_date or talk["timestamp"].startswith(self.filter_date):
-                self.content_layout.insertWidget(0, self.create_talk_bubble(talk))
+        for talk in reversed(talks):
+            self.content_layout.insertWidget(0, self.create_talk_bubble(talk))
+        
+        if not (self.search_keyword or self.filter_date):
+            QTimer.singleShot(0, self._scroll_to_bottom)
+
+    def _scroll_to_bottom(self):
+        """滚动到最新记录；内容不足一屏时继续加载更早的日期"""
+        scroll_bar = self.scroll_area.verticalScrollBar()
+        if scroll_bar.maximum() == 0 and self.older_dates:
+            self._load_older_day()
+            return
+        scroll_bar.setValue(scroll_bar.maximum())
+
+    def _on_history_scrolled(self, value):
+        """滚动到顶部时加载前一天的记录"""
+        if value == 0 and self.older_dates and not (self.search_keyword or self.filter_date):
+            self._load_older_day()
+
+    def _load_older_day(self):
+        """在顶部插入前一个有记录日期的对话，并保持当前可见内容的位置不变"""
+        date_str = self.older_dates.pop()
+        scroll_bar = self.scroll_area.verticalScrollBar()
+        old_maximum = scroll_bar.maximum()
+        
+        for talk in reversed(self.history_manager.get_talks_by_date(date_str)):
+            self.content_layout.insertWidget(0, self.create_talk_bubble(talk))
+        
+        def restore_position():
+            if scroll_bar.maximum() == 0 and self.older_dates:
+                self._load_older_day()
+            else:
+                scroll_bar.setValue(scroll_bar.maximum() - old_maximum)
+        QTimer.singleShot(0, restore_position)
 
     def load_memories(self):
         """加载长期记忆"""
@@ -318,15 +371,24 @@ class HistoryDialog(QDialog):
         date_str = date.toString("yyyy-MM-dd")
         if date_str in self.recorded_dates:
             self.filter_date = date_str
+            self.search_keyword = ""
+            self.search_input.clear()
             self.load_history()
 
+    def search_history(self):
+        """按关键词搜索记录，清空关键词时恢复显示"""
+        self.search_keyword = self.search_input.text().strip()
+        if self.search_keyword:
+            self.filter_date = None
+        self.load_history()
+
     def create_talk_bubble(self, talk):
         """创建对话气泡"""
         bubble_frame = QFrame()
         bubble_frame.setObjectName("bubble_frame")
         bubble_frame.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Preferred)
         
-        style = self.ROLE_STYLES.get(talk["role"], self.ROLE_STYLES["assistant"])
+        style = self.ROLE_STYLES.get(talk.role.value, self.ROLE_STYLES["assistant"])
         bubble_frame.setStyleSheet(f"""
             QFrame#bubble_frame {{
                 background-color: {style['bg_color']};
@@ -342,21 +404,21 @@ class HistoryDialog(QDialog):
         
         # 头部
         header_layout = QHBoxLayout()
-        if talk["role"] == "user":
+        if talk.role == "user":
             role_display = self.user_name
-        elif talk["role"] == "assistant":
+        elif talk.role == "assistant":
             role_display = self.pet_name
         else:
             role_display = style['role_text'] 
-        header_label = QLabel(f"{talk['timestamp']} - {role_display}")
+        header_label = QLabel(f"{talk.timestamp} - {role_display}")
         header_font = QFont(Config.FONT_FAMILY, Config.HISTORY_HEADER_FONT_SIZE)
         header_label.setFont(header_font)
         header_label.setStyleSheet(f"QLabel {{ color: {style['header_color']}; font-weight: bold; background-color: transparent;}}")
         header_layout.addWidget(header_label)
         
         # 显示好感度变化
-        if 'heartchange' in talk:
-            heart_change = talk['heartchange']
+        heart_change = talk.get('heartchange')
+        if heart_change:
             # 根据正负值设置颜色：增加用红色，减少用蓝色
             if heart_change.startswith('+'):
                 heart_color = '#e74c3c'
@@ -381,13 +443,13 @@ class HistoryDialog(QDialog):
             QPushButton:hover { background-color: #ff5722; }
             QPushButton:pressed { background-color: #e64a19; }
         """)
-        delete_button.clicked.connect(lambda checked, d_id=talk['id']: self.delete_talk(d_id))
+        delete_button.clicked.connect(lambda checked, d_id=talk.id: self.delete_talk(d_id))
         header_layout.addWidget(delete_button)
         
         bubble_layout.addLayout(header_layout)
         
         # 内容文本
-        content_label = QLabel(talk["content"])
+        content_label = QLabel(talk.content)
         content_label.setObjectName("content_label")
         content_label.setFont(QFont(Config.FONT_FAMILY, Config.HISTORY_FONT_SIZE))
         content_label.setStyleSheet("QLabel { color: #333333; border: none; background-color: transparent; }")
@@ -396,6 +458,7 @@ class HistoryDialog(QDialog):
         content_label.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Minimum)
         bubble_layout.addWidget(content_label)
         
+        self.talk_bubbles[talk.id] = bubble_frame
         return bubble_frame
 
     def create_memory_bubble(self, memory):
@@ -599,7 +662,11 @@ class HistoryDialog(QDialog):
             if self.parent_window and hasattr(self.parent_window, 'api'):
                 self.parent_window.api.update_conversation_history()
             
-            self.load_history()
+            # ID稳定不变，只移除对应气泡，无需重新加载整个列表
+            bubble = self.talk_bubbles.pop(talk_id, None)
+            if bubble:
+                self.content_layout.removeWidget(bubble)
+                bubble.deleteLater()
             self._show_silent_info("删除成功", "记录已删除。", is_success=True)
 
     def delete_memory(self, memory_id):
@@ -7,6 +7,8 @@ from utils.config import Config
 from utils.loader import CharacterLoader, UserInfoLoader
 from core.history_manager import TalkHistoryManager
 from api.api_client import DeepSeekAPI, VisionAPI
+from api.http_pool import SessionPool
+from api.rate_limiter import RateLimiter
 from ui.animation_manager import AnimationManager
 from ui.talk import TalkManager
 from ui.history_dialog import HistoryDialog
@@ -15,7 +17,9 @@ from ui.setting import SettingsDialog
 from ui.icon import IconManager
 from core.time1 import TimeAnnouncer
 from core.heart import HeartManager
+from core.state_store import LongTermStateStore
 from utils.look import capture_screen_base64
+from utils.executor import TaskExecutor
 
 
 class DeskPetWindow(QWidget):
@@ -77,6 +81,9 @@ class DeskPetWindow(QWidget):
     def __init__(self):
         super().__init__()
         
+        # 后台任务执行器（需在主线程创建，完成回调才能回到主线程）
+        TaskExecutor.instance()
+        
         # 核心管理器初始化
         self.history_manager = TalkHistoryManager()
         self.user_info_loader = UserInfoLoader()
@@ -252,15 +259,16 @@ class DeskPetWindow(QWidget):
         
         user_name = self.user_info_loader.info.get("nickname", "用户")
         pet_name = self.user_info_loader.info.get("oc_name", "桌宠")
-        history = self.history_manager.history
+        last = self.history_manager.get_last_talk()
         
         # 合并连续戳
-        if history and history[-1]["role"] == "event" and "戳了戳" in history[-1]["content"]:
-            last = history[-1]
-            content = last["content"]
-            last["content"] = re.sub(r"(\d+)次", lambda m: f"{int(m.group(1)) + 1}次", content) if "次" in content else content + "2次"
-            last["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            self.history_manager.save_history()
+        if last and last.role == "event" and "戳了戳" in last.content:
+            content = last.content
+            self.history_manager.update_talk(
+                last.id,
+                content=re.sub(r"(\d+)次", lambda m: f"{int(m.group(1)) + 1}次", content) if "次" in content else content + "2次",
+                timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            )
         else:
             self.history_manager.add_talk("event", f"{user_name}戳了戳{pet_name}")
     
@@ -333,13 +341,11 @@ class DeskPetWindow(QWidget):
             self.send_button.hide()
 
     def send_msg(self):
-        """发送消息"""
+        """发送消息；输入框保持可用，回复完成前发送下一句会取消上一轮"""
         user_input = self.input_field.text().strip()
         if not user_input:
             return
         
-        self.send_button.setEnabled(False)
-        self.input_field.setEnabled(False)
         self.input_field.clear()
         self.talk_manager.send_msg(user_input)
 
@@ -362,6 +368,27 @@ class DeskPetWindow(QWidget):
         """显示AI回复"""
         self.talk_manager.show_bubble(response)
 
+    @pyqtSlot()
+    def begin_ai_stream(self):
+        """开始流式显示AI回复"""
+        self.talk_manager.speech_bubble.begin_stream()
+
+    @pyqtSlot(str)
+    def stream_ai_delta(self, delta):
+        """追加流式收到的回复内容"""
+        self.talk_manager.speech_bubble.append_stream(delta)
+
+    @pyqtSlot()
+    def end_ai_stream(self):
+        """流式回复接收完毕"""
+        self.talk_manager.speech_bubble.end_stream()
+
+    @pyqtSlot()
+    def on_heart_changed(self):
+        """好感度判断完成后刷新表情"""
+        if self.animation_manager:
+            self.animation_manager.refresh_mood()
+
     @pyqtSlot()
     def on_talk_complete(self):
         """对话完成回调"""
@@ -408,8 +435,10 @@ class DeskPetWindow(QWidget):
             image_base64 = capture_screen_base64()
             self.animation_manager.set_thinking_state()
             
-            from threading import Thread
-            Thread(target=self._screen_analysis_thread, args=(image_base64,), daemon=True).start()
+            TaskExecutor.instance().submit(
+                "vision", self._screen_analysis_thread, image_base64,
+                on_done=self._on_screen_analyzed
+            )
         except Exception as e:
             error_msg = f"截图失败: {str(e)}"
             print(error_msg)
@@ -420,13 +449,14 @@ class DeskPetWindow(QWidget):
         analysis = self.vision_api.analyze_screen(image_base64)
         self.history_manager.add_talk("assistant", analysis)
         self.api.update_conversation_history()
-        
-        from PyQt5.QtCore import QMetaObject, Qt, Q_ARG
-        QMetaObject.invokeMethod(
-            self, "display_ai_response", 
-            Qt.QueuedConnection, 
-            Q_ARG(str, analysis)
-        )
+        return analysis
+
+    def _on_screen_analyzed(self, future):
+        """屏幕分析完成（主线程）"""
+        try:
+            self.display_ai_response(future.result())
+        except Exception as e:
+            self.talk_manager.show_bubble(f"识图失败: {str(e)}")
 
     def closeEvent(self, event):
         """窗口关闭事件"""
@@ -458,6 +488,7 @@ class DeskPetWindow(QWidget):
         
         # 清理对话状态
         if self.talk_manager:
+            self.talk_manager.cancel_pending()
             self.talk_manager.is_typing = False
 
         # 清理对话框
@@ -468,6 +499,15 @@ class DeskPetWindow(QWidget):
                 dlg.deleteLater()
                 setattr(self, dlg_name, None)
 
+        # 取消排队中的后台任务
+        TaskExecutor.instance().shutdown()
+
+        # 写入尚未落盘的历史记录和长期状态
+        if self.history_manager:
+            self.history_manager.close()
+        LongTermStateStore.instance().close()
+        SessionPool.instance().close()
+
         # 清理托盘
         if hasattr(self, 'tray_manager') and self.tray_manager:
             self.tray_manager.remove_tray_icon()
@@ -493,6 +533,8 @@ class DeskPetWindow(QWidget):
         """重新加载API配置"""
         try:
             # 只更新密钥等配置，保持历史记录和记忆
+            SessionPool.instance().reset()
+            RateLimiter.instance().reset()
             self._init_apis()
             print("API配置已重新加载")
         except Exception as e:
@@ -6,6 +6,7 @@ from PyQt5.QtWidgets import (
 from PyQt5.QtCore import Qt
 from utils.config import Config
 from utils.begin import DEFAULT_FAVORABILITY
+from utils.config_registry import ConfigRegistry, thaw
 from utils.autostart import set_autostart, is_autostart_enabled
 import json
 import os
@@ -225,7 +226,8 @@ class SettingsDialog(QDialog):
 
         defaults = {
             "chat_api": {"api_key": "", "api_url": "https://api.deepseek.com/v1/chat/completions",
-                        "model": "deepseek-chat", "temperature": 0.8, "max_tokens": 900, "stream": False},
+                        "model": "deepseek-chat", "temperature": 0.8, "max_tokens": 900, "stream": False,
+                        "combined_judge": False},
             "vision_api": {"api_key": "", "api_url": "https://api.siliconflow.cn/v1/chat/completions",
                           "model": "Pro/THUDM/GLM-4.1V-9B-Thinking", "temperature": 0.8, "max_tokens": 800}
         }
@@ -235,7 +237,7 @@ class SettingsDialog(QDialog):
         # 对话API
         layout.addWidget(QLabel("<b>对话API配置</b>"))
         self.chat_inputs = self._create_api_group(layout, self.api_data["chat_api"], 
-                                                  ["api_key", "api_url", "model", "temperature", "max_tokens", "stream"])
+                                                  ["api_key", "api_url", "model", "temperature", "max_tokens", "stream", "combined_judge"])
 
         layout.addSpacing(15)
         layout.addWidget(QLabel("<b>识图API配置</b>"))
@@ -252,7 +254,7 @@ class SettingsDialog(QDialog):
             hbox = QHBoxLayout()
             hbox.addWidget(QLabel(f"{field.replace('_', ' ').title()}:"))
             
-            if field == "stream":
+            if field in ["stream", "combined_judge"]:
                 cb = QCheckBox()
                 cb.setChecked(data.get(field, False))
                 hbox.addWidget(cb)
@@ -285,27 +287,24 @@ class SettingsDialog(QDialog):
         return inputs
 
     def _load_config(self, path, default):
-        """加载配置"""
-        full_path = Config.get_full_path(path) if not os.path.isabs(path) else path
-        if os.path.exists(full_path):
-            try:
-                with open(full_path, 'r', encoding='utf-8') as f:
-                    loaded = json.load(f)
-                    if isinstance(default, dict) and isinstance(loaded, dict):
-                        default_copy = default.copy()
-                        default_copy.update(loaded)
-                        return default_copy
-                    return loaded
-            except Exception as e:
-                print(f"加载配置失败 {path}: {e}")
-        return default
+        """加载配置（返回可修改的副本）"""
+        loaded = ConfigRegistry.instance().get(path)
+        if loaded is None:
+            return default
+        loaded = thaw(loaded)
+        if isinstance(default, dict) and isinstance(loaded, dict):
+            default_copy = default.copy()
+            default_copy.update(loaded)
+            return default_copy
+        return loaded
 
     def _save_config(self, path, data):
-        """保存配置"""
+        """保存配置，并更新共享的配置缓存"""
         full_path = Config.get_full_path(path) if not os.path.isabs(path) else path
         os.makedirs(os.path.dirname(full_path), exist_ok=True)
         with open(full_path, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
+        ConfigRegistry.instance().update(full_path, data)
 
     def _load_favorability(self, data):
         """加载好感度到表格"""
@@ -448,7 +447,10 @@ class SettingsDialog(QDialog):
                     data[k] = v.text().strip()
             return data
         
-        api_data = {"chat_api": extract(self.chat_inputs), "vision_api": extract(self.vision_inputs, False)}
+        # 在现有配置上合并，保留界面上没有的段和键（如 "http" 连接设置）
+        api_data = self._load_config(os.path.join("txt", "api.json"), {})
+        for section, inputs in [("chat_api", self.chat_inputs), ("vision_api", self.vision_inputs)]:
+            api_data[section] = {**api_data.get(section, {}), **extract(inputs)}
         
         try:
             self._save_config(os.path.join("txt", "api.json"), api_data)
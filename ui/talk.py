@@ -1,9 +1,13 @@
-from threading import Thread
-from PyQt5.QtCore import Qt, QTimer, QMetaObject, Q_ARG, QObject
+from PyQt5.QtCore import Qt, QTimer, QMetaObject, Q_ARG, QObject, pyqtSignal
 from PyQt5.QtGui import QFont, QColor, QPainter, QPainterPath
 from PyQt5.QtCore import QRectF
+from threading import Lock
 from PyQt5.QtWidgets import QLabel
 from core.heart import HeartManager
+from utils.metrics import LatencyTrace
+from utils.executor import TaskExecutor
+from api.api_client import CancelToken
+from api.errors import RequestCancelled
 
 class SpeechBubble(QLabel):
     """自定义对话气泡控件"""
@@ -34,6 +38,10 @@ class SpeechBubble(QLabel):
         self.paragraphs = []  # 存储分割后的段落
         self.current_paragraph_index = 0  # 当前段落索引
         
+        # 流式显示相关
+        self.streaming = False  # 是否仍在接收内容
+        self.stream_buffer = ""  # 已收到的全部文本
+        
         # 完成停留定时器
         self.wait_timer = QTimer(self)
         self.wait_timer.setSingleShot(True)
@@ -65,6 +73,7 @@ class SpeechBubble(QLabel):
 
     def setText(self, text):
         """逐字显示"""
+        self.streaming = False
         # 按换行分割文本，过滤空段落但保留格式
         self.paragraphs = [p.strip() for p in text.split('\n') if p.strip()]
         self.current_paragraph_index = 0
@@ -75,6 +84,37 @@ class SpeechBubble(QLabel):
         # 开始显示第一段
         self._start_paragraph()
 
+    def begin_stream(self):
+        """开始流式显示，之后通过 append_stream 逐段送入文本"""
+        self.type_timer.stop()
+        self.wait_timer.stop()
+        self.streaming = True
+        self.stream_buffer = ""
+        self.paragraphs = []
+        self.current_paragraph_index = 0
+        self.full_text = ""
+        self.current_text = ""
+        self.char_index = 0
+
+    def append_stream(self, delta):
+        """追加收到的文本，收到第一段内容时立即开始逐字显示"""
+        if not self.streaming:
+            return
+        self.stream_buffer += delta
+        self.paragraphs = [p.strip() for p in self.stream_buffer.split('\n') if p.strip()]
+        if self.paragraphs and not self.type_timer.isActive() and not self.full_text:
+            self._start_paragraph()
+
+    def end_stream(self):
+        """内容接收完毕，显示完剩余文字后按正常流程停留并隐藏"""
+        if not self.streaming:
+            return
+        self.streaming = False
+        if not self.paragraphs:
+            return
+        if not self.full_text:
+            self._start_paragraph()
+
     def _start_paragraph(self):
         """开始显示当前段落"""
         if self.current_paragraph_index >= len(self.paragraphs):
@@ -102,11 +142,22 @@ class SpeechBubble(QLabel):
 
     def _type_next_char(self):
         """显示下一个字符"""
+        if self.streaming and self.current_paragraph_index < len(self.paragraphs):
+            # 流式接收时当前段落可能还在变长
+            paragraph = self.paragraphs[self.current_paragraph_index]
+            if paragraph != self.full_text:
+                self.full_text = paragraph
+                self.adjust_size(self.full_text)
+                self.adjust_position()
+        
         if self.char_index < len(self.full_text):
             self.current_text += self.full_text[self.char_index]
             self.char_index += 1
             super().setText(self.current_text)
             self.update()
+        elif self.streaming and self.current_paragraph_index >= len(self.paragraphs) - 1:
+            # 已追上接收进度，等待后续内容
+            return
         else:
             # 当前段落显示完毕
             self.type_timer.stop()
@@ -210,6 +261,9 @@ class SpeechBubble(QLabel):
 class TalkManager(QObject):
     """对话管理器，处理所有对话相关的逻辑"""
     
+    # 工作线程发出的本轮界面更新：(本轮的 CancelToken, 主窗口方法名, 参数)
+    turn_update = pyqtSignal(object, str, tuple)
+    
     def __init__(self, api, history_manager, animation_manager, parent_window, memory_manager, heart_manager=None):
         super().__init__()
         self.api = api
@@ -226,6 +280,9 @@ class TalkManager(QObject):
         
         # 对话状态
         self.is_typing = False
+        self._cancel_token = None  # 当前进行中的对话请求
+        self._turn_lock = Lock()  # 取消与“检查未取消后提交结果”互斥
+        self.turn_update.connect(self._apply_turn_update)
     
     def show_bubble(self, text: str):
         """显示气泡"""
@@ -236,7 +293,8 @@ class TalkManager(QObject):
         self.speech_bubble.setText(text)
     
     def send_msg(self, user_input: str):
-        """处理发送消息"""
+        """处理发送消息，仍在进行的上一轮回复会被取消"""
+        self.cancel_pending()
         if self.is_typing:
             self.clear_current_display()
         if self.memory_manager:
@@ -250,8 +308,16 @@ class TalkManager(QObject):
             self.animation_manager.set_thinking_state()
         
         # 获取回复
-        thread = Thread(target=self._get_ai_response_thread, args=(user_input,), daemon=True)
-        thread.start()
+        self.is_typing = True
+        self._cancel_token = CancelToken()
+        TaskExecutor.instance().submit("chat", self._get_ai_response_thread, user_input, self._cancel_token)
+    
+    def cancel_pending(self):
+        """取消进行中的对话请求：中断连接，回复不再显示、不写入历史、也不判断好感度"""
+        with self._turn_lock:
+            if self._cancel_token is not None:
+                self._cancel_token.cancel()
+                self._cancel_token = None
     
     def _invoke_main_thread(self, method_name, *args):
         """在主线程调用方法"""
@@ -260,32 +326,113 @@ class TalkManager(QObject):
         else:
             QMetaObject.invokeMethod(self.parent_window, method_name, Qt.QueuedConnection, *[Q_ARG(str, arg) for arg in args])
     
+    def _invoke_turn(self, cancel_token, method_name, *args):
+        """在主线程调用主窗口的方法，到达时本轮已被取消则丢弃"""
+        self.turn_update.emit(cancel_token, method_name, args)
+    
+    def _apply_turn_update(self, cancel_token, method_name, args):
+        """
+        主线程中执行本轮的界面更新
+        
+        取消发生在主线程的 send_msg 中，且早于 clear_current_display，
+        因此取消前已排队、取消后才执行的更新在这里都会被丢弃，旧回复不会重新画到气泡上。
+        """
+        if cancel_token.cancelled:
+            return
+        getattr(self.parent_window, method_name)(*args)
+    
     def clear_current_display(self):
         """清除当前显示"""
         self.speech_bubble.type_timer.stop()
         self.speech_bubble.wait_timer.stop()
         # 重置段落状态
+        self.speech_bubble.streaming = False
         self.speech_bubble.paragraphs = []
         self.speech_bubble.current_paragraph_index = 0
         self.speech_bubble.hide()
         self.is_typing = False
 
-    def _get_ai_response_thread(self, user_input):
-        """获取回复并判断好感度"""
+    def _get_ai_response_thread(self, user_input, cancel_token):
+        """
+        获取回复并提交好感度判断
+        
+        回复一到就显示并写入历史，好感度判断提交到判断通道之后进行，
+        用户可见的等待只有一次请求。开启流式时边接收边显示，接收完毕后再写入历史。
+        用户在回复完成前发送新消息时 cancel_token 被取消，本轮直接放弃。
+        """
+        trace = LatencyTrace("对话")
+        streamed = []
+        
+        def on_delta(delta):
+            with self._turn_lock:
+                cancel_token.check()
+                if not streamed:
+                    trace.mark("首字")
+                    self._invoke_turn(cancel_token, "begin_ai_stream")
+                streamed.append(delta)
+                self._invoke_turn(cancel_token, "stream_ai_delta", delta)
+        
+        # 合并判断模式：一次请求同时拿到回复和好感度变化
+        combined = self.api.combined_judge and self.api.heart_manager is not None
+        change = None
         try:
-            response = self.api.get_response(user_input)
-            self.history_manager.add_talk("assistant", response)
-            
-            # 判断好感度变化
-            change = self.heart.judge_change(user_input, response)
+            stream_callback = on_delta if self.api.stream else None
+            if combined:
+                response, change = self.api.get_response_with_judge(
+                    user_input, on_delta=stream_callback, cancel_token=cancel_token, interactive=True
+                )
+            else:
+                response = self.api.get_response(
+                    user_input, on_delta=stream_callback, cancel_token=cancel_token, interactive=True
+                )
+        except RequestCancelled:
+            # 已被新一轮对话取代，界面状态由新一轮负责
+            print("[对话] 上一轮回复已取消")
+            return
+        except Exception as e:
+            with self._turn_lock:
+                if not cancel_token.cancelled:
+                    self._invoke_turn(cancel_token, "display_ai_response", f"获取回复时出错: {str(e)}")
+                    self._finish_turn(cancel_token)
+            return
+        
+        # 检查取消和提交结果在同一把锁内完成，send_msg 不会在两者之间取消本轮
+        with self._turn_lock:
+            if cancel_token.cancelled:
+                print("[对话] 上一轮回复已取消")
+                return
+            # 在主线程显示回复（流式时已经显示）
+            if streamed:
+                self._invoke_turn(cancel_token, "end_ai_stream")
+            else:
+                self._invoke_turn(cancel_token, "display_ai_response", response)
+            trace.mark("回复显示")
+            talk_id = self.history_manager.add_talk("assistant", response)
+            self._finish_turn(cancel_token)
+            TaskExecutor.instance().submit(
+                "judge", self._judge_favorability, user_input, response, talk_id, change, trace
+            )
+    
+    def _finish_turn(self, cancel_token):
+        """本轮结束，通知主窗口（调用方需持有 _turn_lock，已被取代的轮次不处理）"""
+        if not cancel_token.cancelled:
+            self.is_typing = False
+            # 结果已经提交，之后发送的消息不再取消本轮，排队中的显示照常执行
+            if self._cancel_token is cancel_token:
+                self._cancel_token = None
+            self._invoke_turn(cancel_token, "on_talk_complete")
+    
+    def _judge_favorability(self, user_input, response, talk_id, change, trace):
+        """判断好感度变化，结果出来后再更新分数和表情；合并模式下回复没带标记时退回单独判断"""
+        try:
+            if change is None:
+                change = self.heart.judge_change(user_input, response)
+            trace.mark("好感度判断")
             if change is not None:
                 self.heart.update(change)
-                self.heart.log_heart_change_to_last_talk(change)
-            
-            # 在主线程显示回复
-            self._invoke_main_thread("display_ai_response", response)
+                self.heart.log_heart_change_to_last_talk(change, self.history_manager, talk_id)
+                self._invoke_main_thread("on_heart_changed")
         except Exception as e:
-            self._invoke_main_thread("display_ai_response", f"获取回复时出错: {str(e)}")
+            print(f"好感度判断失败: {e}")
         finally:
-            self.is_typing = False
-            self._invoke_main_thread("on_talk_complete")
\ No newline at end of file
+            trace.finish()
\ No newline at end of file
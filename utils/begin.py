@@ -30,12 +30,11 @@ DEFAULT_CHARACTER = {
 
 DEFAULT_LONG_MEMORY = {
     "processed_count": 0,
+    "processed_id": -1,
     "memories": [],
     "favorability": 0
 }
 
-DEFAULT_HISTORY = []
-
 DEFAULT_SYSTEM_SETTINGS = {
     "scale": 100,
     "always_on_top": True,
@@ -49,7 +48,8 @@ DEFAULT_API_CONFIG = {
         "model": "deepseek-chat",
         "temperature": 0.8,
         "max_tokens": 900,
-        "stream": False
+        "stream": False,
+        "combined_judge": False
     },
     "vision_api": {
         "api_key": "",
@@ -57,6 +57,22 @@ DEFAULT_API_CONFIG = {
         "model": "Pro/THUDM/GLM-4.1V-9B-Thinking",
         "temperature": 0.8,
         "max_tokens": 800
+    },
+    "http": {
+        "pool_size": 4,
+        "connect_timeout": 5,
+        "read_timeout": 30
+    },
+    "retry": {
+        "max_attempts": 3,
+        "base_delay": 0.5,
+        "max_delay": 8,
+        "deadline": 60
+    },
+    "rate_limit": {
+        "rpm": 60,
+        "tpm": 0,
+        "background_reserve": 0.2
     }
 }
 
@@ -175,10 +191,11 @@ def ensure_long_memory():
 
 
 def ensure_history():
-    """确保 talk_log.json（对话历史）存在"""
-    exists = ensure_json_file(Config.HISTORY_FILE, DEFAULT_HISTORY, "对话历史文件")
+    """确保 log/talks（按天分段的对话历史）目录存在，旧版 talk_log.json 由历史存储首次加载时迁移"""
+    exists = os.path.exists(Config.HISTORY_DIR)
     if not exists:
-        print("✓ 已生成默认空历史记录")
+        os.makedirs(Config.HISTORY_DIR, exist_ok=True)
+        print("✓ 已生成对话历史目录")
     return exists
 
 
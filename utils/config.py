@@ -4,7 +4,9 @@ import sys
 class Config:
     """配置类"""
     # 记忆系统配置
-    MAX_HISTORY_MESSAGES = 20  # 短期记忆最大条数
+    MAX_HISTORY_MESSAGES = 20  # 短期记忆最大条数（每次整理记忆的批量）
+    CONTEXT_MAX_MESSAGES = 60  # 上下文窗口最多保留的消息条数，实际发送多少由词元预算决定
+    CONTEXT_TOKEN_BUDGET = 8000  # 每次对话请求的词元上限（系统提示+历史+输入+预留回复）
     LONG_TERM_MEMORY_LIMIT = 20  # 长期记忆最大条数
     COMPRESSED_MEMORY_RANGE = (5, 10)  # 压缩后的长期记忆保留范围
     MAX_MEMORY_LENGTH = 15  # 单条记忆最大字数
@@ -23,7 +25,27 @@ class Config:
     CHARACTER_FILE = os.path.join(BASE_PATH, "txt", "character.json")
     USER_INFO_FILE = os.path.join(BASE_PATH, "txt", "user_info.json")
     SETTING_FILE = os.path.join(BASE_PATH, "txt", "setting.json")
-    HISTORY_FILE = os.path.join(BASE_PATH, "log", "talk_log.json")
+    HISTORY_FILE = os.path.join(BASE_PATH, "log", "talk_log.json")  # 旧版单文件历史，仅用于迁移
+    HISTORY_DIR = os.path.join(BASE_PATH, "log", "talks")
+    HISTORY_DB_FILE = os.path.join(BASE_PATH, "log", "talk_log.db")
+    TOKEN_VOCAB_FILE = os.path.join(BASE_PATH, "txt", "token_vocab.txt")  # 可选词表，用于更准确地估算词元数
+    
+    # 历史记录存储后端："journal"（按天分段的JSON快照+追加日志）或 "sqlite"（带日期和全文索引）
+    HISTORY_BACKEND = "journal"
+    
+    # 历史记录日志合并设置
+    HISTORY_COMPACT_THRESHOLD = 200  # 日志累计多少条记录后合并进分段文件
+    HISTORY_COMPACT_INTERVAL = 60  # 后台定时合并间隔（秒）
+    HISTORY_ARCHIVE_DAYS = 30  # 早于多少天且已整理进长期记忆的历史压缩归档
+    
+    # 系统提示片段顺序："stable_first"（情感状态放最后，利于前缀缓存）或 "classic"（旧版顺序）
+    PROMPT_ORDER = "stable_first"
+    
+    # 后台任务设置
+    BACKGROUND_CONCURRENCY = 2  # 非交互任务（识图、好感度判断、记忆整理、报时）同时进行的请求上限
+    
+    # 后台写入设置
+    SAVE_COALESCE_DELAY = 0.25  # 合并写入窗口（秒），窗口内的多次变更只落盘一次
     
     @classmethod
     def get_full_path(cls, relative_path):
@@ -0,0 +1,105 @@
+import json
+import os
+from threading import Lock
+from types import MappingProxyType
+from utils.config import Config
+
+
+def freeze(value):
+    """把解析出的 JSON 转换为只读结构：字典变为 MappingProxyType，列表变为元组"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def thaw(value):
+    """把只读配置转换回普通的字典和列表（需要修改或写回文件时使用）"""
+    if isinstance(value, (dict, MappingProxyType)):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(item) for item in value]
+    return value
+
+
+class ConfigRegistry:
+    """
+    txt/ 下 JSON 配置的共享缓存
+
+    每个文件只解析一次，之后每次读取只检查修改时间和大小，文件在外部被改动时自动重新解析。
+    返回的配置是只读的（见 freeze），多个调用方和线程可以直接共享。
+    设置界面保存配置后调用 update()，新内容立即生效而不必重新读盘。
+    通过 instance() 获取共享实例。
+    """
+
+    _instance = None
+    _instance_lock = Lock()
+
+    @classmethod
+    def instance(cls):
+        """获取进程内共享的实例"""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def __init__(self):
+        self.lock = Lock()
+        self._entries = {}  # 完整路径 -> (文件签名, 只读配置)
+
+    @staticmethod
+    def _signature(full_path):
+        """文件签名（修改时间, 大小），文件不存在时抛出 FileNotFoundError"""
+        stat = os.stat(full_path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def load(self, path):
+        """
+        读取配置，文件没有变化时直接返回缓存
+
+        Raises:
+            FileNotFoundError: 文件不存在
+            json.JSONDecodeError: 文件内容不是合法的 JSON
+        """
+        full_path = Config.get_full_path(path)
+        signature = self._signature(full_path)
+        with self.lock:
+            entry = self._entries.get(full_path)
+            if entry is not None and entry[0] == signature:
+                return entry[1]
+
+        with open(full_path, 'r', encoding='utf-8') as f:
+            data = freeze(json.load(f))
+        with self.lock:
+            self._entries[full_path] = (signature, data)
+        return data
+
+    def get(self, path, default=None):
+        """读取配置，文件不存在或解析失败时返回 default"""
+        try:
+            return self.load(path)
+        except FileNotFoundError:
+            return default
+        except Exception as e:
+            print(f"加载配置失败 {path}: {e}")
+            return default
+
+    def update(self, path, data):
+        """文件刚被写入 data 后调用，直接更新缓存"""
+        full_path = Config.get_full_path(path)
+        try:
+            signature = self._signature(full_path)
+        except OSError:
+            self.invalidate(path)
+            return
+        with self.lock:
+            self._entries[full_path] = (signature, freeze(data))
+
+    def invalidate(self, path=None):
+        """丢弃某个文件（不指定时为全部）的缓存，下次读取时重新解析"""
+        with self.lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(Config.get_full_path(path), None)
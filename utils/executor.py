@@ -0,0 +1,149 @@
+import heapq
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Lock
+from PyQt5.QtCore import QObject, pyqtSignal
+from utils.config import Config
+
+# 任务通道：名称 -> (优先级（越小越优先）, 并发上限)
+LANES = {
+    "chat": (0, 2),  # 对话回复（交互）
+    "vision": (1, 1),  # 识图
+    "judge": (2, 1),  # 好感度判断
+    "memory": (3, 1),  # 记忆整理
+    "announce": (4, 1),  # 整点报时
+}
+
+# 交互通道独占自己的线程，不占用后台额度，后台任务再多也不会让对话排队
+INTERACTIVE_LANES = {"chat"}
+
+
+class _PriorityGate:
+    """按优先级分配的并发额度：有空位时总是先放行优先级最高、到得最早的任务"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self._waiting = []
+        self._seq = itertools.count()
+        self._cond = Condition()
+
+    def acquire(self, priority):
+        with self._cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._waiting, ticket)
+            while self.active >= self.limit or self._waiting[0] != ticket:
+                self._cond.wait()
+            heapq.heappop(self._waiting)
+            self.active += 1
+            self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+
+class _Notifier(QObject):
+    """把任务完成通知转到主线程"""
+    finished = pyqtSignal(object, object)
+
+    def __init__(self):
+        super().__init__()
+        self.finished.connect(self._deliver)
+
+    def _deliver(self, callback, future):
+        try:
+            callback(future)
+        except Exception as e:
+            print(f"任务完成回调失败: {e}")
+
+
+class TaskExecutor:
+    """
+    后台任务执行器
+
+    所有后台工作（对话、识图、好感度判断、记忆整理、整点报时）按通道提交，
+    每个通道有独立的线程池和并发上限；非交互通道还共享 Config.BACKGROUND_CONCURRENCY
+    个并发额度，按优先级获取，从而限制同时发出的请求数量。
+    submit 返回 concurrent.futures.Future，可选的 on_done 回调在主线程（Qt 事件循环）中执行。
+    通过 instance() 获取共享实例，需先在主线程中创建。
+    """
+
+    _instance = None
+    _instance_lock = Lock()
+
+    @classmethod
+    def instance(cls):
+        """获取进程内共享的实例"""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def __init__(self):
+        self.lock = Lock()
+        self._pools = {
+            lane: ThreadPoolExecutor(max_workers=limit, thread_name_prefix=f"Task-{lane}")
+            for lane, (_, limit) in LANES.items()
+        }
+        self._gate = _PriorityGate(Config.BACKGROUND_CONCURRENCY)
+        self._queued = {lane: 0 for lane in LANES}
+        self._running = {lane: 0 for lane in LANES}
+        self._notifier = _Notifier()
+        self._closed = False
+
+    def submit(self, lane, fn, *args, on_done=None, **kwargs):
+        """
+        向指定通道提交任务
+
+        Args:
+            lane: LANES 中的通道名
+            on_done: 可选，任务结束后在主线程调用 on_done(future)
+
+        Returns:
+            Future: 执行器已关闭时返回 None
+        """
+        with self.lock:
+            if self._closed:
+                return None
+            self._queued[lane] += 1
+            queued = self._queued[lane] - 1
+        if queued:
+            print(f"[任务] {lane} 通道排队中：前面还有{queued}个任务")
+
+        future = self._pools[lane].submit(self._run, lane, fn, args, kwargs)
+        if on_done is not None:
+            future.add_done_callback(lambda f: self._notifier.finished.emit(on_done, f))
+        return future
+
+    def _run(self, lane, fn, args, kwargs):
+        """在通道线程中执行任务，非交互通道先获取后台额度"""
+        background = lane not in INTERACTIVE_LANES
+        if background:
+            self._gate.acquire(LANES[lane][0])
+        with self.lock:
+            self._queued[lane] -= 1
+            self._running[lane] += 1
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            print(f"[任务] {lane} 通道任务失败: {e}")
+            raise
+        finally:
+            with self.lock:
+                self._running[lane] -= 1
+            if background:
+                self._gate.release()
+
+    def stats(self):
+        """各通道的运行中和排队中任务数"""
+        with self.lock:
+            return {lane: {"running": self._running[lane], "queued": self._queued[lane]} for lane in LANES}
+
+    def shutdown(self):
+        """取消排队中的任务并停止接收新任务（程序退出时调用），不等待正在进行的请求"""
+        with self.lock:
+            self._closed = True
+        for pool in self._pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -1,13 +1,14 @@
 import os
 import json
 from utils.config import Config
+from utils.config_registry import ConfigRegistry
 
 class BaseLoader:
     """通用文件加载基类"""
     
     @staticmethod
     def load_file(file_path, file_type='text', default=None):
-        """通用文件加载方法"""
+        """通用文件加载方法，JSON 文件经 ConfigRegistry 缓存并以只读形式返回"""
         try:
             if not os.path.isabs(file_path):
                 file_path = Config.get_full_path(file_path)
@@ -17,8 +18,7 @@ class BaseLoader:
                 return default
             
             if file_type == 'json':
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                return ConfigRegistry.instance().load(file_path)
             else:
                 with open(file_path, 'r', encoding='utf-8') as f:
                     return f.read()
@@ -38,6 +38,7 @@ class BaseLoader:
             if file_type == 'json':
                 with open(file_path, 'w', encoding='utf-8') as f:
                     json.dump(data, f, ensure_ascii=False, indent=2)
+                ConfigRegistry.instance().update(file_path, data)
             else:
                 with open(file_path, 'w', encoding='utf-8') as f:
                     f.write(data)
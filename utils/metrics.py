@@ -0,0 +1,111 @@
+import time
+from threading import Lock
+
+
+class LatencyTrace:
+    """
+    单次操作的延迟追踪
+
+    创建时开始计时，在关键节点调用 mark() 记录相对起点的耗时，finish() 时打印一行汇总，例如：
+        [延迟] 对话 | 首字 820ms | 回复显示 2310ms | 好感度判断 3650ms
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.perf_counter()
+        self.marks = []
+
+    def mark(self, label):
+        """记录一个节点，返回相对起点的毫秒数"""
+        elapsed = (time.perf_counter() - self.start) * 1000
+        self.marks.append((label, elapsed))
+        return elapsed
+
+    def elapsed(self, label):
+        """某个节点的耗时（毫秒），未记录时返回 None"""
+        for mark_label, elapsed in self.marks:
+            if mark_label == label:
+                return elapsed
+        return None
+
+    def finish(self):
+        """打印汇总"""
+        parts = " | ".join(f"{label} {elapsed:.0f}ms" for label, elapsed in self.marks)
+        print(f"[延迟] {self.name} | {parts}")
+
+
+def parse_usage(usage):
+    """
+    把接口返回的 usage 段统一为 (输入, 输出, 缓存命中, 缓存未命中) 词元数
+
+    兼容 DeepSeek 的 prompt_cache_hit_tokens / prompt_cache_miss_tokens
+    和 OpenAI 风格的 prompt_tokens_details.cached_tokens，缺少缓存信息时命中数为 None。
+    """
+    prompt = usage.get("prompt_tokens") or 0
+    completion = usage.get("completion_tokens") or 0
+    hit = usage.get("prompt_cache_hit_tokens")
+    miss = usage.get("prompt_cache_miss_tokens")
+    if hit is None:
+        hit = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+    if hit is not None and miss is None:
+        miss = prompt - hit
+    return prompt, completion, hit, miss
+
+
+class UsageStats:
+    """
+    词元用量与前缀缓存命中统计
+
+    每次请求结束后调用 record()，打印一行用量日志并累计缓存命中率，例如：
+        [用量] deepseek-chat | 输入 1830（缓存命中 1664 / 未命中 166，91%） | 输出 42 | 累计命中率 87%
+    通过 instance() 获取共享实例。
+    """
+
+    _instance = None
+    _instance_lock = Lock()
+
+    @classmethod
+    def instance(cls):
+        """获取进程内共享的实例"""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def __init__(self):
+        self.lock = Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cache_hit_tokens = 0
+        self.cache_miss_tokens = 0
+
+    def record(self, label, usage):
+        """记录一次请求的 usage 段并打印日志"""
+        prompt, completion, hit, miss = parse_usage(usage)
+        with self.lock:
+            self.requests += 1
+            self.prompt_tokens += prompt
+            self.completion_tokens += completion
+            if hit is not None:
+                self.cache_hit_tokens += hit
+                self.cache_miss_tokens += miss
+            total_rate = self._hit_rate()
+
+        if hit is None:
+            cache = ""
+        else:
+            rate = hit / (hit + miss) if hit + miss else 0
+            cache = f"（缓存命中 {hit} / 未命中 {miss}，{rate:.0%}）"
+        total = f" | 累计命中率 {total_rate:.0%}" if total_rate is not None else ""
+        print(f"[用量] {label} | 输入 {prompt}{cache} | 输出 {completion}{total}")
+
+    def _hit_rate(self):
+        """累计缓存命中率（调用方需持有 lock）"""
+        cached = self.cache_hit_tokens + self.cache_miss_tokens
+        return self.cache_hit_tokens / cached if cached else None
+
+    def hit_rate(self):
+        """累计缓存命中率，还没有缓存信息时返回 None"""
+        with self.lock:
+            return self._hit_rate()